@@ -0,0 +1,283 @@
+'''
+Comparison of the statistics of several simulations.
+
+A ComparisonDatabase exposes the tables stored in the results databases
+(see datavis_results_db) of several simulation homes. For each table
+stored by the simulations, there is a relation by the same name with an
+extra column sim, identifying the simulation of each row. Therefore, the
+usual make_plot/Graph machinery can draw one graph per simulation, by
+using sim as an axis.
+
+Up to MAX_ATTACHED simulations, the results databases are ATTACHed and
+each relation is a (temporary) view, the UNION ALL of the simulation
+tables; nothing is copied. For more simulations, the tables are copied,
+one simulation at a time, into a temporary database file. Either way,
+the data never has to fit in memory.
+
+The module can also be run from the command line, e.g.
+
+    python3 -m datavis.compare --executor local sim_abc sim_def --sql "SELECT sim, AVG(data) ..."
+    python3 -m datavis.compare SIMOUTPUT:local:sim_abc SIMOUTPUT:local:sim_def \\
+        --plot node data --select "name=Consumed Energy"
+'''
+
+import argparse
+import csv
+import logging
+import os
+import sqlite3 as sql
+import sys
+import tempfile
+
+from models.nsdplot import Column
+from models.validation import fail
+from datavis.database import Dataset, Attribute, Table, View, RESULTS_DB_FILE
+from datavis.create_plot import make_plot, PNG
+
+
+# SQLite's default limit on the number of attached databases
+MAX_ATTACHED = 10
+
+SIMID_PREFIX = "SIMOUTPUT:"
+
+
+def executor_homedir(executor):
+    """
+    Return the directory where the named executor stores simulation homes.
+    """
+    from runner.config import executor_init
+    for name, cls, homedir, args in executor_init():
+        if name == executor:
+            return homedir
+    fail("Unknown executor \"%s\"" % executor)
+
+
+def resolve_simhome(spec, executor=None):
+    """
+    Return the simulation home for spec, which is either a project repository
+    simulation id (SIMOUTPUT:<executor>:<simhome>), the basename of a simulation
+    home of the given executor, or a path.
+    """
+    if spec.startswith(SIMID_PREFIX):
+        from runner.DAO import SimJob    # needs psycopg2, like the rest of the runner
+        xtor, bname = SimJob.break_simid(spec)
+        return os.path.join(executor_homedir(xtor), bname)
+    if executor is not None:
+        return os.path.join(executor_homedir(executor), spec)
+    return spec
+
+
+def sql_string(value):
+    """Return an SQL string literal for value"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def stored_tables(dbfile):
+    """
+    Return a list of (table name, attribute list) for the tables stored in
+    a results database file.
+    """
+    conn = sql.connect(dbfile)
+    try:
+        names = [row[0] for row in conn.execute("SELECT tablename FROM datavis_sources ORDER BY tablename")]
+        return [(name, [Attribute(col[1], col[2]) for col in conn.execute("PRAGMA table_info(%s)" % name)])
+                for name in names]
+    except sql.Error as ex:
+        fail("Cannot read results database %s: %s" % (dbfile, ex))
+    finally:
+        conn.close()
+
+
+class ComparisonDatabase(Dataset):
+    """
+    A Dataset over the results databases of several simulation homes.
+
+    simhomes is the list of simulation homes, labels is the list of values
+    of the sim column for each of them (by default, the basename of the home).
+    """
+
+    def __init__(self, simhomes, labels=None):
+        if labels is None:
+            labels = [os.path.basename(os.path.normpath(home)) for home in simhomes]
+        if len(labels) != len(simhomes):
+            fail("There must be one label per simulation")
+        if len(set(labels)) != len(labels):
+            fail("Simulation labels must be distinct")
+
+        self.simhomes = list(simhomes)
+        self.labels = list(labels)
+        self.dbfiles = []
+        for home in self.simhomes:
+            dbfile = os.path.join(home, RESULTS_DB_FILE)
+            if not os.path.isfile(dbfile):
+                fail("There is no results database in %s (enable datavis_results_db and re-run the "
+                     "finish stage of the simulation)" % home)
+            self.dbfiles.append(dbfile)
+
+        self.attached = len(self.dbfiles) <= MAX_ATTACHED
+        self.tmpfile = None
+        if self.attached:
+            Dataset.__init__(self)
+        else:
+            fd, self.tmpfile = tempfile.mkstemp(suffix=".sqlite", prefix="datavis_compare_")
+            os.close(fd)
+            Dataset.__init__(self, self.tmpfile)
+
+        self.__create_relations()
+
+    def __common_tables(self):
+        """
+        Return a list of (table name, attribute list, list of simulation positions)
+        for each table stored by some simulation. The attributes are the ones common
+        to all simulations storing the table.
+        """
+        tables = {}
+        order = []
+        for pos, dbfile in enumerate(self.dbfiles):
+            for name, alist in stored_tables(dbfile):
+                if name not in tables:
+                    tables[name] = (alist, [pos])
+                    order.append(name)
+                else:
+                    names = {a.name for a in alist}
+                    common = [a for a in tables[name][0] if a.name in names]
+                    tables[name] = (common, tables[name][1] + [pos])
+
+        result = []
+        for name in order:
+            alist, sims = tables[name]
+            if len(sims) != len(self.dbfiles):
+                logging.warning("Table %s is missing from simulations %s", name,
+                                ", ".join(self.labels[pos] for pos in range(len(self.dbfiles)) if pos not in sims))
+            if any(a.name == "sim" for a in alist):
+                logging.warning("Table %s has a column named sim, it is skipped", name)
+                continue
+            result.append((name, alist, sims))
+        return result
+
+    def __create_relations(self):
+        tables = self.__common_tables()
+
+        if self.attached:
+            for pos, dbfile in enumerate(self.dbfiles):
+                self.conn.execute("ATTACH DATABASE ? AS sim%d" % pos, (dbfile,))
+
+        for name, alist, sims in tables:
+            columns = ",".join(a.name for a in alist)
+            full_alist = [Attribute("sim", "VARCHAR")] + alist
+            if self.attached:
+                qry = " UNION ALL ".join("SELECT %s AS sim,%s FROM sim%d.%s" % (sql_string(self.labels[pos]),
+                                                                                columns, pos, name)
+                                         for pos in sims)
+                self.conn.execute("CREATE TEMP VIEW %s AS %s" % (name, qry))
+                view = self.add(View(name, qry), create=False)
+                view.set_attributes(full_alist)
+            else:
+                self.add(Table(name, full_alist))
+                for pos in sims:
+                    self.conn.execute("ATTACH DATABASE ? AS sim", (self.dbfiles[pos],))
+                    try:
+                        self.conn.execute("INSERT INTO %s(sim,%s) SELECT ?,%s FROM sim.%s" %
+                                          (name, columns, columns, name), (self.labels[pos],))
+                        self.conn.commit()
+                    finally:
+                        self.conn.execute("DETACH DATABASE sim")
+                self.conn.execute("CREATE INDEX %s_sim ON %s(sim)" % (name, name))
+                self.conn.commit()
+            logging.info("Comparison relation %s over %d simulations", name, len(sims))
+
+    def close(self):
+        self.conn.close()
+        if self.tmpfile is not None:
+            os.remove(self.tmpfile)
+            self.tmpfile = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+def compare_plot(cdb, x, y, select={}, axes=None, table="dataTable", **kwargs):
+    """
+    Return a Plot of y over x, from relation table of ComparisonDatabase cdb,
+    with one graph per simulation (and per value of any further axes).
+    The remaining arguments are passed to make_plot.
+    """
+    return make_plot(cdb.relations[table], (Column(x),), (Column(y),), ["sim"] + list(axes or []), select,
+                     **kwargs)
+
+
+def parse_select(items):
+    """
+    Parse a list of "attribute=value" strings into a select dict. Numeric values
+    are converted to numbers.
+    """
+    select = {}
+    for item in items:
+        attr, sep, value = item.partition("=")
+        if not sep:
+            fail("Bad selection \"%s\", expected attribute=value" % item)
+        try:
+            select[attr] = int(value)
+        except ValueError:
+            try:
+                select[attr] = float(value)
+            except ValueError:
+                select[attr] = value
+    return select
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='''
+    Compare the statistics of several simulations. Each simulation is given by its
+    project repository id (SIMOUTPUT:<executor>:<simhome>), by its simulation home
+    basename (with --executor), or by the path of its simulation home. The simulations
+    must have been run with datavis_results_db enabled.
+
+    Without --sql or --plot, the scheme of each comparison relation is printed.
+    ''')
+    parser.add_argument("simulations", nargs="+", help="The simulations to compare")
+    parser.add_argument("--executor", help="The executor of the simulation homes")
+    parser.add_argument("--label", action="append", default=None,
+                        help="The value of the sim column for each simulation (repeated, in order)")
+    parser.add_argument("--config", help="Path to the configuration file", default=None)
+    parser.add_argument("--sql", help="Run the query and print its results as CSV")
+    parser.add_argument("--plot", nargs=2, metavar=("X", "Y"), help="Plot Y over X, with one graph per simulation")
+    parser.add_argument("--table", default="dataTable", help="The relation to plot from (default: dataTable)")
+    parser.add_argument("--select", action="append", default=[], metavar="ATTR=VALUE",
+                        help="Restrict the plotted rows (repeated)")
+    parser.add_argument("--axes", nargs="*", default=[], help="Further axes, beside sim")
+    parser.add_argument("--style", default="linespoints", help="The gnuplot style of the graphs")
+    parser.add_argument("--output", default=None, help="The base name of the plot file")
+    args = parser.parse_args(argv)
+
+    if args.executor or any(s.startswith(SIMID_PREFIX) for s in args.simulations):
+        from runner.config import configure
+        configure("datavis", args.config)
+
+    simhomes = [resolve_simhome(s, args.executor) for s in args.simulations]
+    with ComparisonDatabase(simhomes, args.label) as cdb:
+        if args.sql:
+            writer = csv.writer(sys.stdout)
+            for row in cdb.conn.execute(args.sql):
+                writer.writerow(row)
+        elif args.plot:
+            kwargs = {"style": args.style, "terminal": PNG()}
+            if args.output:
+                kwargs["output"] = args.output
+            plot = compare_plot(cdb, args.plot[0], args.plot[1], parse_select(args.select), args.axes,
+                                args.table, **kwargs)
+            if not plot.make_plot():
+                return 1
+            print(plot.output + ".png")
+        else:
+            for name in sorted(cdb.relations):
+                print(cdb.relations[name].scheme())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,125 +4,476 @@ Created on Jan 19, 2015
 @author: GeoMSK
 '''
 import logging
-from subprocess import PIPE, Popen
+import queue
+import threading
+import time
+from subprocess import PIPE, DEVNULL, Popen, TimeoutExpired
 from datavis.database import Relation
-from models.validation import warn, fail
+from models.validation import warn, fail, inform
 import traceback
 import re
 import os
+from itertools import chain, groupby, islice
+from tempfile import SpooledTemporaryFile
 from models.validation import CheckFail
+from runner.config import datavis_renderer, datavis_max_points
 
 
-class StatBreakdownHelper:
+# the time allowed to gnuplot for rendering a single plot, in seconds
+# vsam: changed timeout to 10 sec (it was 0.2 but I was getting timeouts)
+PLOT_TIMEOUT = 10
+
+# the number of lines in each chunk of the inline data of gnuplot scripts
+DATA_CHUNK_LINES = 1000
+
+# the maximum number of graphs of a histogram (each one is a column of the pivot query)
+MAX_HISTOGRAM_GRAPHS = 1000
+
+# scripts kept for replay are held in memory up to this size, else in a temporary file
+SCRIPT_SPOOL_SIZE = 1 << 20
+
+
+def gnuplot_block(lines):
+    """
+    Generate a block of gnuplot inline data, terminated by "end", from the given
+    lines, in chunks of DATA_CHUNK_LINES lines. Nothing is generated if there are no lines.
+    """
+    lines = iter(lines)
+    empty = True
+    while True:
+        chunk = list(islice(lines, DATA_CHUNK_LINES))
+        if not chunk:
+            break
+        empty = False
+        yield "\n".join(chunk) + "\n"
+    if not empty:
+        yield "end\n"
+
+
+def decimate(rows, max_points):
+    """
+    Reduce a series of (x, y) rows, ordered by x, to at most max_points rows, by
+    min/max bucketing: the rows are split into buckets of consecutive rows, and only
+    the rows with the minimum and the maximum y of each bucket are kept, in order.
+    Rows with a NULL (None) y have no point to draw, and are dropped.
+
+    The rows are read in a single pass, holding about max_points rows: whenever
+    there are too many buckets, adjacent buckets are merged, doubling the bucket size.
+    Series of up to max_points rows are returned unchanged. max_points must be at least 2.
+    Return the list of kept rows and the number of rows read.
+    """
+    if max_points < 2:
+        raise ValueError("cannot decimate to less than 2 points per graph")
+    rows = iter(rows)
+    head = list(islice(rows, max_points + 1))
+    if len(head) <= max_points:
+        return head, len(head)
+
+    nbuckets = max_points // 2
+    size = 1
+    # each bucket is [(position, row with min y), (position, row with max y)]
+    buckets = []
+    count = 0
+    # the number of rows with a y value
+    pos = 0
+    for row in chain(head, rows):
+        count += 1
+        if row[1] is None:
+            continue
+        if pos % size == 0:
+            buckets.append([(pos, row), (pos, row)])
+        else:
+            b = buckets[-1]
+            if row[1] < b[0][1][1]: b[0] = (pos, row)
+            if row[1] > b[1][1][1]: b[1] = (pos, row)
+        pos += 1
+        if len(buckets) > nbuckets:
+            merged = []
+            for i in range(0, len(buckets), 2):
+                pair = buckets[i:i+2]
+                merged.append([min((b[0] for b in pair), key=lambda p: p[1][1]),
+                               max((b[1] for b in pair), key=lambda p: p[1][1])])
+            buckets = merged
+            size *= 2
+
+    kept = []
+    for lo, hi in buckets:
+        kept.extend(row for pos, row in sorted({lo, hi}, key=lambda p: p[0]))
+    return kept, count
+
+
+class Script:
+    """
+    A gnuplot script with inline data, generated in chunks, so that the data
+    never has to be held in memory as a whole.
+
+    A script is generated once. If keep() is called before that, the chunks are
+    also kept (in a temporary file, if they are large), so that the script can
+    be iterated over again.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.spool = None
+        self.generated = False
+
+    def keep(self):
+        if self.spool is None:
+            self.spool = SpooledTemporaryFile(max_size=SCRIPT_SPOOL_SIZE, mode="w+")
+
+    def __iter__(self):
+        if not self.generated:
+            self.generated = True
+            for chunk in self.chunks:
+                if self.spool is not None:
+                    self.spool.write(chunk)
+                yield chunk
+        elif self.spool is not None:
+            self.spool.seek(0)
+            for chunk in iter(lambda: self.spool.read(SCRIPT_SPOOL_SIZE), ""):
+                yield chunk
+        else:
+            raise RuntimeError("gnuplot script already generated")
+
+    def __str__(self):
+        self.keep()
+        return "".join(self)
+
+
+class GnuplotSession:
+    """
+    A gnuplot process which renders a sequence of plots, so that a process
+    is not started for every plot.
+
+    Each script is followed by a command printing a marker to stderr; the
+    output of gnuplot up to the marker is the output of that script. If gnuplot
+    exits (e.g., on an error) or times out, it is restarted for the next plot.
+
+    It is used as a context manager, closing the process on exit.
+    """
+
+    def __init__(self, gnuplot="gnuplot", timeout=PLOT_TIMEOUT):
+        self.gnuplot = gnuplot
+        self.timeout = timeout
+        self.process = None
+        self.lines = None
+        self.plots = 0
+        self.restarts = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def __start(self):
+        if self.plots:
+            self.restarts += 1
+        self.process = Popen(self.gnuplot, stdin=PIPE, stdout=DEVNULL, stderr=PIPE)
+        self.lines = queue.Queue()
+        reader = threading.Thread(target=self.__read_output, args=(self.process.stderr, self.lines))
+        reader.daemon = True
+        reader.start()
+
+    @staticmethod
+    def __read_output(stream, lines):
+        for line in iter(stream.readline, b''):
+            lines.put(line.decode("utf-8", "replace"))
+        lines.put(None)
+
+    def __stop(self, kill=False):
+        p, self.process = self.process, None
+        if p is None:
+            return
+        try:
+            p.stdin.close()
+        except OSError:
+            pass
+        try:
+            if kill:
+                p.kill()
+            p.wait(timeout=self.timeout)
+        except TimeoutExpired:
+            p.kill()
+            p.wait()
+
+    def render(self, script):
         """
-        Helper class to aid in the collection of values from the database and output them in an appropriate format for gnuplot
-        Holds a list of lists in the following format
-        [[node1, label1_val1, label2_val1, ...]
-         [node2, label1_val2, label2_val2, ...]
-         ...
-        ]
-        where node1 is the Node number and label1_val1 is a label's value label2_val1 is a label's value and so on
-              node2 is another node,       label1_val2 is another value of the same label as label1_val1 and so on
+        Feed script (a string, or an iterable of strings, such as a Script) to gnuplot
+        and wait until it is processed.
+        Return a pair (ok, output) where output is what gnuplot printed on stderr
+        while processing script, and ok is False if gnuplot exited or timed out.
         """
-        def __init__(self):
-            self.info_map = {}
-            self.info = []
-            self.label_no = 0
-
-        def add_label_values(self, vals):
-            """
-            vals should be a list of tuples, each tuple should be in the format (Node, label_value)
-            """
-            assert isinstance(vals, list)
-            assert all(isinstance(x, tuple) for x in vals)
-
-            default_row = [0.0]*self.label_no
-            current_nodes = set(self.info_map.keys())
-
-            # add values where they exist
-            for node, val in vals:
-                if node in current_nodes:
-                    self.info_map[node].append(val)
-                    current_nodes.remove(node)
-                else:
-                    self.info_map[node] = default_row+[val]
-
-            # extend any skipped keys
-            for node in current_nodes:
-                self.info_map[node].append(0.0)
-
-            # increase the label
-            self.label_no += 1
-
-            """
-            for row in vals:
-                node = row[0]
-                val = row[1]
-
-                r = self.__get_row_with_node(node)
-                if r is not None:  # node already exists in out list
-                    index = r
-                else:  # create a new list for our new node
-                    self.info.append([node])
-                    index = len(self.info)-1
-                while len(self.info[index]) != self.label_no:  # check if all previous positions have been filled
-                    self.info[index].append(0)                 # if not fill with zeroes to indicate there was no value for
-                                                               # the specified node and label
-                self.info[index].append(val)                   # add the new value for label number "label_no"
-
-
-            # check for any row with a node that did not have the specific label statistic, we have to fill that with zero
-            for row in self.info:
-                while len(row) != self.label_no + 1:
-                    row.append(0)
-            """
-
-        def __get_row_with_node(self, node):
-            """
-            return an index to the row with id node, or None if it does not exist
-            """
-            i = 0
-            for row in self.info:
-                if row[0] == node:
-                    return i
-                i += 1
-            return None
+        if self.process is None:
+            self.__start()
+        self.plots += 1
+        marker = "datavis-plot-%d-done" % self.plots
+        if isinstance(script, str):
+            script = [script]
+
+        # reset the settings of the previous plot, close the output file after plotting
+        try:
+            stdin = self.process.stdin
+            stdin.write(b"reset\n")
+            for chunk in script:
+                stdin.write(chunk.encode("utf-8"))
+            stdin.write(("\nset output\nset print\nprint \"%s\"\n" % marker).encode("utf-8"))
+            stdin.flush()
+        except OSError:
+            # gnuplot has exited, its output is collected below
+            pass
+
+        output = []
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                line = self.lines.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                logging.warning("gnuplot timed out, restarting it")
+                self.__stop(kill=True)
+                output.append("timeout after %d sec" % self.timeout)
+                return False, "".join(output)
+            if line is None:
+                logging.warning("gnuplot exited, restarting it")
+                self.__stop()
+                return False, "".join(output)
+            if line.strip() == marker:
+                return True, "".join(output)
+            output.append(line)
+
+    def close(self):
+        """
+        Terminate the gnuplot process.
+        """
+        if self.process is not None:
+            self.__stop()
+        if self.plots:
+            logging.info("gnuplot session rendered %d plots, with %d restarts", self.plots, self.restarts)
+
+
+class Renderer:
+    """
+    The interface of plot renderers.
+
+    prepare(plot) fetches the data of a plot and returns the source of its rendering,
+    or None if there is no data; cache_source(plot, source) returns a string (or an
+    iterable of strings) which determines the rendered image (see RenderCache);
+    draw(plot, source, output_file) renders the plot, calling fail() on errors.
+    """
+    name = None
+
+    def prepare(self, plot):
+        raise NotImplementedError
+
+    def cache_source(self, plot, source):
+        raise NotImplementedError
+
+    def draw(self, plot, source, output_file):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class GnuplotRenderer(Renderer):
+    """
+    Renders plots by gnuplot scripts, through a GnuplotSession.
+    If no session is given, a new gnuplot process is used.
+    """
+    name = "gnuplot"
+
+    def __init__(self, session=None, gnuplot="gnuplot"):
+        self.own_session = session is None
+        self.session = GnuplotSession(gnuplot) if session is None else session
+
+    def prepare(self, plot):
+        return plot.create_script()
+
+    def cache_source(self, plot, script):
+        # the script is generated here, and replayed to gnuplot on a cache miss
+        script.keep()
+        chunks = iter(script)
+        header = next(chunks)
+        if plot.terminal:
+            # the name of the output file does not affect the image
+            header = header.replace(plot.terminal.out(plot.output), plot.terminal.out(None), 1)
+        return chain([header], chunks)
+
+    def draw(self, plot, script, output_file):
+        ok, err = self.session.render(script)
+
+        err_str = "\n".join(err.splitlines()[:10])
+        if not ok or (err_str != "" and re.search("gnuplot>\ ", err_str)):
+            if output_file is not None and os.path.isfile(output_file):
+                os.remove(output_file)
+            fail("generation failed, gnuplot reported error:\n%s" % err_str)
+
+    def close(self):
+        if self.own_session:
+            self.session.close()
+
+
+# the colors and point types of gnuplot's default line types
+GNUPLOT_COLORS = ["#9400d3", "#009e73", "#56b4e9", "#e69f00", "#f0e442", "#0072b2", "#e51e10", "#000000"]
+GNUPLOT_MARKERS = ["+", "x", "*", "s", "o", "^", "v", "D"]
+
+# dots per inch of the images drawn by the matplotlib renderer
+MATPLOTLIB_DPI = 100
 
-        def get_values_invert_columns(self):
-            """
-            returns the info structure sorted by node, now each list contains one column
-            so if there are N columns, the first contains the node numbers, the second the values of the 1st
-            label statistic, the third the values of the 2nd label statistic and so on
-            """
-            sorted_by_node = sorted(self.info, key=lambda x: x[0])
-            ret = []
-            for i in list(range(len(sorted_by_node[0]))):
-                col = []
-                for row in sorted_by_node:
-                    col.append(row[i])
-                ret.append(col)
-            return ret
-
-        def get_values(self):
-            """
-            returns the info structure sorted by node
-            """
-
-            # rebuild info from info_map
-            self.info = [
-                [node]+values for node,values in self.info_map.items()
-            ]
-
-            if len(self.info) == 0:
+
+def parse_range(r):
+    """
+    Return (low, high) for a gnuplot range "[low:high]". Missing (or "*") bounds are None.
+    """
+    def bound(b):
+        b = b.strip()
+        return None if b in ("", "*") else float(b)
+    low, sep, high = r.strip().lstrip("[").rstrip("]").partition(":")
+    return bound(low), bound(high) if sep else None
+
+
+def legend_location(key):
+    """
+    Return the matplotlib legend location for a gnuplot key setting,
+    or None if the key is switched off.
+    """
+    words = key.split() if key else []
+    if words and words[0] in ("off", "no", "unset"):
+        return None
+    vertical = "lower" if "bottom" in words else "center" if "center" in words else "upper"
+    horizontal = "left" if "left" in words else "right"
+    return "%s %s" % (vertical, horizontal)
+
+
+class MatplotlibRenderer(Renderer):
+    """
+    Renders plots in-process, with the matplotlib Agg backend, which needs no display.
+    It draws graphs in the gnuplot styles lines, points, dots, steps and linespoints
+    (the default) and clustered histograms, in PNG images only.
+    """
+    name = "matplotlib"
+
+    def __init__(self):
+        try:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+        except ImportError:
+            fail("The matplotlib plot renderer needs matplotlib, which is not installed")
+        self.Figure = Figure
+        self.FigureCanvas = FigureCanvasAgg
+
+    def prepare(self, plot):
+        graphs = [(g.key_title(), g.output_style()) for g in plot.graphs]
+        if plot.is_historgram:
+            data = plot.histogram_values()
+            if not data:
+                warn("no data found")
                 return None
+        else:
+            data = [list(rows) for g, rows in plot.graph_data()]
+            if not any(data):
+                warn("no data found")
+                return None
+        return graphs, data
+
+    def cache_source(self, plot, source):
+        settings = (self.name, plot.terminal.size if isinstance(plot.terminal, PNG) else None,
+                    plot.title, plot.xlabel, plot.ylabel, plot.x_range, plot.y_range,
+                    plot.logscale, plot.grid, plot.key, plot.is_historgram)
+        return repr((settings, source))
+
+    def draw(self, plot, source, output_file):
+        if not isinstance(plot.terminal, PNG) or output_file is None:
+            fail("the matplotlib renderer can only produce PNG images")
+        graphs, data = source
+        width, height = plot.terminal.size
+        fig = self.Figure(figsize=(width / MATPLOTLIB_DPI, height / MATPLOTLIB_DPI), dpi=MATPLOTLIB_DPI)
+        self.FigureCanvas(fig)
+        ax = fig.add_subplot(1, 1, 1)
+
+        if plot.title:  ax.set_title(plot.title)
+        if plot.xlabel: ax.set_xlabel(plot.xlabel)
+        if plot.ylabel: ax.set_ylabel(plot.ylabel)
+        logscale = (plot.logscale or "").split()
+        if logscale:
+            if "x" in logscale[0]: ax.set_xscale("log")
+            if "y" in logscale[0]: ax.set_yscale("log")
+        if plot.grid:   ax.grid(True)
+
+        if plot.is_historgram:
+            self.__draw_histogram(ax, graphs, data)
+        else:
+            self.__draw_graphs(ax, graphs, data)
+
+        if plot.x_range: ax.set_xlim(*parse_range(plot.x_range))
+        if plot.y_range: ax.set_ylim(*parse_range(plot.y_range))
+        loc = legend_location(plot.key)
+        if loc is not None and any(title for title, style in graphs):
+            ax.legend(loc=loc)
+        fig.savefig(output_file, format="png")
+
+    @staticmethod
+    def __draw_graphs(ax, graphs, data):
+        for i, ((title, style), rows) in enumerate(zip(graphs, data)):
+            if not rows:
+                continue
+            style = style.split()[0] if style.strip() else "linespoints"
+            kwargs = {"color": GNUPLOT_COLORS[i % len(GNUPLOT_COLORS)], "label": title}
+            if style == "lines":
+                kwargs.update(marker="None")
+            elif style == "points":
+                kwargs.update(linestyle="None", marker=GNUPLOT_MARKERS[i % len(GNUPLOT_MARKERS)])
+            elif style == "dots":
+                kwargs.update(linestyle="None", marker=".")
+            elif style == "steps":
+                kwargs.update(marker="None", drawstyle="steps-post")
             else:
-                return sorted(self.info, key=lambda x: x[0])
+                if style != "linespoints":
+                    logging.warning("style %s is drawn as linespoints by the matplotlib renderer", style)
+                kwargs.update(marker=GNUPLOT_MARKERS[i % len(GNUPLOT_MARKERS)])
+            ax.plot([row[0] for row in rows], [row[1] for row in rows], **kwargs)
+
+    @staticmethod
+    def __draw_histogram(ax, graphs, values):
+        # clustered bars, one cluster per x value, with a gap of 2 bars between clusters
+        nbars = len(values[0]) - 1
+        width = 1.0 / (nbars + 2)
+        positions = range(len(values))
+        for i in range(nbars):
+            offset = (i - (nbars - 1) / 2.0) * width
+            # a missing (None) value draws no bar
+            heights = [float("nan") if row[i+1] is None else row[i+1] for row in values]
+            ax.bar([p + offset for p in positions], heights, width,
+                   color=GNUPLOT_COLORS[i % len(GNUPLOT_COLORS)], label=graphs[i][0])
+        ax.set_xticks(list(positions))
+        ax.set_xticklabels([str(row[0]) for row in values])
+
+
+# the renderers by name, see get_renderer
+RENDERERS = {r.name: r for r in (GnuplotRenderer, MatplotlibRenderer)}
+
+
+def get_renderer(name=None, session=None, gnuplot="gnuplot"):
+    """
+    Return a renderer of the named kind (by default, the one configured by
+    datavis_renderer). The gnuplot renderer uses GnuplotSession session, if given,
+    else a new process of the gnuplot executable; other renderers ignore both.
+    """
+    if name is None:
+        name = datavis_renderer()
+    if name not in RENDERERS:
+        fail("Unknown plot renderer \"%s\"" % name)
+    if name == GnuplotRenderer.name:
+        return GnuplotRenderer(session=session, gnuplot=gnuplot)
+    return RENDERERS[name]()
 
 
 class Plot():
     def __init__(self, title=None, xlabel=None,
                  ylabel=None, x_range=None, y_range=None, terminal=None,
-                 logscale=None, grid=" ", key=None, output=None, is_histogram=False):
+                 logscale=None, grid=" ", key=None, output=None, is_histogram=False, renderer=None,
+                 max_points=None):
         self.graphs = []
         self.title = title
         self.xlabel = xlabel
@@ -135,87 +486,181 @@ class Plot():
         self.key = key
         self.output = output
         self.is_historgram = is_histogram
+        self.renderer = renderer
+        self.max_points = max_points
+        # the axes and selection of the graphs made by make_plot, see graph_data()
+        self.axes = None
+        self.select = None
 
-    def make_plot(self, gnuplot="gnuplot"):
-        p = Popen(gnuplot, stdin=PIPE, stderr=PIPE)
+    def make_plot(self, gnuplot="gnuplot", session=None, cache=None):
+        """
+        Render the plot with its renderer (see get_renderer). If the plot is rendered
+        by gnuplot and a GnuplotSession is given, it is rendered through it; else a
+        new gnuplot process is used.
+        If a RenderCache is given, a cached rendering of an identical plot is
+        used instead of rendering, if there is one, and new renderings are cached.
+        Return False if there was no data to plot.
+        """
+        renderer = get_renderer(self.renderer, session, gnuplot)
         ret = False
         try:
-            script = self.__create_script()
-            if script:
-                p.stdin.write(script.encode("utf-8"))
+            source = renderer.prepare(self)
+            if source is not None:
                 ret = True
-
-                # vsam: changed timeout to 10 sec (it was 0.2 but I was getting timeouts)
-                out, err = p.communicate(timeout=10)
-
-                err_str = err.decode("utf-8").splitlines()[:10] if err else ""
-                err_str = "\n".join(err_str)
-                if err_str != "" and re.search("gnuplot>\ ", err_str):
-                    if os.path.isfile(self.output + ".png"):
-                        os.remove(self.output + ".png")
-                    fail("generation failed, gnuplot reported error:\n%s" % err_str)
+                output_file = self.terminal.output_file(self.output) if self.terminal else None
+                key = None
+                if cache is not None and output_file is not None:
+                    key = cache.key(renderer.cache_source(self, source))
+                    if cache.restore(key, output_file):
+                        return ret
+                # the renderer must not write into an existing file, which may be
+                # linked to a cache entry (even if the cache is not used now)
+                if output_file is not None and os.path.lexists(output_file):
+                    os.remove(output_file)
+
+                renderer.draw(self, source, output_file)
+                if key is not None:
+                    cache.store(key, output_file)
         except CheckFail as ex:
             raise ex
         except BaseException as ex:
             logging.critical(traceback.format_exc())
             fail("generation failed")
         finally:
-            p.stdin.close()
+            renderer.close()
         return ret
 
     def make_parameter(self):
         return self.graphs[0].output_data()
 
-    def __create_script(self):
-        script = ""
-        if self.title:    script += ('set title ' + '"'+self.title+'"\n')
-        if self.xlabel:   script += ('set xlabel "' + self.xlabel + "\n")
-        if self.ylabel:   script += ('set ylabel "' + self.ylabel + '"\n')
-        if self.x_range:  script += ('set xrange ' + self.x_range + "\n")
-        if self.y_range:  script += ('set yrange ' + self.y_range + "\n")
-        if self.logscale: script += ('set logscale %s' % self.logscale + "\n")
-        if self.grid:     script += ('set grid %s' % self.grid + "\n")
-        if self.key:      script += ("set key %s" % self.key + "\n")
-        if self.terminal: script += self.terminal.out(self.output)
-        if self.is_historgram: script += ("set style data histograms\n"
-                                          "set style histogram cluster gap 2\n"
-                                          "set style fill solid 1.0\n")
-
-        script += ("plot" + ','.join([g.output_plot() for g in self.graphs]) + "\n")
-        if self.is_historgram:
-            sbh = StatBreakdownHelper()
+    def histogram_values(self):
+        """
+        Return the data of a histogram plot as a list of rows [x, value1, value2, ...],
+        one per x value, in order, holding the value of each graph, or None if there is no data.
+        A graph with no value for x has 0.0, one with a NULL value has None (a gap), and
+        one with many values for x has the last one.
+        The data of all graphs is fetched by a single query, and pivoted as it is read.
+        """
+        if not self.graphs:
+            return None
+        if len(self.graphs) > MAX_HISTOGRAM_GRAPHS:
+            fail("a histogram can have at most %d graphs, this one has %d" % (MAX_HISTOGRAM_GRAPHS, len(self.graphs)))
+        g = self.graphs[0]
+        sql = g.relation.sql_pivot(g.x[0].name, g.y[0].name, [g.select for g in self.graphs])
+        values = []
+        for row in g.relation.dataset.conn.execute(sql):
+            x, y = row[0], row[1]
+            if not values or values[-1][0] != x:
+                values.append([x] + [0.0] * len(self.graphs))
+            current = values[-1]
+            for i, selected in enumerate(row[2:]):
+                if selected:
+                    current[i+1] = y
+        return values if values else None
+
+    def graph_data(self):
+        """
+        Generate (graph, rows) for the graphs of the plot, in order, where rows is an
+        iterator over the (x, y) rows of the graph, ordered by x, which must be consumed
+        before the next graph is generated.
+        The data of the graphs made by make_plot over some axes is fetched by a single
+        query, ordered by the axes, which is split into the graphs.
+
+        Unless the plot is a histogram, graphs with more than max_points rows (by
+        default, datavis_max_points) are decimated; max_points 0 means no limit,
+        and smaller limits are raised to 2 points.
+        """
+        max_points = int(self.max_points if self.max_points is not None else datavis_max_points())
+        if self.is_historgram or max_points <= 0:
+            yield from self.__graph_rows()
+            return
+        max_points = max(max_points, 2)
+
+        kept = read = 0
+        for g, rows in self.__graph_rows():
+            rows, count = decimate(rows, max_points)
+            kept += len(rows)
+            read += count
+            yield g, iter(rows)
+        if kept < read:
+            inform("decimated to at most %d points per graph: kept %d points, dropped %d" %
+                   (max_points, kept, read - kept))
+
+    def __graph_rows(self):
+        if self.axes is None:
             for g in self.graphs:
-                sbh.add_label_values(g.output_data())
-            values = sbh.get_values()
+                yield g, g.iter_data()
+            return
+        if not self.graphs:
+            return
+
+        g = self.graphs[0]
+        n = len(self.axes)
+        sql = g.relation.sql_select_groups(self.axes, [g.x[0].name, g.y[0].name], where=self.select,
+                                           order=[g.x[0].name])
+        groups = groupby(g.relation.dataset.conn.execute(sql), key=lambda row: row[:n])
+        group = next(groups, None)
+        for g in self.graphs:
+            # both the graphs and the groups are ordered by the axes
+            if group is not None and group[0] == g.key:
+                yield g, (row[n:] for row in group[1])
+                group = next(groups, None)
+            else:
+                yield g, iter(())
+
+    def create_script(self):
+        """
+        Return the gnuplot Script of the plot, with the plot data inline,
+        or None if there is no data. The first chunk of the script holds
+        the settings and the plot command, the rest hold the data, which is
+        streamed from the database as the script is generated.
+        """
+        data = self.__script_data()
+        first = next(data, None)
+        if first is None:
+            warn("no data found")
+            return None
+        return Script(chain([self.__script_header(), first], data))
+
+    def __script_header(self):
+        script = []
+        if self.title:    script.append('set title ' + '"'+self.title+'"\n')
+        if self.xlabel:   script.append('set xlabel "' + self.xlabel + "\n")
+        if self.ylabel:   script.append('set ylabel "' + self.ylabel + '"\n')
+        if self.x_range:  script.append('set xrange ' + self.x_range + "\n")
+        if self.y_range:  script.append('set yrange ' + self.y_range + "\n")
+        if self.logscale: script.append('set logscale %s' % self.logscale + "\n")
+        if self.grid:     script.append('set grid %s' % self.grid + "\n")
+        if self.key:      script.append("set key %s" % self.key + "\n")
+        if self.terminal: script.append(self.terminal.out(self.output))
+        if self.is_historgram: script.append("set style data histograms\n"
+                                             "set style histogram cluster gap 2\n"
+                                             "set style fill solid 1.0\n")
+
+        script.append("plot" + ','.join([g.output_plot() for g in self.graphs]) + "\n")
+        return "".join(script)
+
+    def __script_data(self):
+        """
+        Generate the inline data of the script in chunks.
+        """
+        if self.is_historgram:
+            values = self.histogram_values()
             if not values:
-                warn("no data found")
-                return None
+                return
             for i in range(len(values[0])-1):
-                for row in values:
-                    node = str(row[0])
-                    val = str(row[i+1])
-                    script += ("\""+node+"\""+" "+val+"\n")
-                script += "end\n"
+                yield from gnuplot_block("\"%s\" %s" % (row[0], row[i+1]) for row in values)
         else:
-            has_data = False
-            for g in self.graphs:
-                graph_data = g.output_data_for_gnuplot()
-                if graph_data is not None:
-                    script += graph_data
-                    has_data = True
-            if not has_data:
-                warn("no data found")
-                return None
+            for g, rows in self.graph_data():
+                yield from g.output_data_for_gnuplot(rows)
 
-        return script
-
-    def add_graph(self, rel, x, y, select={}, title=None, style='linespoints'):
-        g  = Graph(self, rel, x, y, select=select, title=title, style=style)
+    def add_graph(self, rel, x, y, select={}, title=None, style='linespoints', key=None):
+        g  = Graph(self, rel, x, y, select=select, title=title, style=style, key=key)
         return self
 
 
 class Graph(object):
-    def __init__(self, plot, rel, x, y, select=[], title=None, style='linespoints'):
+    def __init__(self, plot, rel, x, y, select=[], title=None, style='linespoints', key=None):
         self.plot = plot
         plot.graphs.append(self)
 
@@ -228,37 +673,51 @@ class Graph(object):
         self.select = select
         self.title = title
         self.style = style
+        # the values of the plot axes for this graph
+        self.key = key
 
     def __default_title(self):
         return str(self.select)
 
-    def __output_style(self):
+    def key_title(self):
+        return self.__default_title() if self.title is None else self.title
+
+    def output_style(self):
         if callable(self.style):
             return self.style(self.select)
         else:
             return str(self.style)
 
     def output_plot(self):
-        title = self.__default_title() if self.title is None else self.title
-        style = "" if self.style is None or self.style == "histogram" else "with "+self.__output_style()
+        title = self.key_title()
+        style = "" if self.style is None or self.style == "histogram" else "with "+self.output_style()
         using = "using 2:xticlabels(1)" if self.style == "histogram" else ""
         return """ '-' %s title "%s" %s""" % (using, title, style)
 
-    def output_data_for_gnuplot(self):
+    def iter_data(self):
         """
-        writes this graph's data, in gnuplot format, to string s
-        returns s or None if no data was returned from the query
+        returns an iterator over the (x, y) rows of this graph, ordered by x
         """
-        s = ""
         sql = self.relation.sql_select([self.x[0].name, self.y[0].name], where=self.select, order=[self.x[0].name])
         conn = self.relation.dataset.conn
-        res = conn.execute(sql).fetchall()
+        return conn.execute(sql)
+
+    def fetch_data(self):
+        """
+        fetches the (x, y) rows of this graph, ordered by x
+        """
+        res = self.iter_data().fetchall()
         logging.debug("query row count: %d" % len(res))
-        if len(res) == 0: return None
-        for row in res:
-            s += (" ".join(str(x) for x in row) + "\n")
-        s += "end\n"
-        return s
+        return res
+
+    def output_data_for_gnuplot(self, rows=None):
+        """
+        generates this graph's data (fetched, unless given in rows), in gnuplot format, in chunks
+        nothing is generated if there is no data
+        """
+        if rows is None:
+            rows = self.iter_data()
+        return gnuplot_block(" ".join(str(x) for x in row) for row in rows)
 
     def output_data(self):
         """
@@ -321,14 +780,16 @@ pm_defaults = {
     "output": DEFAULT,
     "x": None,
     "axes": None,
-    "unit": ""
+    "unit": "",
+    "renderer": None,
+    "max_points": None
 }
 
 def make_plot(rel, x, y, axes, select={}, title=DEFAULT, style='linespoints',
               legend=DEFAULT,
               xlabel=None, ylabel=None, x_range=None, y_range=None,
               terminal=None, logscale=None, grid=" ", key=None,
-              output=DEFAULT, is_histogram=False):
+              output=DEFAULT, is_histogram=False, renderer=None, max_points=None):
     """
     Return a Plot object, containing a number of Graph objects.
 
@@ -337,8 +798,9 @@ def make_plot(rel, x, y, axes, select={}, title=DEFAULT, style='linespoints',
     SELECT DISTINCT axes... FROM rel WHERE select... ORDER BY axes...
 
     For each result row R of this query, a new graph is created. The
-    data used for the graph is retrieved as follows
+    data used for the graph is
     SELECT x, y FROM rel WHERE axes...=R... ORDER BY x
+    (the data of all graphs is actually fetched by a single query, see Plot.graph_data).
 
     rel: the Relation from which data will be drawn
     x,y: the plotted attribute names
@@ -353,6 +815,8 @@ def make_plot(rel, x, y, axes, select={}, title=DEFAULT, style='linespoints',
     grid: a string passed to gnuplot
     terminal: an object used to select and configure a gnuplot terminal
     output: a string used to create output file of gnuplot
+    renderer: the name of the plot renderer (see get_renderer), by default the configured one
+    max_points: the maximum number of points drawn per graph (see Plot.graph_data)
     """
 
     if axes is not None:
@@ -389,13 +853,16 @@ def make_plot(rel, x, y, axes, select={}, title=DEFAULT, style='linespoints',
                 xlabel=xlabel, ylabel=ylabel,
                 x_range=x_range, y_range=y_range,
                 terminal=terminal, logscale=logscale, grid=grid, key=key,
-                output=output, is_histogram=style == "histogram")
+                output=output, is_histogram=style == "histogram", renderer=renderer,
+                max_points=max_points)
 
     if axes is not None:
-        # make the graphs
+        # make the graphs; their data is fetched together, see Plot.graph_data()
+        plot.axes = list(axes)
+        plot.select = select
         for row in axisdata:
             sel = dict(zip(axes, row))
-            plot.add_graph(rel, x, y, select=sel, title=(legend%sel), style=style)
+            plot.add_graph(rel, x, y, select=sel, title=(legend%sel), style=style, key=tuple(row))
     else:
         plot.add_graph(rel, x, y, select=select, title=title, style=style)
     return plot
@@ -414,8 +881,11 @@ class PNG:
         self.filename = filename
         self.size = size
 
+    def output_file(self, filebase=None):
+        return self.filename if self.filename else filebase+'.png' if filebase else None
+
     def out(self, filebase=None):
-        fname = self.filename if self.filename else filebase+'.png' if filebase else None
+        fname = self.output_file(filebase)
 
         ret = "set terminal png size %d,%d\n" % self.size
         if fname:
@@ -427,8 +897,11 @@ class Tikz:
     def __init__(self, filename=None, size=None):
         self.filename = filename
         self.size = size
+    def output_file(self, filebase=None):
+        return self.filename if self.filename else filebase+'.tex' if filebase else None
+
     def out(self,filebase=None):
-        fname = self.filename if self.filename else filebase+'.tex' if filebase else None
+        fname = self.output_file(filebase)
 
         ret = "set terminal tikz"
         if self.size:
@@ -11,35 +11,208 @@ import re
 import csv
 import logging
 import json
+import time
+import math
+import shutil
+import tempfile
+from multiprocessing import Pool
+from itertools import accumulate, chain, repeat, islice
 from models.nsdplot import Table as nsdTable
 from models.validation import fail
+from datavis.omnetpp import VectorStore, read_scalars, split_module
 
 DEFAULT_NODEMAP_FILE = "nodemap.json"
 
 
 histogram_statistic_names = ["Application level latency, in ms"]
 
+# the table holding the castalia to plan node map, in every StatsDatabase
+NODEMAP_TABLE = "datavis_nodemap"
+
+# the columns of tables loaded from OMNeT++ vector and scalar files
+VECTOR_COLUMNS = ["module", "node", "name", "event", "time", "data"]
+SCALAR_COLUMNS = ["module", "node", "name", "data"]
+
+# the columns of a table loaded from Castalia output that hold castalia node ids,
+# each with the condition on the rows where the column is a node id.
+# n_index holds node ids except for the statistics that are histograms over values.
+CASTALIA_NODE_COLUMNS = [
+    ("node", None),
+    ("n_index", "name NOT IN (%s)" % ",".join(repr(name) for name in histogram_statistic_names))
+]
+
+# the file name of the persistent results database, inside a simulation home
+RESULTS_DB_FILE = "results.sqlite"
+
+# the schema version of the persistent results database, stored as PRAGMA user_version.
+# Bump this whenever the layout of the stored tables changes; older files are rebuilt.
+RESULTS_SCHEMA_VERSION = 2
+
+# number of rows buffered by a BulkInserter before they are written with executemany()
+DEFAULT_BATCH_SIZE = 10000
+
+# a BulkInserter with progress reporting logs the row count every this many rows
+DEFAULT_PROGRESS_ROWS = 100000
+
+
+class BulkInserter(object):
+    """
+    A BulkInserter buffers rows destined for a single INSERT statement and
+    writes them to the database in batches, using executemany().
+
+    It is used as a context manager; all rows are written in a single
+    transaction, which is committed on exit (or rolled back on error).
+    Upon commit, the number of rows and the throughput are logged.
+    """
+
+    def __init__(self, conn, sql, batch_size=DEFAULT_BATCH_SIZE, name=None, progress=None):
+        """
+        conn is the sqlite3 connection, sql is the (parameterized) INSERT query,
+        name is used only for logging. If progress is given, the number of rows
+        inserted so far is logged every progress rows.
+        """
+        self.conn = conn
+        self.sql = sql
+        self.batch_size = batch_size
+        self.name = name
+        self.progress = progress
+        self.rows = []
+        self.count = 0
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.flush()
+            self.conn.commit()
+            self.report()
+        else:
+            self.rows = []
+            self.conn.rollback()
+        return False
+
+    def add(self, row):
+        """
+        Add a row (a tuple) to the buffer, flushing the buffer if it is full.
+        """
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def add_many(self, rows):
+        """
+        Add a list of rows to the buffer, flushing the buffer if it is full.
+        """
+        self.rows.extend(rows)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all buffered rows to the database (without committing).
+        """
+        if self.rows:
+            self.conn.executemany(self.sql, self.rows)
+            before = self.count
+            self.count += len(self.rows)
+            self.rows = []
+            if self.progress and before // self.progress != self.count // self.progress:
+                elapsed = time.time() - self.start_time
+                logging.info("Loading %s: %d rows so far (%.0f rows/sec)", self.name if self.name else "database",
+                             self.count, self.count / elapsed if elapsed > 0 else float(self.count))
+
+    def report(self):
+        """
+        Log the number of rows inserted and the insertion rate.
+        """
+        elapsed = time.time() - self.start_time
+        rate = self.count / elapsed if elapsed > 0 else float(self.count)
+        logging.info("Loaded %d rows into %s in %.3f sec (%.0f rows/sec)",
+                     self.count, self.name if self.name else "database", elapsed, rate)
+
+
+class StdDev:
+    """
+    SQL aggregate STDDEV(x): the sample standard deviation of x.
+    NULL for less than two values.
+    """
+    def __init__(self):
+        # Welford's online algorithm
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def step(self, value):
+        if value is None:
+            return
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+    def variance(self):
+        return self.m2 / (self.n - 1)
+
+    def finalize(self):
+        if self.n < 2:
+            return None
+        return math.sqrt(self.variance())
+
+
+class ConfidenceInterval95(StdDev):
+    """
+    SQL aggregate CI95(x): the half-width of the (normal approximation) 95% confidence
+    interval of the mean of x, so that the interval is AVG(x) +- CI95(x).
+    NULL for less than two values.
+    """
+    def finalize(self):
+        if self.n < 2:
+            return None
+        return 1.96 * math.sqrt(self.variance() / self.n)
+
+
+def register_aggregates(conn):
+    """
+    Add the aggregate functions which are not built into sqlite to connection conn.
+    """
+    conn.create_aggregate("STDDEV", 1, StdDev)
+    conn.create_aggregate("CI95", 1, ConfidenceInterval95)
+
 
 class Dataset(object):
     """
-    A Dataset encapsulates a new in-memory database.
+    A Dataset encapsulates a new in-memory database, or a database file.
 
     Dataset objects can be used to add Table and View objects to the
     database, load data into tables and access tables and views by name.
     """
 
-    def __init__(self):
-        self.conn = sql.connect(':memory:')
+    def __init__(self, dbfile=None, readonly=False):
+        """
+        If dbfile is None, an in-memory database is used.
+        If readonly is True, the database cannot be modified; the connection
+        may then be closed by a thread other than the one using it.
+        """
+        self.dbfile = dbfile
+        self.conn = sql.connect(':memory:' if dbfile is None else dbfile, check_same_thread=not readonly)
+        if readonly:
+            self.conn.execute("PRAGMA query_only = ON")
+        register_aggregates(self.conn)
         self.relations = {}
 
-    def add(self, relation):
+    def add(self, relation, create=True):
         """
         Add relation to the dataset.
+        If create is False, the relation is assumed to already exist in the database.
         """
         assert isinstance(relation, Relation)
-        sql_create_query = relation.sql_create()
-        logging.debug("Dataset.add, Relation.sql_create: %s", sql_create_query)
-        self.conn.execute(sql_create_query)
+        if create:
+            sql_create_query = relation.sql_create()
+            logging.debug("Dataset.add, Relation.sql_create: %s", sql_create_query)
+            self.conn.execute(sql_create_query)
         if relation.name in self.relations:
             logging.error("In datavis.database.Dataset.add(): duplicate relation name: %s", relation.name)
             raise ValueError("This relation's name is already in use" % relation.name)
@@ -78,6 +251,13 @@ class Dataset(object):
         view.set_attributes(self.get_attributes_of_relation(name))
         return view
 
+    def create_table_as(self, name, qry):
+        """
+        Create a table holding the results of query qry (a materialized view) and add it.
+        """
+        self.conn.execute("CREATE TABLE %s AS %s" % (name, qry))
+        return self.add(Table(name, self.get_attributes_of_relation(name)), create=False)
+
     def load_csv(self, filename, dialect='excel', **fmtargs):
         """
         Load data from a CSV file.
@@ -97,6 +277,32 @@ class Dataset(object):
             assert isinstance(table, Table)
             self.conn.executemany(table.sql_insertmany(), tabdata[tabname])
 
+    def snapshot(self, dbfile):
+        """
+        Write a copy of the database into file dbfile.
+        """
+        self.conn.commit()
+        dest = sql.connect(dbfile)
+        try:
+            self.conn.backup(dest)
+        finally:
+            dest.close()
+
+    def open_copy(self, dbfile):
+        """
+        Return a new, read-only Dataset over file dbfile, which holds this database
+        (or a snapshot of it), with the same relations.
+        """
+        copy = Dataset(dbfile, readonly=True)
+        for name, rel in self.relations.items():
+            if isinstance(rel, View):
+                rcopy = View(name, rel.defquery)
+                rcopy.set_attributes(rel.attributes)
+            else:
+                rcopy = Table(name, rel.attributes)
+            copy.add(rcopy, create=False)
+        return copy
+
     def print_relation(self, name):
         rel = self.relations[name]
         print(rel.scheme())
@@ -119,8 +325,19 @@ class Dataset(object):
 
 
 class StatsDatabase(Dataset):
-    def __init__(self, testing=False):
-        Dataset.__init__(self)
+    """
+    The database holding the statistics of a simulation.
+
+    By default the database lives in memory. If dbfile is given, the database
+    is persistent: tables loaded into it are stamped with a signature of their
+    source files, so that they can be restored (with restore_table) instead of
+    re-parsed, as long as the sources have not changed.
+    """
+
+    def __init__(self, testing=False, dbfile=None):
+        Dataset.__init__(self, dbfile)
+        if dbfile is not None:
+            self.__prepare_results_db()
         if testing:
             alist = [
                 Attribute("module", "VARCHAR"),
@@ -132,6 +349,139 @@ class StatsDatabase(Dataset):
             ]
             self.create_table("dataTable", alist)
         self.nodemap = None
+        self.node_columns = {}
+
+    #
+    # Persistent results database
+    #
+
+    def is_persistent(self):
+        return self.dbfile is not None
+
+    def __prepare_results_db(self):
+        """
+        Check the schema version of the database file, rebuilding it if it is stale,
+        and drop all views and materialized views, i.e., tables not loaded from
+        sources (they are always re-created from the NSD).
+        """
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, RESULTS_SCHEMA_VERSION):
+            logging.info("Rebuilding results database %s (schema version %d, expected %d)",
+                         self.dbfile, version, RESULTS_SCHEMA_VERSION)
+            self.conn.close()
+            os.remove(self.dbfile)
+            self.conn = sql.connect(self.dbfile)
+            register_aggregates(self.conn)
+            version = 0
+
+        if version == 0:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS datavis_sources "
+                              "(tablename VARCHAR PRIMARY KEY, signature VARCHAR, nodemap VARCHAR)")
+            self.conn.execute("PRAGMA user_version = %d" % RESULTS_SCHEMA_VERSION)
+            self.conn.commit()
+
+        views = self.conn.execute("SELECT name FROM sqlite_master WHERE type='view'").fetchall()
+        for (view,) in views:
+            self.conn.execute("DROP VIEW %s" % view)
+        tables = self.conn.execute("SELECT name FROM sqlite_master WHERE type='table' "
+                                   "AND name NOT LIKE 'sqlite\\_%' ESCAPE '\\' "
+                                   "AND name NOT LIKE 'datavis\\_%' ESCAPE '\\' "
+                                   "AND name NOT IN (SELECT tablename FROM datavis_sources)").fetchall()
+        for (table,) in tables:
+            self.conn.execute("DROP TABLE %s" % table)
+        self.conn.commit()
+
+    @staticmethod
+    def source_signature(alist, sources):
+        """
+        Return a string identifying a table loaded from the given source files.
+        It changes whenever the table scheme or the size or modification time
+        of any source file changes.
+        """
+        stats = []
+        for fname in sources:
+            if os.path.isfile(fname):
+                st = os.stat(fname)
+                stats.append([os.path.abspath(fname), st.st_size, st.st_mtime_ns])
+            else:
+                stats.append([os.path.abspath(fname), None, None])
+        return json.dumps([[a.sql_create() for a in alist], stats])
+
+    def restore_table(self, name, alist, sources, node_mapping_file=DEFAULT_NODEMAP_FILE):
+        """
+        If this is a persistent database holding table name, loaded from the given
+        (unchanged) source files, add the table to the dataset and return it.
+        Else, return None.
+
+        If the node mapping file has changed since the table was loaded, the node ids
+        of the table are re-mapped, without re-loading it (when this is not possible,
+        None is returned).
+        """
+        if not self.is_persistent():
+            return None
+        row = self.conn.execute("SELECT signature, nodemap FROM datavis_sources WHERE tablename=?",
+                                (name,)).fetchone()
+        if row is None or row[0] != self.source_signature(alist, sources):
+            return None
+        if row[1] is not None:
+            mapping = json.loads(row[1])
+            self.__generate_nodemap(node_mapping_file)
+            if mapping["nodemap"] != self.nodemap:
+                node_columns = [tuple(nc) for nc in mapping["columns"]]
+                if not self.__unmap_nodes(name, node_columns, mapping["nodemap"]):
+                    logging.info("Cannot re-map the node ids of table %s, it must be reloaded", name)
+                    return None
+                self.map_nodes(name, node_columns)
+                logging.info("Re-mapped the node ids of table %s", name)
+                self.conn.execute("UPDATE datavis_sources SET nodemap=? WHERE tablename=?",
+                                  (self.__nodemap_record(name), name))
+                self.conn.commit()
+            else:
+                self.node_columns[name] = [tuple(nc) for nc in mapping["columns"]]
+        logging.info("Restored table %s from results database %s", name, self.dbfile)
+        return self.add(Table(name, alist), create=False)
+
+    def stamp_table(self, name, alist, sources):
+        """
+        Record that table name has been loaded from the given source files,
+        together with the node mapping applied to it.
+        This is a no-op for in-memory databases.
+        """
+        if self.is_persistent():
+            self.conn.execute("INSERT OR REPLACE INTO datavis_sources(tablename, signature, nodemap) VALUES(?,?,?)",
+                              (name, self.source_signature(alist, sources), self.__nodemap_record(name)))
+            self.conn.commit()
+
+    def __nodemap_record(self, name):
+        """
+        Return the node mapping applied to table name, as stored in datavis_sources.
+        """
+        if name not in self.node_columns:
+            return None
+        return json.dumps({"columns": self.node_columns[name], "nodemap": self.nodemap}, sort_keys=True)
+
+    def restore_all_tables(self):
+        """
+        Add all the tables stored in a persistent database to the dataset, without checking
+        their sources. Return the list of table names.
+        """
+        names = [row[0] for row in self.conn.execute("SELECT tablename FROM datavis_sources ORDER BY tablename")]
+        for name in names:
+            if name not in self.relations:
+                alist = [Attribute(col[1], col[2]) for col in self.conn.execute("PRAGMA table_info(%s)" % name)]
+                self.add(Table(name, alist), create=False)
+        return names
+
+    def create_table(self, name, alist):
+        """
+        Create and add a Table, given name and attribute list.
+        In a persistent database, a stale table by the same name is dropped first.
+        """
+        if self.is_persistent():
+            self.conn.execute("DELETE FROM datavis_sources WHERE tablename=?", (name,))
+            self.conn.execute("DROP TABLE IF EXISTS %s" % name)
+            self.conn.commit()
+        return Dataset.create_table(self, name, alist)
 
     def get_datatable(self):
         """
@@ -167,6 +517,7 @@ class StatsDatabase(Dataset):
         """
         parse map_file and generate a nodemap
         that is a dictionary of the form {"castaliaID1":"planID1", "castaliaID12:"planID2", ...}
+        The nodemap is also stored in table NODEMAP_TABLE, for mapping node ids in SQL.
         :param map_file: the file containing information to generate the nodemap
         :return: the nodemap
         """
@@ -184,26 +535,74 @@ class StatsDatabase(Dataset):
                 nodemap[str(n["simid"])] = n["nodeid"]
         self.nodemap = nodemap
 
-    def __castaliaID_2_planID(self, castalia_id):
+        self.conn.execute("DROP TABLE IF EXISTS %s" % NODEMAP_TABLE)
+        self.conn.execute("CREATE TABLE %s(simid INT PRIMARY KEY, nodeid)" % NODEMAP_TABLE)
+        self.conn.executemany("INSERT INTO %s(simid, nodeid) VALUES(?,?)" % NODEMAP_TABLE, nodemap.items())
+        self.conn.commit()
+
+    def map_castalia_nodes(self, table_name, node_mapping_file=DEFAULT_NODEMAP_FILE):
         """
-        translate a castalia node id to a plan node id
-        self.nodemap has to be generated with __generate_nodemap before this function is called or it will just return the id as is
-        if castalia node id == -1 it is returned as is
-        :param castalia_id: the castalia node id to translate
-        :return: the plan node id (translated castalia node id)
+        map the castalia node ids of a table loaded from Castalia output to plan node ids
         """
-        if self.nodemap is None or castalia_id is None or castalia_id == "" or castalia_id == -1:
-            return castalia_id
+        self.__generate_nodemap(node_mapping_file)
+        self.map_nodes(table_name, CASTALIA_NODE_COLUMNS)
 
-        if str(castalia_id) in self.nodemap:
-            return self.nodemap[str(castalia_id)]
-        else:
-            logging.warning("castalia node id \"%s\" is not mapped to a plan id" % castalia_id)
-            return castalia_id
+    def map_nodes(self, table_name, node_columns):
+        """
+        map castalia node ids to plan node ids in table table_name, using the nodemap
+        (see __generate_nodemap). node_columns is a list of pairs (column, condition),
+        where condition (an SQL expression, or None for all rows) selects the rows where
+        column holds a node id. Each column is mapped by a single UPDATE.
+        Ids missing from the nodemap are left as they are, and reported once.
+        """
+        self.node_columns[table_name] = list(node_columns)
+        if self.nodemap is None:
+            return
+
+        for column, cond in node_columns:
+            where = "" if cond is None else " AND (%s)" % cond
+            unmapped = self.conn.execute(
+                "SELECT DISTINCT {c} FROM {t} WHERE {c} IS NOT NULL AND {c} <> '' AND {c} <> -1 "
+                "AND {c} NOT IN (SELECT simid FROM {m}){w}".format(c=column, t=table_name, m=NODEMAP_TABLE, w=where)
+            ).fetchall()
+            if unmapped:
+                logging.warning("castalia node ids %s in column %s of %s are not mapped to plan ids",
+                                ", ".join(str(u[0]) for u in unmapped), column, table_name)
+            self.conn.execute(
+                "UPDATE {t} SET {c} = (SELECT nodeid FROM {m} WHERE simid = {t}.{c}) "
+                "WHERE {c} IN (SELECT simid FROM {m}){w}".format(c=column, t=table_name, m=NODEMAP_TABLE, w=where))
+        self.conn.commit()
+
+    def __unmap_nodes(self, table_name, node_columns, nodemap):
+        """
+        restore the castalia node ids in table table_name, mapped with the given nodemap
+        (a dict, or None if no mapping took place). Return False if this cannot be done
+        reliably, that is, if some plan node ids are shared, or may be castalia ids.
+        """
+        if nodemap is None:
+            return True
+        planids = list(nodemap.values())
+        if len(set(planids)) != len(planids) or any(re.fullmatch(r"-?[0-9]+", str(p)) for p in planids):
+            return False
+
+        self.conn.execute("CREATE TEMP TABLE datavis_unmap(nodeid PRIMARY KEY, simid INT)")
+        try:
+            self.conn.executemany("INSERT INTO datavis_unmap(nodeid, simid) VALUES(?,?)",
+                                  [(nodeid, simid) for simid, nodeid in nodemap.items()])
+            for column, cond in node_columns:
+                where = "" if cond is None else " AND (%s)" % cond
+                self.conn.execute(
+                    "UPDATE {t} SET {c} = (SELECT simid FROM datavis_unmap WHERE nodeid = {t}.{c}) "
+                    "WHERE {c} IN (SELECT nodeid FROM datavis_unmap){w}".format(c=column, t=table_name, w=where))
+            self.conn.commit()
+        finally:
+            self.conn.execute("DROP TABLE datavis_unmap")
+        return True
 
-    def __save_output(self, m, n, i, o, bl, l, v, table_name):
+    def __output_row(self, m, n, i, o, bl, l, v):
         """
-        Stores data representing a simple output or histogram to database
+        Return the row representing a simple output or histogram value, in the column
+        order of __insert_output_sql()
             m: module
             n: node
             i: index
@@ -214,16 +613,45 @@ class StatsDatabase(Dataset):
         """
 
         # ignore sim_label bl
+        # node ids are mapped afterwards, by map_nodes()
+        return m, n, o, l, i, v
 
-        c = self.conn.cursor()
-        # map castalia node ids to plan node ids
-        n = self.__castaliaID_2_planID(n)
-        # map index only for histogram statistics
-        if o not in histogram_statistic_names:
-            i = self.__castaliaID_2_planID(i)
-        c.execute("INSERT INTO %s(module,node,name,label,n_index,data) VALUES(?,?,?,?,?,?);" % table_name,
-                  (m, n, o, l, i, v))
-        self.conn.commit()
+    @staticmethod
+    def __insert_output_sql(table_name):
+        return "INSERT INTO %s(module,node,name,label,n_index,data) VALUES(?,?,?,?,?,?);" % table_name
+
+    def __histogram_rows(self, m, n, o, bl, hmin, hmax, vals):
+        """
+        Return the rows for all buckets of a histogram, in the same form as __output_row()
+            m: module
+            n: node
+            o: histogram name
+            bl: sim_label
+            hmin, hmax: histogram_min and histogram_max
+            vals: the list of bucket values
+        """
+        labels = self.__histogram_labels(hmin, hmax, len(vals))
+        return [(m, n, o, l, i, v) for l, i, v in zip(labels, range(len(vals)), vals)]
+
+    @staticmethod
+    def __histogram_labels(hmin, hmax, nbuckets):
+        """
+        Return the list of labels "[lower,upper)" for the nbuckets buckets of a histogram.
+        The last bucket has upper bound "inf".
+
+        Bucket bounds are accumulated by repeated addition of the step, as Castalia does;
+        a bound with no fractional part is printed as an int, except for lower bounds past
+        the first one, which are printed as computed.
+        """
+        step = float(hmax - hmin) / (nbuckets - 1)
+        if StatsDatabase.__is_int(step): step = int(step)
+        if StatsDatabase.__is_int(hmin): hmin = int(hmin)
+
+        # edges[k] is the lower bound of bucket k, edges[k+1] is its upper bound
+        edges = list(accumulate(chain([hmin], repeat(step, nbuckets))))
+        uppers = [int(e) if type(e) == float and int(e) == e else e for e in edges[1:]]
+        uppers = ["inf" if e > hmax else e for e in uppers]
+        return ["[%s,%s)" % bounds for bounds in zip(edges, uppers)]
 
     @staticmethod
     def __is_int(num):
@@ -233,12 +661,23 @@ class StatsDatabase(Dataset):
         if type(num) != float: return False
         return int(num) == num
 
-    def load_data_csv(self, table, node_mapping_file=DEFAULT_NODEMAP_FILE):
+    def load_data_csv(self, table, node_mapping_file=DEFAULT_NODEMAP_FILE, batch_size=DEFAULT_BATCH_SIZE):
         """
         Load data from a CSV file to table
+
+        The first line of the file holds the column names. The file is streamed:
+        rows are read and inserted in batches of batch_size, all inside a single
+        transaction. Progress and throughput are reported in the log. Node ids
+        are mapped afterwards, by map_nodes().
         """
+        assert isinstance(table, nsdTable)
+        filename = table.filename
+        table_cols = len(table.columns)
 
-        def assert_format():
+        if not os.path.exists(filename) or not os.path.isfile(filename):
+            fail("Could not load \"%s\" csv data file, file not found" % filename)
+
+        def assert_format(row):
             """
             checks table column number to be equal with column number in data file
             """
@@ -247,70 +686,181 @@ class StatsDatabase(Dataset):
                 fail("data file (\"%s\") format (%d columns) does not match table (\"%s\") format (%d columns)"
                      % (filename, file_cols, table.name, table_cols), ooc=TypeError)
 
-        def store_data():
-            """
-            stores data of a row to the appropriate table
-            """
+        with open(filename, "r") as f:
+            reader = csv.reader(f)
+            dfile_colnames = next(reader, None)
+            if dfile_colnames is None:
+                return
+            assert_format(dfile_colnames)
+            dfile_colnames = [name.strip() for name in dfile_colnames]
+
+            sql = "INSERT INTO %s(%s) VALUES(%s)" % (table.name, ",".join(dfile_colnames), ",".join(["?"] * table_cols))
+            with BulkInserter(self.conn, sql, batch_size, table.name, progress=DEFAULT_PROGRESS_ROWS) as inserter:
+                while True:
+                    batch = [[d.strip() for d in row] for row in islice(reader, batch_size)]
+                    if not batch:
+                        break
+                    for row in batch:
+                        assert_format(row)
+                    inserter.add_many(batch)
+
+        # map castalia node ids to plan node ids, only for columns marked in table.node_mapping
+        self.__generate_nodemap(node_mapping_file)
+        self.map_nodes(table.name, [(name, None) for name in dfile_colnames
+                                    if table.node_mapping and name in table.node_mapping])
 
-            def map_nodes():
-                """
-                maps castalia node ids to plan node ids, only for columns marked in table.node_mapping
-                """
-                for i in range(0, len(data)):
-                    if dfile_colnames[i] in table.node_mapping:
-                        data[i] = self.__castaliaID_2_planID(data[i])
-
-            sql = "INSERT INTO %s(%s) VALUES(%s)" % (table.name,
-                                                     ",".join(dfile_colnames),
-                                                     ",".join(["?"] * table_cols))
-            for c in table.columns:
-                print(c.name)
-            print(sql)
-            c = self.conn.cursor()
-            data = [d.strip() for d in row]
-            print(data)
-            if self.nodemap:
-                map_nodes()
-            c.execute(sql, tuple(data))
-            self.conn.commit()
+    def load_data_castalia(self, castalia_output_file, table_name="dataTable", node_mapping_file=DEFAULT_NODEMAP_FILE,
+                           batch_size=DEFAULT_BATCH_SIZE):
+        """
+        read data from Castalia output file and store them to an sqlite db in memory
 
-        #
-        # load_data_csv
-        #
+        The file is read lazily, line by line, and rows are inserted in batches of
+        batch_size, all inside a single transaction. Castalia node ids are stored as
+        they are, then mapped to plan node ids by map_castalia_nodes(), unless
+        node_mapping_file is None.
+        """
+        if not os.path.exists(castalia_output_file) or not os.path.isfile(castalia_output_file):
+            fail("Could not load \"%s\" castalia output file, file not found" % castalia_output_file)
 
-        assert isinstance(table, nsdTable)
-        filename = table.filename
-        table_cols = len(table.columns)
+        with open(castalia_output_file, "r") as f, \
+                BulkInserter(self.conn, self.__insert_output_sql(table_name), batch_size, table_name) as inserter:
+            self.__parse_castalia(f, inserter, castalia_output_file)
 
-        if not os.path.exists(filename) or not os.path.isfile(filename):
-            fail("Could not load \"%s\" csv data file, file not found" % filename)
+        if node_mapping_file is not None:
+            self.map_castalia_nodes(table_name, node_mapping_file)
 
-        # generate the castalia to plan node map
-        self.__generate_nodemap(node_mapping_file)
+    def load_data_castalia_runs(self, castalia_output_files, table_name="dataTable",
+                                node_mapping_file=DEFAULT_NODEMAP_FILE, processes=None):
+        """
+        read data from a list of Castalia output files, one per simulation run, and store
+        them to table table_name, which must have a column named run. The rows of each file
+        are stored with the position of the file in the list as their run.
+
+        The files are parsed in parallel by a pool of processes (by default, one per core),
+        each into a temporary database file. These are merged into table table_name in
+        the order of the list, as soon as each one is ready. Finally, node ids are mapped
+        (unless node_mapping_file is None).
+        """
+        for fname in castalia_output_files:
+            if not os.path.exists(fname) or not os.path.isfile(fname):
+                fail("Could not load \"%s\" castalia output file, file not found" % fname)
 
-        with open(filename, "r") as f:
-            reader = csv.reader(f)
-            first_row = True
-            for row in reader:
-                assert_format()
-                if first_row:
-                    dfile_colnames = row
-                    first_row = False
-                else:
-                    store_data()
+        columns = ",".join(a.name for a in self.relations[table_name].attributes if a.name != "run")
+        if processes is None:
+            processes = min(len(castalia_output_files), os.cpu_count() or 1)
+
+        start_time = time.time()
+        tmpdir = tempfile.mkdtemp(prefix="datavis_runs_")
+        try:
+            # workers may not share our working directory, so paths are made absolute
+            jobs = [(os.path.abspath(fname), os.path.join(tmpdir, "run%d.sqlite" % run),
+                     self.relations[table_name].attributes)
+                    for run, fname in enumerate(castalia_output_files)]
+            with Pool(max(processes, 1)) as pool:
+                for run, dbfile in enumerate(pool.imap(_parse_castalia_run, jobs)):
+                    self.conn.commit()
+                    self.conn.execute("ATTACH DATABASE ? AS castalia_run", (dbfile,))
+                    try:
+                        self.conn.execute("INSERT INTO %s(run,%s) SELECT ?,%s FROM castalia_run.dataTable" %
+                                          (table_name, columns, columns), (run,))
+                        self.conn.commit()
+                    finally:
+                        self.conn.execute("DETACH DATABASE castalia_run")
+                    os.remove(dbfile)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        logging.info("Loaded %d runs into %s in %.3f sec, using %d processes",
+                     len(castalia_output_files), table_name, time.time() - start_time, processes)
+
+        if node_mapping_file is not None:
+            self.map_castalia_nodes(table_name, node_mapping_file)
 
-    def load_data_castalia(self, castalia_output_file, table_name="dataTable", node_mapping_file=DEFAULT_NODEMAP_FILE):
+    def __omnetpp_columns(self, table, allowed):
         """
-        read data from Castalia output file and store them to an sqlite db in memory
+        Return the names of the columns of table, checking that they are among
+        the allowed ones.
         """
-        if not os.path.exists(castalia_output_file) or not os.path.isfile(castalia_output_file):
-            fail("Could not load \"%s\" castalia output file, file not found" % castalia_output_file)
+        assert isinstance(table, nsdTable)
+        names = [c.name for c in table.columns]
+        unknown = [name for name in names if name not in allowed]
+        if unknown:
+            fail("table \"%s\" (format %s) has unknown columns %s; allowed columns are %s"
+                 % (table.name, table.format, ",".join(unknown), ",".join(allowed)))
+        return names
+
+    def load_data_vectors(self, table, node_mapping_file=DEFAULT_NODEMAP_FILE):
+        """
+        Load the vectors of an OMNeT++ .vec file (table.filename) to table.
 
-        # generate the castalia to plan node map
-        self.__generate_nodemap(node_mapping_file)
+        Each sample is a row, with columns among VECTOR_COLUMNS: module and node
+        (see omnetpp.split_module), the vector name, and the event number, time
+        and value (as data) of the sample.
 
-        with open(castalia_output_file, "r") as f:
-            lines = f.readlines()
+        The samples are read from the columnar VectorStore of the file, which is
+        built on first use, and inserted with executemany() in a single transaction.
+        """
+        names = self.__omnetpp_columns(table, VECTOR_COLUMNS)
+        store = VectorStore(table.filename).open()
+        sql = "INSERT INTO %s(%s) VALUES(%s)" % (table.name, ",".join(names), ",".join(["?"] * len(names)))
+
+        start_time = time.time()
+        count = 0
+        try:
+            for vector in store.vectors:
+                node, module = split_module(vector["module"])
+                constants = {"module": module, "node": node, "name": vector["name"]}
+                columns = {"event": store.column(vector, "event"), "time": store.column(vector, "time"),
+                           "data": store.column(vector, "value")}
+                iters = [repeat(constants[name]) if name in constants
+                         else columns[name] if columns[name] is not None
+                         else repeat(None)
+                         for name in names]
+                self.conn.executemany(sql, islice(zip(*iters), vector["count"]))
+                count += vector["count"]
+            self.conn.commit()
+        except:
+            self.conn.rollback()
+            raise
+        finally:
+            store.close()
+        elapsed = time.time() - start_time
+        logging.info("Loaded %d samples of %d vectors into %s in %.3f sec (%.0f rows/sec)", count,
+                     len(store.vectors), table.name, elapsed, count / elapsed if elapsed > 0 else float(count))
+
+        if "node" in names and table.node_mapping and "node" in table.node_mapping:
+            self.__generate_nodemap(node_mapping_file)
+            self.map_nodes(table.name, [("node", None)])
+
+    def load_data_scalars(self, table, node_mapping_file=DEFAULT_NODEMAP_FILE, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Load the scalars of an OMNeT++ .sca file (table.filename) to table.
+
+        Each scalar is a row, with columns among SCALAR_COLUMNS: module and node
+        (see omnetpp.split_module), the scalar name and its value (as data).
+        """
+        names = self.__omnetpp_columns(table, SCALAR_COLUMNS)
+        if not os.path.exists(table.filename) or not os.path.isfile(table.filename):
+            fail("Could not load \"%s\" scalar file, file not found" % table.filename)
+        sql = "INSERT INTO %s(%s) VALUES(%s)" % (table.name, ",".join(names), ",".join(["?"] * len(names)))
+
+        with BulkInserter(self.conn, sql, batch_size, table.name) as inserter:
+            for path, name, value in read_scalars(table.filename):
+                node, module = split_module(path)
+                row = {"module": module, "node": node, "name": name, "data": value}
+                inserter.add(tuple(row[n] for n in names))
+
+        if "node" in names and table.node_mapping and "node" in table.node_mapping:
+            self.__generate_nodemap(node_mapping_file)
+            self.map_nodes(table.name, [("node", None)])
+
+    def __parse_castalia(self, lines, inserter, castalia_output_file):
+        """
+        parse the lines of a Castalia output file, adding the rows of the data table to
+        the BulkInserter inserter
+        """
+        def save_output(m, n, i, o, bl, l, v):
+            inserter.add(self.__output_row(m, n, i, o, bl, l, v))
 
         # prepare regex
         r_castalia = re.compile("^Castalia\|\s+(.+)$")
@@ -348,7 +898,7 @@ class StatsDatabase(Dataset):
                 # check for output data
                 m = r_output.match(line)
                 if m:
-                    self.__save_output(module, n, i, o, bl, m.group(2), m.group(1), table_name)
+                    save_output(module, n, i, o, bl, m.group(2), m.group(1))
                     continue
                 else:
                     level = 2
@@ -365,20 +915,7 @@ class StatsDatabase(Dataset):
                 m = r_histogram_values.match(line)
                 if m:
                     vals = m.group(1).split(" ")
-                    size = len(vals) - 1
-                    step = float(histogram_max - histogram_min) / size
-                    curr = histogram_min
-                    if self.__is_int(step): step = int(step)
-                    if self.__is_int(curr): curr = int(curr)
-                    ival = 0
-                    for val in vals:
-                        next = curr + step
-                        if self.__is_int(next): next = int(next)
-                        if next > histogram_max: next = "inf"
-                        self.__save_output(module, n, ival, o, bl, "[" + str(curr) + "," + str(next) + ")", val,
-                                           table_name)
-                        curr += step
-                        ival += 1
+                    inserter.add_many(self.__histogram_rows(module, n, o, bl, histogram_min, histogram_max, vals))
                     level = 2
                     continue
 
@@ -439,6 +976,35 @@ class StatsDatabase(Dataset):
             logging.warning("Parsing file: \"%s\"\nUnknown input at level %s: %s" % (castalia_output_file, level, line))
 
 
+def _parse_castalia_run(job):
+    """
+    Worker of StatsDatabase.load_data_castalia_runs(): parse one Castalia output file
+    into table dataTable of a new database file, without mapping node ids.
+    Return the database file name.
+    """
+    castalia_output_file, dbfile, alist = job
+    ds = StatsDatabase(dbfile=dbfile)
+    try:
+        ds.create_table("dataTable", [a for a in alist if a.name != "run"])
+        ds.load_data_castalia(castalia_output_file, node_mapping_file=None)
+    finally:
+        ds.conn.close()
+    return dbfile
+
+
+def open_results_database(simhome):
+    """
+    Open the persistent results database of the given simulation home, with
+    all of its stored tables. Returns None if there is no results database.
+    """
+    dbfile = os.path.join(simhome, RESULTS_DB_FILE)
+    if not os.path.isfile(dbfile):
+        return None
+    ds = StatsDatabase(dbfile=dbfile)
+    ds.restore_all_tables()
+    return ds
+
+
 class Attribute:
     def __init__(self, name, atype):
         self.name = name
@@ -587,13 +1153,22 @@ class Relation(object):
     def sql_from_clause(self):
         return "FROM " + self.name
 
-    def sql_where_clause(self, where):
+    def sql_condition(self, where):
+        """
+        Return the SQL predicate for where (see sql_select), or "" if there is no condition.
+        """
         if where:
             if isinstance(where, dict):
                 # make it into a list
                 where = [(a, where[a]) for a in where]
             if isinstance(where, list):
-                return " WHERE " + ' AND '.join([self.__map_value(attr, value) for attr, value in where])
+                return ' AND '.join([self.__map_value(attr, value) for attr, value in where])
+        return ""
+
+    def sql_where_clause(self, where):
+        cond = self.sql_condition(where)
+        if cond:
+            return " WHERE " + cond
         return ""
 
     def sql_order_by_clause(self, order):
@@ -616,6 +1191,42 @@ class Relation(object):
         logging.debug("Relation.sql_select: " + sql)
         return sql
 
+    def sql_pivot(self, key, value, wheres):
+        """
+        Return a query for the rows (key, value, in_1, ..., in_n) of the rows satisfying
+        some of wheres, ordered by key, where in_i is 1 if the row satisfies wheres[i], else 0.
+        The rows are pivoted by key, with a column per condition, by the caller (see
+        Plot.histogram_values).
+        """
+        conds = [self.sql_condition(where) or "1" for where in wheres]
+        columns = ["(%s)" % cond for cond in conds]
+        sql = ' '.join([self.sql_select_clause([key, value] + columns, False),
+                        self.sql_from_clause(),
+                        " WHERE " + " OR ".join(columns),
+                        self.sql_order_by_clause([key])
+        ])
+        logging.debug("Relation.sql_pivot: " + sql)
+        return sql
+
+    def sql_select_groups(self, axes, alist, where=None, order=[]):
+        """
+        Return a query for axes+alist over the groups of rows with the same values
+        of axes, for each group having some row which satisfies where.
+        The rows are ordered by axes, then by order.
+        """
+        if isinstance(where, dict):
+            where = [(a, where[a]) for a in where]
+        if all(attr in axes for attr, value in where or []):
+            return self.sql_select(axes + alist, where=where, order=axes + order)
+
+        sql = ' '.join([self.sql_select_clause(axes + alist, False),
+                        self.sql_from_clause(),
+                        "JOIN (%s) USING (%s)" % (self.sql_select(axes, where=where, distinct=True), ','.join(axes)),
+                        self.sql_order_by_clause(axes + order)
+        ])
+        logging.debug("Relation.sql_select_groups: " + sql)
+        return sql
+
     def scheme(self):
         return ''.join([self.name, '(', ','.join("%s %s" % (a.name, a.type) for a in self.attributes), ')'])
 
@@ -1,7 +1,7 @@
 import ast
 from models.nsdplot import PlotModel, DerivedTable, Table,  Column, ColumnExpr, ColumnRef, \
     ConstantExpr, Operator, \
-    AVG, COUNT, MAX, MIN, SUM, \
+    AVG, COUNT, MAX, MIN, SUM, STDDEV, CI95, \
     EQ, NOTEQ, LESS, LESS_EQ, GREATER, GREATER_EQ, \
     LAND, LOR, \
     PLUS, MINUS, DIV, MULT
@@ -73,6 +73,10 @@ class ViewsPlotsDecoder:
         if "stat_type" not in d:
             fail("\"stat_type\" must be specified")
 
+        max_points = ViewsPlotsDecoder.get_attr("max_points", d)
+        if max_points is not None and (not isinstance(max_points, int) or max_points < 0 or max_points == 1):
+            fail("\"max_points\" must be 0 (no limit) or at least 2")
+
         pm = PlotModel(
             d["model_type"],
             d["stat_type"],
@@ -91,7 +95,9 @@ class ViewsPlotsDecoder:
             ViewsPlotsDecoder.get_attr("logscale", d),
             ViewsPlotsDecoder.get_attr("grid", d),
             ViewsPlotsDecoder.get_attr("key", d),
-            ViewsPlotsDecoder.get_attr("unit", d))
+            ViewsPlotsDecoder.get_attr("unit", d),
+            ViewsPlotsDecoder.get_attr("renderer", d),
+            max_points)
         return pm
 
     def gen_columns(self, d, base_tables=None, cols_of_data_table=False):
@@ -282,6 +288,8 @@ def gen_types(columns=None, tables=None):
         "MAX": "function",
         "MIN": "function",
         "SUM": "function",
+        "STDDEV": "function",
+        "CI95": "function",
         "dataTable": "table"
     }
 
@@ -396,7 +404,7 @@ class ExprGenNodeVisitor(ast.NodeVisitor):
 
     @staticmethod
     def get_func_by_name(name):
-        funcs = [AVG, COUNT, MAX, MIN, SUM, LAND, LOR]
+        funcs = [AVG, COUNT, MAX, MIN, SUM, STDDEV, CI95, LAND, LOR]
         for f in funcs:
             if name.lower() == f.name.lower():
                 return f
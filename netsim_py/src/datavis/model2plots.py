@@ -4,13 +4,24 @@
 
 from models.nsdplot import PlotModel, Table, DerivedTable, ColumnExpr, \
     ConstantExpr, ColumnRef, Operator
-from datavis.database import StatsDatabase
-from datavis.create_plot import make_plot, PNG, default_title
+from datavis.database import StatsDatabase, DEFAULT_NODEMAP_FILE
+from datavis.create_plot import make_plot, PNG, default_title, GnuplotSession
 from datavis.results2json import plot2json, JsonOutput, parameter2json
-from models.validation import Context, warn, inform, fail, fatal
+from datavis.parse_cache import get_parse_cache
+from datavis.render_cache import get_render_cache
+from datavis.planner import create_indexes, plan_materialization
+from models.validation import Context, Process, warn, inform, fail, fatal, scope_stack
 from datavis.database import Attribute
+from runner.config import datavis_workers
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import traceback
+import threading
+import sqlite3
+from types import SimpleNamespace
+import tempfile
+import os
+import glob
 
 
 def collect_tables(tables, tlol, table):
@@ -114,39 +125,46 @@ def derived2sql(dt):
     return sql
 
 
-def create_view_for_derived(ds, dt):
+def create_view_for_derived(ds, dt, materialize=False):
     """
-    Create an SQL view in ds for given DerivedTable dt.
+    Create an SQL view in ds for given DerivedTable dt. If materialize is true,
+    the view is materialized, i.e., created as a table.
     """
     sql = derived2sql(dt)
     try:
-        ds.create_view(dt.name, sql)
+        if materialize:
+            ds.create_table_as(dt.name, sql)
+        else:
+            ds.create_view(dt.name, sql)
     except BaseException as ex:
         # this should be here to catch unhandled sql syntax errors
         fail(ex)
 
 
-def create_table(ds, dt):
+def create_table(ds, dt, castalia_data=None):
     """
     Creates a Table in ds for given Table dt
     """
 
     assert isinstance(dt, Table)
-    alist = [Attribute(c.name, c.type) for c in dt.columns]
-    ds.create_table(dt.name, alist)
+    ds.create_table(dt.name, table_attributes(dt, castalia_data))
 
 
-def create_plot_for_model(pm, ds, jo):
+def create_plot_for_model(pm, ds, jo, session=None, cache=None, parameters=None):
     """
     Create a plot/parameter(statistic) for given PlotModel and StatsDatabase ds
     add generated values to JsonOutput jo
+    plots are rendered through GnuplotSession session, if given,
+    and looked up in (and added to) RenderCache cache, if given
+    parameters evaluated together with others are taken from ParameterGroups parameters, if given
     """
     assert isinstance(pm, PlotModel)
     terminal = PNG()
     output = "DEFAULT"
     plot = make_plot(ds.relations[pm.rel.name], pm.x, pm.y, pm.axes, pm.select, pm.title, pm.style,
                      pm.legend, pm.xlabel, pm.ylabel, pm.x_range, pm.y_range,
-                     terminal, pm.logscale, pm.grid, pm.key, output)
+                     terminal, pm.logscale, pm.grid, pm.key, output, renderer=pm.renderer,
+                     max_points=pm.max_points)
 
     if pm.title == "DEFAULT":
         if pm.model_type == "plot":
@@ -158,13 +176,15 @@ def create_plot_for_model(pm, ds, jo):
 
     if pm.model_type == "plot":
         # generate the plot to the current working directory
-        if plot.make_plot():
+        if plot.make_plot(session=session, cache=cache):
             # add plot to JsonOutput jo
             plot2json(jo, pm, plot.output + ".png")
             inform("generated successfully")
     elif pm.model_type == "parameter":
         # generate the parameter (statistic)
-        res = plot.make_parameter()
+        res = parameters.rows(pm, ds) if parameters is not None else None
+        if res is None:
+            res = plot.make_parameter()
         if len(res) != 0 and res[0] != (None,):
             # add the parameter to JsonOutput jo
             parameter2json(jo, pm, res)
@@ -177,66 +197,383 @@ def create_plot_for_model(pm, ds, jo):
         fail("invalid model type: \"%s\"" % pm.model_type)
 
 
-def populate_table(ds, table, castalia_data=None):
+def castalia_runs(table, castalia_data=None):
+    """
+    Return the list of Castalia output files to be loaded as separate runs into
+    dataTable-format table, or None if the table is loaded from a single file.
+    castalia_data may be a list of files, one per run. Else, if the filename of the
+    table is a glob pattern (e.g., "simout-*.txt"), the matching files in the
+    simulation home (the current directory) are the runs, in name order. A single
+    file is also loaded as a run, when the table declares a run column.
+    """
+    if isinstance(castalia_data, (list, tuple)):
+        return list(castalia_data)
+    if castalia_data is None and table.filename and glob.has_magic(table.filename):
+        runs = sorted(glob.glob(table.filename))
+        if not runs:
+            fail("no Castalia output file matches \"%s\"" % table.filename)
+        return runs
+    if "run" in table.col:
+        return [table.filename if castalia_data is None else castalia_data]
+    return None
+
+
+def table_attributes(table, castalia_data=None):
+    """
+    Return the list of Attributes of table in the database. A dataTable-format table
+    loaded from several runs has an extra column run, unless it declares one.
+    """
+    alist = [Attribute(c.name, c.type) for c in table.columns]
+    if table.format == "dataTable" and castalia_runs(table, castalia_data) is not None \
+            and "run" not in table.col:
+        alist.append(Attribute("run", "INT"))
+    return alist
+
+
+def table_sources(table, castalia_data=None):
+    """
+    Return the list of files from which the data of table are loaded.
+    The node mapping file is not among them, since a stored table is re-mapped
+    (see StatsDatabase.restore_table) when it changes.
+    """
+    if table.format == "dataTable":
+        runs = castalia_runs(table, castalia_data)
+        if runs is not None:
+            return runs
+        datafile = table.filename if castalia_data is None else castalia_data
+    else:
+        datafile = table.filename
+    return [datafile]
+
+
+def load_table(ds, table, castalia_data=None, parse_cache=None):
+    """
+    Create and populate table in database ds. If ds is a persistent database
+    which already holds the table, loaded from the same sources, it is reused.
+    """
+    alist = table_attributes(table, castalia_data)
+    sources = table_sources(table, castalia_data)
+    if ds.restore_table(table.name, alist, sources, DEFAULT_NODEMAP_FILE) is not None:
+        inform("restored from the results database")
+        return
+    create_table(ds, table, castalia_data)
+    populate_table(ds, table, castalia_data, parse_cache)
+    ds.stamp_table(table.name, alist, sources)
+
+
+def populate_table(ds, table, castalia_data=None, parse_cache=None):
     """
     load data appropriate for this table in database ds
     if castalia_data is set, override the table's filename
+    if castalia_data is a list, each file in it is loaded as a separate run
+    if parse_cache is given, castalia output is read from and stored into it
     """
-    if table.format == "dataTable":
-        ds.load_data_castalia(table.filename if castalia_data is None else castalia_data, table.name)
+    runs = castalia_runs(table, castalia_data) if table.format == "dataTable" else None
+    if runs is not None:
+        ds.load_data_castalia_runs(runs, table.name)
+        inform("loaded %d runs" % len(runs))
+    elif table.format == "dataTable":
+        datafile = table.filename if castalia_data is None else castalia_data
+        if parse_cache is not None and os.path.isfile(datafile):
+            if not parse_cache.restore(ds, datafile, table.name):
+                ds.load_data_castalia(datafile, table.name, node_mapping_file=None)
+                parse_cache.store(ds, datafile, table.name)
+            ds.map_castalia_nodes(table.name, DEFAULT_NODEMAP_FILE)
+        else:
+            ds.load_data_castalia(datafile, table.name)
     elif table.format == "csv":
         ds.load_data_csv(table)
+    elif table.format == "vector":
+        ds.load_data_vectors(table)
+    elif table.format == "scalar":
+        ds.load_data_scalars(table)
     else:
         fail("unknown format %s" % table.format)
 
 
-def model2plots(pml, jo, castalia_data=None):
+def parameter_group_key(pm, ds):
+    """
+    Return the key of the parameter PlotModels which can be evaluated together with
+    PlotModel pm (see ParameterGroups), or None if pm is evaluated by itself.
+    """
+    if pm.model_type != "parameter" or pm.axes is not None or not pm.x or not pm.y \
+            or pm.rel.name not in ds.relations:
+        return None
+    return pm.rel.name, tuple(c.name for c in pm.x), ds.relations[pm.rel.name].sql_condition(pm.select)
+
+
+class ParameterGroups:
+    """
+    Evaluates the parameter PlotModels over the same relation, with the same x and
+    selection, by a single query over the columns of all their y's, instead of a
+    query per parameter. A group is evaluated when the first of its parameters is
+    created, and its results are kept until the last of them is created.
+
+    The groups may be evaluated by several threads, each with its own database.
+    """
+
+    def __init__(self, pml, ds):
+        self.groups = {}
+        for pm in pml:
+            key = parameter_group_key(pm, ds)
+            if key is not None:
+                self.groups.setdefault(key, []).append(pm)
+        self.groups = {key: group for key, group in self.groups.items() if len(group) > 1}
+        self.pending = {key: len(group) for key, group in self.groups.items()}
+        self.locks = {key: threading.Lock() for key in self.groups}
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def __evaluate(self, key, ds):
+        """
+        Return (columns, rows) for the group with the given key, or None if the query failed.
+        """
+        rel = ds.relations[key[0]]
+        group = self.groups[key]
+        xcols = list(key[1])
+        columns = xcols + list(dict.fromkeys(c.name for pm in group for c in pm.y))
+        try:
+            rows = ds.conn.execute(rel.sql_select(columns, where=group[0].select, order=xcols)).fetchall()
+        except sqlite3.Error as ex:
+            logging.warning("Could not evaluate the parameters of %s together: %s", rel.name, ex)
+            return None
+        logging.info("Evaluated %d parameters of %s by a single query", len(group), rel.name)
+        return columns, rows
+
+    def rows(self, pm, ds):
+        """
+        Return the rows of parameter pm (as make_parameter does), or None if pm is not evaluated
+        as part of a group. The group is evaluated over StatsDatabase ds, if it has not been already.
+        """
+        key = parameter_group_key(pm, ds)
+        if key not in self.groups:
+            return None
+        with self.locks[key]:
+            if key not in self.results:
+                self.results[key] = self.__evaluate(key, ds)
+            result = self.results[key]
+        with self.lock:
+            self.pending[key] -= 1
+            if self.pending[key] == 0:
+                del self.results[key]
+        if result is None:
+            return None
+
+        columns, rows = result
+        nx = len(key[1])
+        ycols = [columns.index(c.name) for c in pm.y]
+        return [row[:nx] + tuple(row[i] for i in ycols) for row in rows]
+
+
+class RecordCollector(logging.Handler):
+    """
+    A logging handler keeping the records it handles in a list.
+    """
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class ParallelPlots:
+    """
+    Generates plots and parameters with a bounded pool of worker threads.
+
+    The statistics database is shared through a file (the persistent database,
+    or a snapshot of the in-memory one); each worker opens it read-only and has
+    its own gnuplot session; the render cache, if any, is shared. Each PlotModel is processed in its own Process scope,
+    with a JsonOutput and a logger of its own. The caller then merges the results
+    and re-logs the messages in PlotModel order, so the output is the same as
+    that of the sequential loop.
+    """
+
+    def __init__(self, ds, workers, cache=None, parameters=None):
+        self.ds = ds
+        self.workers = workers
+        self.cache = cache
+        self.parameters = parameters
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.resources = []
+        self.snapshot = None
+        if ds.dbfile is not None:
+            ds.conn.commit()
+            self.dbfile = ds.dbfile
+        else:
+            fd, self.snapshot = tempfile.mkstemp(suffix=".sqlite", prefix="datavis_snapshot_")
+            os.close(fd)
+            ds.snapshot(self.snapshot)
+            self.dbfile = self.snapshot
+
+    def __worker(self):
+        """
+        Return the resources of the current worker thread, creating them on first use.
+        """
+        w = getattr(self.local, "worker", None)
+        if w is None:
+            with self.lock:
+                w = SimpleNamespace(ds=self.ds.open_copy(self.dbfile), session=GnuplotSession(),
+                                    logger=logging.getLogger("datavis.worker%d" % len(self.resources)))
+                self.resources.append(w)
+            self.local.worker = w
+        return w
+
+    def create_plot(self, pm, jo_type, simulation_id):
+        """
+        Create the plot/parameter for pm in the current (worker) thread.
+        Return a JsonOutput with its results, the list of logged records and a success flag.
+        """
+        w = self.__worker()
+        jo = JsonOutput(jo_type, simulation_id)
+        collector = RecordCollector()
+        with Process(logger=w.logger) as p:
+            p.addScopeHandler(collector)
+            with Context(view=pm.rel.name, plot=pm.title):
+                create_plot_for_model(pm, w.ds, jo, w.session, self.cache, self.parameters)
+        return jo, collector.records, p.success
+
+    def run(self, pml, jo, progress=None):
+        """
+        Create the plots/parameters for the PlotModels in pml, adding the results to jo.
+        If given, progress is called as in model2plots.
+        """
+        logger = scope_stack.top().logger if scope_stack else logging.getLogger()
+        # the titles before any defaults are filled in by the workers
+        titles = [pm.title for pm in pml]
+        with ThreadPoolExecutor(self.workers) as pool:
+            futures = [pool.submit(self.create_plot, pm, jo.type, jo.simulation_id)
+                       if pm.rel.name in self.ds.relations else None
+                       for pm in pml]
+            try:
+                for pm, title, future, flush in zip(pml, titles, futures, progress_flushes(pml)):
+                    if future is None:
+                        fail("View %s does not exist in database, some error occurred during its generation"
+                             % pm.rel.name)
+                    pjo, records, success = future.result()
+                    for record in records:
+                        logger.handle(record)
+                    jo.merge(pjo)
+                    if not success:
+                        with Context(view=pm.rel.name, plot=title):
+                            fail()
+                    if progress is not None:
+                        progress(jo, flush)
+            finally:
+                for future in futures:
+                    if future is not None:
+                        future.cancel()
+
+    def close(self):
+        for w in self.resources:
+            w.session.close()
+            w.ds.conn.close()
+        self.resources = []
+        if self.snapshot is not None:
+            os.remove(self.snapshot)
+            self.snapshot = None
+
+
+def progress_flushes(pml):
+    """
+    Return a list with a flag for each PlotModel in pml (ordered with the parameters first),
+    which is true for the last parameter: the parameters are cheap, so their results are
+    published as soon as they are all available.
+    """
+    return [pm.model_type == "parameter" and (i + 1 == len(pml) or pml[i + 1].model_type != "parameter")
+            for i, pm in enumerate(pml)]
+
+
+def model2plots(pml, jo, castalia_data=None, dbfile=None, workers=None, progress=None):
     """Accepts a list of PlotModel objects and creates the corresponding plots/parameters(statistics).
+
+    If dbfile is given, the statistics are kept in a persistent database in that file,
+    and tables already loaded in it are reused.
+    If workers is more than 1 (by default, see datavis_workers), plots and parameters
+    are generated in parallel, by that many worker threads.
+    The parameters are generated before the plots. If progress is given, progress(jo, flush)
+    is called after each plot/parameter is added to jo, with flush true right after the
+    last parameter, so that partial results can be published.
     """
 
     assert isinstance(pml, list)
     assert all(isinstance(pm, PlotModel) for pm in pml)
+    pml = sorted(pml, key=lambda pm: pm.model_type != "parameter")
 
     # Collect a list of tables, ordered according to dependence
     table_list = collect_tables_for_pml(pml)
 
     # Create database
-    ds = StatsDatabase()
+    ds = StatsDatabase(dbfile=dbfile)
+    parse_cache = get_parse_cache()
 
     # create tables
     for table in table_list:
         if isinstance(table, Table) and not isinstance(table, DerivedTable):
             with Context(view=table.name):
-                create_table(ds, table)
-                populate_table(ds, table, castalia_data)
+                load_table(ds, table, castalia_data, parse_cache)
+    if parse_cache is not None:
+        parse_cache.close()
 
+    # decide which views to materialize, and create indexes on the base tables,
+    # as needed by the views and plots
+    materialized = plan_materialization(ds, pml, table_list)
+    create_indexes(ds, pml, table_list, materialized)
 
     # create views
     for table in table_list:
         if isinstance(table, DerivedTable):
             with Context(view=table.name):
-                create_view_for_derived(ds, table)
+                create_view_for_derived(ds, table, materialize=table.name in materialized)
 
-    # create plots
-    for pm in pml:
-        if pm.rel.name in ds.relations:
-            with Context(view=pm.rel.name, plot=pm.title):
-                create_plot_for_model(pm, ds, jo)
-        else:
-            fail("View %s does not exist in database, some error occurred during its generation" % pm.rel.name)
+    # create indexes on the materialized views
+    if materialized:
+        create_indexes(ds, pml, table_list, materialized, tables=materialized)
 
-
-def create_simulation_results(simulation_id, plotModels, castalia_data=None):
+    if workers is None:
+        workers = datavis_workers()
+    cache = get_render_cache()
+    parameters = ParameterGroups(pml, ds)
+    try:
+        if workers > 1:
+            plotter = ParallelPlots(ds, workers, cache, parameters)
+            try:
+                plotter.run(pml, jo, progress)
+            finally:
+                plotter.close()
+            return
+
+        # create plots, all rendered by a single gnuplot process
+        with GnuplotSession() as session:
+            for pm, flush in zip(pml, progress_flushes(pml)):
+                if pm.rel.name in ds.relations:
+                    with Context(view=pm.rel.name, plot=pm.title):
+                        create_plot_for_model(pm, ds, jo, session, cache, parameters)
+                else:
+                    fail("View %s does not exist in database, some error occurred during its generation"
+                         % pm.rel.name)
+                if progress is not None:
+                    progress(jo, flush)
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+def create_simulation_results(simulation_id, plotModels, castalia_data=None, dbfile=None, progress=None):
     """
     generates plots, calculates statistics, ands returns all that info in json format
     :param simulation_id: the id of the current simulation
     :param plotModels: this object describes the plots and parameters (statistics) to be generated
-    :param castalia_data: this is the path to the castalia output file
+    :param castalia_data: this is the path to the castalia output file, or a list of paths
+                          of the output files of several runs
+    :param dbfile: if given, the path of a persistent results database
+    :param progress: if given, called with the partial results (see model2plots)
     :return: the results in json format, a python dictionary
     """
     # create the JsonOutput object that will hold all our results in json format
     jo = JsonOutput("simulation_results", simulation_id)
     # generate plots and parameters (statistics), add the results to JsonOutput jo
-    model2plots(plotModels, jo, castalia_data)
+    model2plots(plotModels, jo, castalia_data, dbfile, progress=progress)
 
     return jo.get_json()
@@ -0,0 +1,213 @@
+'''
+Reading OMNeT++ result files (.vec and .sca).
+
+Castalia simulations record vectors in Castalia-statistics.vec and scalars
+in Castalia-statistics.sca (see the omnetpp.ini preamble in castaliagen).
+
+Vector files can hold millions of samples, so they are parsed only once,
+in a streaming fashion, into a VectorStore: a directory next to the .vec
+file holding, for each vector, its event numbers, times and values as
+flat binary columns (arrays of 64-bit ints/doubles). An index of the
+vectors by module and name is kept in the directory. The store is rebuilt
+whenever the .vec file changes; otherwise, the columns are read through
+memory maps, without any text parsing.
+'''
+
+import os
+import re
+import mmap
+import json
+import shlex
+import shutil
+import logging
+from array import array
+
+from models.validation import fail
+
+
+# the suffix of the VectorStore directory of a .vec file
+STORE_SUFFIX = ".columns"
+STORE_INDEX = "index.json"
+
+# Bump this whenever the layout of the VectorStore changes
+STORE_VERSION = 1
+
+# the array typecodes of the vector columns
+COLUMN_TYPES = {"event": "q", "time": "d", "value": "d"}
+
+# the vector data columns of the .vec format, by their letter in the vector declaration
+VEC_COLUMNS = {"E": "event", "T": "time", "V": "value"}
+
+# the number of buffered samples (over all vectors) which causes the buffers to be written out
+FLUSH_SAMPLES = 1 << 20
+
+# Castalia module paths: SN.node[<node>].<module>
+r_node_module = re.compile(r"^[^.]+\.node\[(\d+)\]\.(.+)$")
+
+
+def split_line(line):
+    """
+    Split a line of an OMNeT++ result file into fields, honoring quotes
+    """
+    if '"' in line:
+        return shlex.split(line)
+    return line.split()
+
+
+def split_module(path):
+    """
+    Return (node, module) for an OMNeT++ module path. For modules inside
+    a Castalia node (SN.node[3].Communication.Radio) these are the node index
+    and the module path inside the node. For other modules, node is None.
+    """
+    m = r_node_module.match(path)
+    if m:
+        return int(m.group(1)), m.group(2)
+    return None, path
+
+
+class VectorStore:
+    """
+    The columnar store of the vectors of a .vec file.
+
+    vectors is the list of vector descriptions, each a dict with keys
+    id, module (the full module path), name, columns and count.
+    """
+
+    def __init__(self, vecfile):
+        self.vecfile = vecfile
+        self.path = vecfile + STORE_SUFFIX
+        self.vectors = None
+        self.__maps = []
+
+    def signature(self):
+        st = os.stat(self.vecfile)
+        return [STORE_VERSION, st.st_size, st.st_mtime_ns]
+
+    def open(self):
+        """
+        Open the store, building it first if it is missing or stale.
+        """
+        if not os.path.isfile(self.vecfile):
+            fail("Could not load \"%s\" vector file, file not found" % self.vecfile)
+        index_file = os.path.join(self.path, STORE_INDEX)
+        if os.path.isfile(index_file):
+            with open(index_file, "r") as f:
+                index = json.load(f)
+            if index["signature"] == self.signature():
+                self.vectors = index["vectors"]
+                return self
+        self.build()
+        return self
+
+    def build(self):
+        """
+        Parse the .vec file into the store.
+        """
+        logging.info("Building the vector store of %s", self.vecfile)
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path)
+        signature = self.signature()
+
+        vectors = {}
+        buffers = {}
+        buffered = 0
+
+        def flush():
+            for vid, cols in buffers.items():
+                for col, buf in cols.items():
+                    with open(self.column_file(vid, col), "ab") as f:
+                        buf.tofile(f)
+                    del buf[:]
+
+        with open(self.vecfile, "r") as f:
+            for line in f:
+                if not line or not line[0].isdigit():
+                    if line.startswith("vector "):
+                        fields = split_line(line)
+                        vid = int(fields[1])
+                        spec = fields[4] if len(fields) > 4 else "TV"
+                        columns = [VEC_COLUMNS[c] for c in spec if c in VEC_COLUMNS]
+                        vectors[vid] = {"id": vid, "module": fields[2], "name": fields[3],
+                                        "columns": columns, "count": 0}
+                        buffers[vid] = {col: array(COLUMN_TYPES[col]) for col in columns}
+                    # all other lines (version, run, attr, param, ...) are ignored
+                    continue
+
+                fields = line.split()
+                vid = int(fields[0])
+                cols = buffers.get(vid)
+                if cols is None:
+                    logging.warning("Sample of undeclared vector %d in %s", vid, self.vecfile)
+                    continue
+                for col, value in zip(vectors[vid]["columns"], fields[1:]):
+                    cols[col].append(int(value) if col == "event" else float(value))
+                vectors[vid]["count"] += 1
+                buffered += 1
+                if buffered >= FLUSH_SAMPLES:
+                    flush()
+                    buffered = 0
+        flush()
+
+        self.vectors = [vectors[vid] for vid in sorted(vectors)]
+        tmp = os.path.join(self.path, STORE_INDEX + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"signature": signature, "vectors": self.vectors}, f)
+        os.replace(tmp, os.path.join(self.path, STORE_INDEX))
+        logging.info("Stored %d vectors, %d samples", len(self.vectors), sum(v["count"] for v in self.vectors))
+
+    def column_file(self, vid, col):
+        return os.path.join(self.path, "%d.%s" % (vid, col))
+
+    def find(self, module=None, name=None):
+        """
+        Return the vectors with the given module path and/or name.
+        """
+        return [v for v in self.vectors
+                if (module is None or v["module"] == module) and (name is None or v["name"] == name)]
+
+    def column(self, vector, col):
+        """
+        Return the column col ("event", "time" or "value") of a vector as a sequence,
+        memory-mapped from the store. Missing columns are returned as None.
+        """
+        if col not in vector["columns"]:
+            return None
+        if vector["count"] == 0:
+            return array(COLUMN_TYPES[col])
+        with open(self.column_file(vector["id"], col), "rb") as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__maps.append(m)
+        return memoryview(m).cast(COLUMN_TYPES[col])
+
+    def close(self):
+        for m in self.__maps:
+            try:
+                m.close()
+            except BufferError:
+                # a memoryview is still alive; the map is released with it
+                pass
+        self.__maps = []
+
+
+def read_scalars(scafile):
+    """
+    Generate (module path, name, value) for the scalars of a .sca file.
+    The fields of statistic objects are generated as scalars named
+    "<statistic>:<field>". Histogram bins are ignored.
+    """
+    statistic = None
+    with open(scafile, "r") as f:
+        for line in f:
+            if line.startswith("scalar "):
+                fields = split_line(line)
+                yield fields[1], fields[2], float(fields[3])
+                statistic = None
+            elif line.startswith("statistic "):
+                fields = split_line(line)
+                statistic = (fields[1], fields[2])
+            elif line.startswith("field ") and statistic is not None:
+                fields = split_line(line)
+                yield statistic[0], "%s:%s" % (statistic[1], fields[1]), float(fields[2])
+            elif not line.startswith(("bin ", "attr ")):
+                statistic = None
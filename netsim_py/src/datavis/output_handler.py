@@ -1,22 +1,183 @@
 import json
-import base64
 import logging
+import os
 import sys
+import time
 from datavis.json2plots import ViewsPlotsDecoder
 from datavis.model2plots import create_simulation_results
 from datavis.datavis_logger import DatavisProcess
 from models.validation import inform
 from datavis.results2json import JsonOutput
+from datavis.database import RESULTS_DB_FILE
+from runner.config import datavis_results_db
+from runner.dpcmrepo import Conflict
 
 from simgen.datastore import context
 
 
 logger = logging.getLogger('datavis')
 
+# The number of attempts made to upload each plot file
+UPLOAD_ATTEMPTS = 3
+
+# The delay (in seconds) before the first retry of a failed upload; it doubles with each retry
+UPLOAD_RETRY_DELAY = 1.0
+
+
+class AttachmentUploader:
+    """
+    Uploads files as attachments of the root object of a datastore, one at a
+    time, each one streamed with a request of its own.
+
+    Every upload makes a new revision of the root object, which the next upload
+    must name, so the uploads are sequential. An upload which conflicts with a
+    concurrent update of the object is retried with its latest revision; other
+    failures are retried up to UPLOAD_ATTEMPTS times per file.
+    """
+
+    def __init__(self, datastore, rev):
+        self.datastore = datastore
+        self.rev = rev
+
+    def upload(self, fname, content_type):
+        """
+        Upload a single file, as attachment fname.
+        """
+        failures = 0
+        while True:
+            try:
+                with open(fname, 'rb') as f:
+                    self.rev = self.datastore.put_root_attachment(fname, f, content_type, self.rev)
+                return
+            except (FileNotFoundError, PermissionError, NotImplementedError):
+                raise
+            except Exception as ex:
+                failures += 1
+                if failures >= UPLOAD_ATTEMPTS:
+                    raise
+                if isinstance(ex, Conflict):
+                    # someone else updated the root object
+                    self.rev = self.datastore.get_root_object()['_rev']
+                else:
+                    logging.warning("Failed to upload %s (%s), retrying", fname, ex)
+                    time.sleep(UPLOAD_RETRY_DELAY * 2 ** (failures - 1))
+
+    def upload_all(self, files):
+        """
+        Upload the given list of (file name, content type) pairs.
+        Return the list of the files which could not be uploaded.
+        """
+        failed = []
+        for fname, content_type in files:
+            try:
+                self.upload(fname, content_type)
+            except Exception:
+                logging.exception("Cannot upload %s", fname)
+                failed.append(fname)
+        return failed
+
+
+# The fields of the SIMOUTPUT object which hold the simulation results
+RESULT_FIELDS = ("node_plot_results", "node_parameter_results", "network_plot_results",
+                 "network_parameter_results", "node_2_node_results")
+
+# The minimum time (in seconds) between two publications of partial results
+PUBLISH_INTERVAL = 10.0
+
+# The number of attempts made to update the SIMOUTPUT object, when it is updated concurrently
+PUBLISH_ATTEMPTS = 5
+
+
+class ResultsPublisher:
+    """
+    Publishes the results of a simulation into the SIMOUTPUT object (the root object
+    of the datastore), progressively, while they are being generated.
+
+    Partial results are published at most once per PUBLISH_INTERVAL seconds, so that
+    the updates for several plots are coalesced into one, except when they are flushed
+    (as model2plots does once all the parameters are ready). Each publication uploads
+    the plot files not uploaded before; the object lists only the plots whose files
+    were uploaded. An update that conflicts with a concurrent update of the object is
+    applied again on its latest revision.
+    """
+
+    def __init__(self, datastore, interval=PUBLISH_INTERVAL):
+        self.datastore = datastore
+        self.interval = interval
+        self.uploaded = set()
+        self.published = False
+        self.last_time = None
+
+    def progress(self, jo, flush=False):
+        """
+        Publish the partial results in JsonOutput jo, unless partial results were published
+        recently and flush is false. This is the progress callback of model2plots.
+
+        The new plot files are uploaded before this returns, so plot generation
+        waits for the uploads; PUBLISH_INTERVAL bounds how often this happens.
+        """
+        if not flush and self.last_time is not None and time.monotonic() - self.last_time < self.interval:
+            return
+        try:
+            self.publish(jo.get_json())
+        except Exception:
+            # the final results will be published anyway
+            logging.exception("Cannot publish partial results")
+
+    def publish(self, results_json, status=None):
+        """
+        Publish results_json (as returned by JsonOutput.get_json()) and upload the new
+        plot files. If status is given, it becomes the simulation status, once all the
+        plot files are uploaded. Plots whose files could not be uploaded are left out.
+        Return the updated object.
+        """
+        plots = results_json['network_plot_results']
+        files = [fdecl['file_id'] for fdecl in plots if fdecl['file_id'] not in self.uploaded]
+
+        fields = {field: results_json[field] for field in RESULT_FIELDS}
+        fields["type"] = "simoutput"
+        fields["network_plot_results"] = [fdecl for fdecl in plots if fdecl['file_id'] in self.uploaded]
+        if not self.published:
+            # the plots of an earlier run are dropped
+            fields["_attachments"] = {}
+        if status is not None and not files:
+            fields["simulation_status"] = status
+        doc = self.update(fields)
+        self.published = True
+        self.last_time = time.monotonic()
+
+        if files:
+            uploader = AttachmentUploader(self.datastore, doc.get('_rev'))
+            failed = uploader.upload_all([(fname, 'image/png') for fname in files])
+            self.uploaded.update(fname for fname in files if fname not in failed)
+            if failed:
+                logging.error("%d of %d plot files could not be uploaded", len(failed), len(files))
+
+            # list the uploaded plots, on the latest revision
+            fields = {"network_plot_results": [fdecl for fdecl in plots if fdecl['file_id'] in self.uploaded]}
+            if status is not None:
+                fields["simulation_status"] = status
+            doc = self.update(fields)
+            self.last_time = time.monotonic()
+        return doc
+
+    def update(self, fields):
+        """
+        Update the root object with the given fields and return it.
+        """
+        for attempt in range(1, PUBLISH_ATTEMPTS + 1):
+            try:
+                return self.datastore.update_root_object(fields)
+            except Conflict:
+                if attempt == PUBLISH_ATTEMPTS:
+                    raise
+                logging.info("The simulation results were updated concurrently, updating again")
+
 
 class SimOutputHandler:
-    def __init__(self):
+    def __init__(self, publisher=None):
         self.status = 'FINISHED'
+        self.publisher = publisher if publisher is not None else ResultsPublisher(context.datastore)
 
     def finish_job(self, results_json, fileloc):
         writeto_logstatistcs(fileloc)
@@ -35,7 +196,8 @@ class SimOutputHandler:
         #
 
     def create_null_SIMOUTPUT(self):
-        data = context.datastore.get_root_object()
+        datastore = self.publisher.datastore
+        data = datastore.get_root_object()
         try:
             data["simulation_status"] = self.status
             data["node_plot_results"] = []
@@ -44,10 +206,12 @@ class SimOutputHandler:
             data["network_parameter_results"] = []
             data["node_2_node_results"] = []
             data["type"] = "simoutput"
+            # drop the plots of partial results published before the abort
+            data["_attachments"] = {}
 
             # Write json data to SIMOUTPUTx
             logging.info("Data = %s", data)
-            context.datastore.update_root_object(data)
+            datastore.update_root_object(data)
 
         except:
             logging.exception("Wrong json content")
@@ -59,37 +223,14 @@ class SimOutputHandler:
     #
     def create_SIMOUTPUT(self, results_json):
 
-        data = context.datastore.get_root_object()
-
         try:
-            data["simulation_status"] = self.status
-            data["node_plot_results"] = results_json['node_plot_results']
-            data["node_parameter_results"] = results_json['node_parameter_results']
-            data["network_plot_results"] = results_json['network_plot_results']
-            data["network_parameter_results"] = results_json['network_parameter_results']
-            data["node_2_node_results"] = results_json['node_2_node_results']
-            data["type"] = "simoutput"
-
-            data['_attachments'] = {}
-            self.add_attachments_inline(data, 'network_plot_results')
-
-            #Write json data to SIMOUTPUTx
-            logging.info("Data = %s", data)
-            context.datastore.update_root_object(data)
+            #Write json data to SIMOUTPUTx (partial results may have been published already)
+            logging.info("Data = %s", results_json)
+            self.publisher.publish(results_json, self.status)
 
         except:
             logging.exception("Wrong json content")
 
-    def add_attachments_inline(self, obj, field):
-        for fdecl in obj[field]:
-            fname = fdecl['file_id']
-            with open(fname, 'rb') as f:
-                fdata = f.read()
-            obj['_attachments'][fname] = {
-                'content_type': 'image/png',
-                'data': base64.b64encode(fdata).decode('ascii')
-            }
-
     #
     #Update SIMOUTPUT file with couchdb
     #server, which includes rev_id
@@ -110,6 +251,9 @@ def generate_output():
     fileloc = context.datastore.fileloc
     simulation_id = context.datastore.sim_id
 
+    # results are published while they are generated
+    simoutput_handler = SimOutputHandler()
+
     # output_list will hold all info/error messages of GenerateResultsProcess
     output_list = []
     pf = DatavisProcess.new_factory(output_list)
@@ -122,7 +266,9 @@ def generate_output():
             #
             # Get the results of the simulation
             #
-            results_json = create_simulation_results(simulation_id, plot_models)
+            dbfile = RESULTS_DB_FILE if datavis_results_db() else None
+            results_json = create_simulation_results(simulation_id, plot_models, dbfile=dbfile,
+                                                     progress=simoutput_handler.publisher.progress)
             results_json_string = json.dumps(results_json, default=lambda o: o.__dict__, indent=2)
 
             with open("results.json", "w") as f:
@@ -138,7 +284,6 @@ def generate_output():
         jo = JsonOutput("simulation_results", simulation_id)
         results_json = jo.get_json()
 
-    simoutput_handler = SimOutputHandler()
     simoutput_handler.finish_job(results_json, fileloc)
     #Write end execution time to statistics fille (finih_job->update_root_object->update obj in couchdb)
     writeto_logstatistcs(fileloc)
@@ -0,0 +1,204 @@
+'''
+A cache of parsed Castalia output files, shared among simulation homes.
+
+Parsing a large simout.txt dominates the finish stage, yet re-running the
+finish stage (e.g., after editing the NSD views) parses the very same file
+again. The cache stores the rows of each parsed table in a small sqlite file,
+keyed by the content of the Castalia output file. Rows are cached with
+their Castalia node ids, before node mapping, so that changing the node
+mapping file does not invalidate the cache. On a hit, the rows are copied
+into the statistics database directly.
+
+The cache directory holds an index database, which records
+ - the digest of each file already hashed, by (path, size, mtime), so that
+   unchanged files are not hashed again, and
+ - the size and last use time of each cache entry, used to evict the least
+   recently used entries when the cache grows beyond its size limit.
+'''
+
+import os
+import hashlib
+import logging
+import sqlite3 as sql
+import tempfile
+import time
+
+from runner.config import datavis_cache_path, datavis_cache_size
+
+
+# Bump this whenever the parser output changes, to invalidate cached entries
+PARSE_CACHE_VERSION = 2
+
+INDEX_FILE = "index.sqlite"
+
+# chunk size for hashing files
+HASH_CHUNK = 1 << 20
+
+
+class ParseCache:
+    """
+    A size-bounded, LRU-evicted cache of parsed tables.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        self.index = sql.connect(os.path.join(path, INDEX_FILE), timeout=60)
+        self.index.execute("CREATE TABLE IF NOT EXISTS files "
+                           "(path VARCHAR, size INT, mtime INT, digest VARCHAR, PRIMARY KEY(path, size, mtime))")
+        self.index.execute("CREATE TABLE IF NOT EXISTS entries "
+                           "(key VARCHAR PRIMARY KEY, nbytes INT, last_used FLOAT)")
+        self.index.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.index.close()
+
+    def file_digest(self, fname):
+        """
+        Return the sha1 digest of the contents of fname, or None if the file does not exist.
+        Digests are remembered by (path, size, mtime).
+        """
+        if not os.path.isfile(fname):
+            return None
+        fname = os.path.abspath(fname)
+        st = os.stat(fname)
+        row = self.index.execute("SELECT digest FROM files WHERE path=? AND size=? AND mtime=?",
+                                 (fname, st.st_size, st.st_mtime_ns)).fetchone()
+        if row is not None:
+            return row[0]
+
+        h = hashlib.sha1()
+        with open(fname, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self.index.execute("DELETE FROM files WHERE path=?", (fname,))
+        self.index.execute("INSERT INTO files(path, size, mtime, digest) VALUES(?,?,?,?)",
+                           (fname, st.st_size, st.st_mtime_ns, digest))
+        self.index.commit()
+        return digest
+
+    def key(self, datafile, table):
+        """
+        Return the cache key for the given data file and (database) table.
+        """
+        h = hashlib.sha1()
+        h.update(str(PARSE_CACHE_VERSION).encode("utf-8"))
+        h.update(str(os.path.getsize(datafile)).encode("utf-8"))
+        h.update(self.file_digest(datafile).encode("utf-8"))
+        h.update(",".join(a.sql_create() for a in table.attributes).encode("utf-8"))
+        return h.hexdigest()
+
+    def entry_file(self, key):
+        return os.path.join(self.path, key + ".sqlite")
+
+    def restore(self, ds, datafile, table_name):
+        """
+        If the parsed contents of datafile are cached, insert them (with unmapped
+        node ids) into table table_name of StatsDatabase ds and return True.
+        Else, return False.
+        """
+        table = ds.relations[table_name]
+        key = self.key(datafile, table)
+        entry = self.entry_file(key)
+        if not os.path.isfile(entry):
+            self.misses += 1
+            logging.info("Parse cache miss for %s (hits=%d, misses=%d)", datafile, self.hits, self.misses)
+            return False
+
+        columns = ",".join(a.name for a in table.attributes)
+        ds.conn.commit()
+        restored = False
+        ds.conn.execute("ATTACH DATABASE ? AS parse_cache", (entry,))
+        try:
+            ds.conn.execute("INSERT INTO %s(%s) SELECT %s FROM parse_cache.rows" % (table_name, columns, columns))
+            ds.conn.commit()
+            restored = True
+        except sql.Error:
+            # the entry was evicted (or damaged) under our feet
+            ds.conn.rollback()
+            logging.warning("Could not read parse cache entry %s", entry, exc_info=1)
+        finally:
+            ds.conn.execute("DETACH DATABASE parse_cache")
+        if not restored:
+            # if the entry was evicted, ATTACH has created an empty database in its
+            # place, which would keep store() from storing it again
+            self.remove(key)
+            self.misses += 1
+            return False
+
+        self.index.execute("UPDATE entries SET last_used=? WHERE key=?", (time.time(), key))
+        self.index.commit()
+        self.hits += 1
+        logging.info("Parse cache hit for %s (hits=%d, misses=%d)", datafile, self.hits, self.misses)
+        return True
+
+    def store(self, ds, datafile, table_name):
+        """
+        Store the rows of table table_name of StatsDatabase ds, parsed from datafile
+        (before node mapping), into the cache. Then, evict entries as needed.
+        """
+        table = ds.relations[table_name]
+        key = self.key(datafile, table)
+        entry = self.entry_file(key)
+        if os.path.isfile(entry):
+            return
+
+        columns = ",".join(a.name for a in table.attributes)
+        fd, tmpfile = tempfile.mkstemp(suffix=".sqlite", dir=self.path)
+        os.close(fd)
+        ds.conn.commit()
+        ds.conn.execute("ATTACH DATABASE ? AS parse_cache", (tmpfile,))
+        try:
+            ds.conn.execute("CREATE TABLE parse_cache.rows AS SELECT %s FROM %s" % (columns, table_name))
+            ds.conn.commit()
+        finally:
+            ds.conn.execute("DETACH DATABASE parse_cache")
+        os.replace(tmpfile, entry)
+
+        self.index.execute("INSERT OR REPLACE INTO entries(key, nbytes, last_used) VALUES(?,?,?)",
+                           (key, os.path.getsize(entry), time.time()))
+        self.index.commit()
+        logging.info("Stored %s into the parse cache", datafile)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries, until the cache fits in max_bytes.
+        """
+        total = self.index.execute("SELECT TOTAL(nbytes) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, nbytes in self.index.execute("SELECT key, nbytes FROM entries ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.remove(key, commit=False)
+            total -= nbytes
+            logging.info("Evicted entry %s from the parse cache", key)
+        self.index.commit()
+
+    def remove(self, key, commit=True):
+        """
+        Remove the entry of the given key, if there is one.
+        """
+        try:
+            os.remove(self.entry_file(key))
+        except FileNotFoundError:
+            pass
+        self.index.execute("DELETE FROM entries WHERE key=?", (key,))
+        if commit:
+            self.index.commit()
+
+
+def get_parse_cache():
+    """
+    Return the ParseCache configured for this installation, or None if
+    no parse cache is configured.
+    """
+    path = datavis_cache_path()
+    if path is None:
+        return None
+    return ParseCache(os.path.join(path, "parsed"), datavis_cache_size())
@@ -0,0 +1,330 @@
+'''
+Physical design for the statistics database.
+
+Before any plots are produced, model2plots looks at how the PlotModels and
+DerivedTables use the base tables and decides
+ - which DerivedTables to materialize (as tables) instead of creating them
+   as views, which are evaluated again by every query reading them, and
+ - which indexes to build on the base tables and the materialized tables.
+'''
+
+import logging
+import math
+from models.nsdplot import DerivedTable, ColumnRef, ColumnExpr, ConstantExpr, Operator, LAND, EQ
+from datavis.database import Selector
+from models.validation import Context, inform
+
+
+# Base tables with fewer rows than this are never indexed.
+MIN_INDEXED_ROWS = 10000
+
+# The cost of building an index, per row and per log2(rows), relative to
+# the cost of scanning one row of the table.
+INDEX_BUILD_COST = 0.05
+
+# DerivedTables which cost less than this to compute (in row scans) are never materialized.
+MIN_MATERIALIZED_COST = 10000
+
+# The cost of grouping, per input row and per log2(input rows), relative to the
+# cost of scanning one row.
+GROUP_COST = 0.05
+
+# The cost of writing one row of a materialized table, relative to the cost of
+# scanning one row.
+MATERIALIZE_ROW_COST = 2.0
+
+# The estimated fraction of the input rows of an aggregating DerivedTable that
+# make it to its output.
+GROUPED_ROWS_FRACTION = 0.1
+
+
+class IndexCandidate:
+    """
+    An index which may be built on a base table.
+
+    columns is the ordered list of indexed columns. The leading columns are the ones
+    used in equality predicates, followed by the ones used in range predicates,
+    grouping and ordering, followed by the rest of the columns needed by the queries,
+    so that the index is covering. uses is the number of queries served by the index.
+    """
+
+    def __init__(self, table, columns, uses=1):
+        self.table = table
+        self.columns = columns
+        self.uses = uses
+        self.rows = None
+
+    @property
+    def name(self):
+        return "auto_%s_%s" % (self.table.name, "_".join(self.columns))
+
+    def covers(self, other):
+        """True if this index can serve all queries of other"""
+        return self.table is other.table and self.columns[:len(other.columns)] == other.columns
+
+    def build_cost(self):
+        """Estimated cost of building the index, in row scans"""
+        return self.rows * math.log2(max(self.rows, 2)) * INDEX_BUILD_COST
+
+    def benefit(self):
+        """Estimated cost saved by the index, in row scans (one full scan per use)"""
+        return self.uses * self.rows
+
+    def worthwhile(self):
+        return self.rows >= MIN_INDEXED_ROWS and self.benefit() > self.build_cost()
+
+    def sql_create(self):
+        return "CREATE INDEX IF NOT EXISTS %s ON %s(%s)" % (self.name, self.table.name, ",".join(self.columns))
+
+
+def _append_unique(lst, names):
+    for name in names:
+        if name not in lst:
+            lst.append(name)
+    return lst
+
+
+def filter_columns(expr):
+    """
+    Return a pair of lists (eq, other) of the names of the columns that appear in
+    the top-level conjuncts of filter expression expr. Columns compared to constants
+    for equality go into eq, columns in all other comparisons go into other.
+    Disjunctions are ignored, since they cannot be served by a single index.
+    """
+    eq, other = [], []
+
+    def visit(e):
+        if not isinstance(e, Operator):
+            return
+        if e.function is LAND:
+            for x in e.operands:
+                visit(x)
+        elif e.function.isinline and e.function.name not in ('OR', 'AND'):
+            cols = [x.column.name for x in e.operands if isinstance(x, ColumnRef)]
+            consts = [x for x in e.operands if isinstance(x, ConstantExpr)]
+            if e.function is EQ and len(cols) == 1 and consts:
+                _append_unique(eq, cols)
+            else:
+                _append_unique(other, cols)
+
+    visit(expr)
+    return eq, other
+
+
+def select_columns(select):
+    """
+    Return a pair of lists (eq, other) for the column names in a PlotModel select dict.
+    """
+    eq, other = [], []
+    if isinstance(select, dict):
+        for name, value in select.items():
+            if isinstance(value, (Selector, list, tuple)):
+                other.append(name)
+            else:
+                eq.append(name)
+    return eq, other
+
+
+def base_column_names(table):
+    return [c.name for c in table.columns]
+
+
+def access_paths(table, key, cover, materialized=()):
+    """
+    Map a query on table, with leading (key) columns and further (cover) columns,
+    to a list of IndexCandidates on base tables (or the materialized DerivedTables
+    named in materialized). Queries on other DerivedTables are traced to their base
+    tables, as long as the DerivedTable is not grouped (sqlite can flatten such views
+    into the query).
+    """
+    if not isinstance(table, DerivedTable) or table.name in materialized:
+        names = base_column_names(table)
+        key = [c for c in key if c in names]
+        if not key:
+            return []
+        return [IndexCandidate(table, _append_unique(list(key), [c for c in cover if c in names]))]
+
+    if table.groupby:
+        return []
+
+    eq, other = filter_columns(table.table_filter)
+    paths = []
+    for bt in table.base_tables:
+        paths += access_paths(bt, eq + other + key, cover + base_column_names(table), materialized)
+    return paths
+
+
+def derived_table_paths(dt, materialized=()):
+    """
+    Return the IndexCandidates for computing a DerivedTable dt from its base tables.
+    """
+    eq, other = filter_columns(dt.table_filter)
+    groupby = [c.name for c in dt.groupby] if dt.groupby else []
+    paths = []
+    for bt in dt.base_tables:
+        paths += access_paths(bt, eq + other + groupby, base_column_names(dt), materialized)
+    return paths
+
+
+def plot_model_paths(pm, materialized=()):
+    """
+    Return the IndexCandidates for the queries of a PlotModel pm.
+    """
+    eq, other = select_columns(pm.select)
+    key = eq + other
+    if pm.axes:
+        _append_unique(key, pm.axes)
+    if pm.x:
+        _append_unique(key, [c.name for c in pm.x])
+    cover = [c.name for c in pm.y] if pm.y else []
+    return access_paths(pm.rel, key, cover, materialized)
+
+
+def plan_indexes(pml, table_list, materialized=()):
+    """
+    Return the list of IndexCandidates for the given PlotModels and tables
+    (as returned by collect_tables_for_pml), where the DerivedTables named in
+    materialized are materialized. Candidates served by a longer candidate on
+    the same table are merged into it.
+    """
+    candidates = []
+    for table in table_list:
+        if isinstance(table, DerivedTable):
+            candidates += derived_table_paths(table, materialized)
+    for pm in pml:
+        candidates += plot_model_paths(pm, materialized)
+
+    # merge candidates covered by longer ones
+    candidates.sort(key=lambda c: -len(c.columns))
+    merged = []
+    for cand in candidates:
+        for idx in merged:
+            if idx.covers(cand):
+                idx.uses += cand.uses
+                break
+        else:
+            merged.append(cand)
+    return merged
+
+
+def create_indexes(ds, pml, table_list, materialized=(), tables=None):
+    """
+    Plan indexes for the given PlotModels and create the ones worth building
+    in StatsDatabase ds, on the tables of ds (only those named in tables, if given).
+    The DerivedTables named in materialized are materialized.
+    Each decision is reported in the datavis log.
+    """
+    rows = {}
+    for idx in plan_indexes(pml, table_list, materialized):
+        if idx.table.name not in ds.relations or (tables is not None and idx.table.name not in tables):
+            continue
+        with Context(view=idx.table.name):
+            if idx.table.name not in rows:
+                rows[idx.table.name] = ds.execute("SELECT COUNT(*) FROM %s" % idx.table.name)[0][0]
+            idx.rows = rows[idx.table.name]
+            if idx.worthwhile():
+                ds.conn.execute(idx.sql_create())
+                decision = "created"
+            else:
+                decision = "skipped"
+            inform("index on (%s) %s: rows=%d, uses=%d, estimated build cost=%d, estimated saving=%d" %
+                   (",".join(idx.columns), decision, idx.rows, idx.uses, idx.build_cost(), idx.benefit()))
+            logging.debug("index: %s", idx.sql_create())
+    ds.conn.commit()
+
+
+def is_aggregate(expr):
+    """True if expression expr involves an aggregate function"""
+    if isinstance(expr, ColumnExpr):
+        return is_aggregate(expr.expr)
+    if isinstance(expr, Operator):
+        return expr.function.isaggregate or any(is_aggregate(x) for x in expr.operands)
+    return False
+
+
+class MaterializationCandidate:
+    """
+    A DerivedTable which may be materialized.
+
+    consumers is the number of queries reading the DerivedTable (PlotModels over it
+    and DerivedTables built on it), inputs the list of the estimated sizes of its
+    base tables, in rows.
+    """
+
+    def __init__(self, table, consumers, inputs):
+        self.table = table
+        self.consumers = consumers
+        self.inputs = inputs
+        self.grouped = bool(table.groupby) or any(is_aggregate(c) for c in table.columns)
+
+    def input_rows(self):
+        # the base tables are joined
+        rows = 1 if self.inputs else 0
+        for n in self.inputs:
+            rows *= n
+        return rows
+
+    def rows(self):
+        """Estimated number of rows of the DerivedTable"""
+        return self.input_rows() * (GROUPED_ROWS_FRACTION if self.grouped else 1)
+
+    def cost(self):
+        """Estimated cost of computing the DerivedTable once, in row scans"""
+        rows = self.input_rows()
+        if self.grouped:
+            rows += rows * math.log2(max(rows, 2)) * GROUP_COST
+        return rows
+
+    def build_cost(self):
+        """Estimated cost of materializing the DerivedTable, beyond computing it once"""
+        return self.rows() * MATERIALIZE_ROW_COST
+
+    def benefit(self):
+        """Estimated cost saved by materializing, by computing the DerivedTable once for all consumers"""
+        return (self.consumers - 1) * self.cost()
+
+    def worthwhile(self):
+        # sqlite flattens ungrouped views over a single table into the queries reading them
+        flattened = not self.grouped and len(self.table.base_tables) == 1
+        return self.consumers > 1 and not flattened and self.cost() >= MIN_MATERIALIZED_COST \
+            and self.benefit() > self.build_cost()
+
+
+def plan_materialization(ds, pml, table_list):
+    """
+    Decide which DerivedTables among the given tables (as returned by collect_tables_for_pml)
+    are materialized, given the PlotModels reading them and the base tables of StatsDatabase ds.
+    Return the set of the names of the materialized DerivedTables.
+    Each decision is reported in the datavis log.
+    """
+    consumers = {}
+    for table in table_list:
+        if isinstance(table, DerivedTable):
+            for bt in table.base_tables:
+                consumers[bt.name] = consumers.get(bt.name, 0) + 1
+    for pm in pml:
+        consumers[pm.rel.name] = consumers.get(pm.rel.name, 0) + 1
+
+    # the estimated size of each table, as seen by the queries reading it;
+    # for views, this is the cost of computing them
+    sizes = {}
+    materialized = set()
+    for table in table_list:
+        if not isinstance(table, DerivedTable):
+            if table.name in ds.relations:
+                sizes[table.name] = ds.execute("SELECT COUNT(*) FROM %s" % table.name)[0][0]
+            continue
+
+        cand = MaterializationCandidate(table, consumers.get(table.name, 0),
+                                        [sizes.get(bt.name, 0) for bt in table.base_tables])
+        with Context(view=table.name):
+            if cand.worthwhile():
+                materialized.add(table.name)
+                sizes[table.name] = cand.rows()
+                decision = "materialized"
+            else:
+                sizes[table.name] = cand.cost()
+                decision = "kept as a view"
+            inform("%s: consumers=%d, estimated cost=%d, estimated rows=%d, estimated saving=%d" %
+                   (decision, cand.consumers, cand.cost(), cand.rows(), cand.benefit()))
+    return materialized
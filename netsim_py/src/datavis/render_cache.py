@@ -0,0 +1,160 @@
+'''
+A cache of rendered plots, shared among simulation homes.
+
+Re-running the finish stage of a simulation (or running a simulation whose
+NSD differs from an earlier one in a few views only) renders again plots
+which are identical to ones already rendered. A plot is fully determined
+by its gnuplot script, which includes the plot data inline. Therefore, the
+rendered image is cached under the digest of the script (with the output
+file name left out), and on a hit it is linked (or copied) into the
+simulation home, without running gnuplot.
+
+Entries are stored as copies of the rendered files, so that cache entries
+and plot files are never the same file unless they were linked on restore.
+Plot files are never rewritten in place (Plot.make_plot removes an existing
+output file before rendering), so a linked entry cannot be modified.
+
+The cache directory holds an index database, which records the size and
+last use time of each cache entry, used to evict the least recently used
+entries when the cache grows beyond its size limit.
+'''
+
+import os
+import hashlib
+import logging
+import shutil
+import sqlite3 as sql
+import tempfile
+import threading
+import time
+
+from runner.config import datavis_cache_path, datavis_plot_cache_size
+
+
+# Bump this whenever the rendering of plots changes, to invalidate cached entries
+RENDER_CACHE_VERSION = 1
+
+INDEX_FILE = "index.sqlite"
+
+
+def link_or_copy(src, dst):
+    """
+    Make dst a hard link to src, or a copy of src where hard links are not possible
+    (e.g., across file systems). An existing dst is replaced.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class RenderCache:
+    """
+    A size-bounded, LRU-evicted cache of rendered plots.
+
+    A cache may be used by several threads.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        self.lock = threading.Lock()
+        self.index = sql.connect(os.path.join(path, INDEX_FILE), timeout=60, check_same_thread=False)
+        self.index.execute("CREATE TABLE IF NOT EXISTS entries "
+                           "(key VARCHAR PRIMARY KEY, nbytes INT, last_used FLOAT)")
+        self.index.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        if self.hits or self.misses:
+            logging.info("Plot cache: %d hits, %d misses", self.hits, self.misses)
+        self.index.close()
+
+    @staticmethod
+    def key(source):
+        """
+        Return the cache key for the source of a plot (see Renderer.cache_source),
+        a string or an iterable of strings.
+        """
+        h = hashlib.sha1()
+        h.update(str(RENDER_CACHE_VERSION).encode("utf-8"))
+        for chunk in [source] if isinstance(source, str) else source:
+            h.update(chunk.encode("utf-8"))
+        return h.hexdigest()
+
+    def entry_file(self, key):
+        return os.path.join(self.path, key)
+
+    def restore(self, key, output_file):
+        """
+        If the plot with the given key is cached, place it in output_file and return True.
+        Else, return False.
+        """
+        entry = self.entry_file(key)
+        try:
+            link_or_copy(entry, output_file)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return False
+
+        with self.lock:
+            self.index.execute("UPDATE entries SET last_used=? WHERE key=?", (time.time(), key))
+            self.index.commit()
+            self.hits += 1
+        logging.debug("Plot cache hit for %s", output_file)
+        return True
+
+    def store(self, key, output_file):
+        """
+        Store the plot rendered into output_file into the cache, under the given key.
+        Then, evict entries as needed.
+        """
+        entry = self.entry_file(key)
+        if os.path.isfile(entry) or not os.path.isfile(output_file):
+            return
+
+        fd, tmpfile = tempfile.mkstemp(dir=self.path, prefix="tmp")
+        os.close(fd)
+        shutil.copyfile(output_file, tmpfile)
+        os.replace(tmpfile, entry)
+
+        with self.lock:
+            self.index.execute("INSERT OR REPLACE INTO entries(key, nbytes, last_used) VALUES(?,?,?)",
+                               (key, os.path.getsize(entry), time.time()))
+            self.index.commit()
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries, until the cache fits in max_bytes.
+        """
+        total = self.index.execute("SELECT TOTAL(nbytes) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, nbytes in self.index.execute("SELECT key, nbytes FROM entries ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self.entry_file(key))
+            except FileNotFoundError:
+                pass
+            self.index.execute("DELETE FROM entries WHERE key=?", (key,))
+            total -= nbytes
+            logging.info("Evicted plot %s from the plot cache", key)
+        self.index.commit()
+
+
+def get_render_cache():
+    """
+    Return the RenderCache configured for this installation, or None if
+    no datavis cache is configured.
+    """
+    path = datavis_cache_path()
+    if path is None:
+        return None
+    return RenderCache(os.path.join(path, "plots"), datavis_plot_cache_size())
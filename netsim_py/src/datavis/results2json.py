@@ -10,7 +10,33 @@ from models.nsdplot import PlotModel
 import pickle
 
 
+def to_json_value(value):
+    """
+    Convert a result record, or a list of them, to plain dicts and lists
+    """
+    if isinstance(value, ResultRecord):
+        return value.to_dict()
+    if isinstance(value, (list, tuple)):
+        return [to_json_value(v) for v in value]
+    return value
+
+
+class ResultRecord:
+    """
+    Base class of the records of a JsonOutput. The fields of a record are
+    its __slots__, in the order they appear in the json output.
+    """
+    __slots__ = ()
+
+    def to_dict(self):
+        return {name: to_json_value(getattr(self, name)) for name in self.__slots__}
+
+
 class JsonOutput:
+    # the fields of the json output, in order
+    FIELDS = ("type", "simulation_id", "node_plot_results", "node_parameter_results",
+              "network_plot_results", "network_parameter_results", "node_2_node_results")
+
     def __init__(self, type, simulation_id):
         self.type = type
         self.simulation_id = simulation_id
@@ -19,6 +45,10 @@ class JsonOutput:
         self.network_plot_results = []
         self.network_parameter_results = []
         self.node_2_node_results = []
+        # indexes of the node and node2node results, by node id(s)
+        self.__node_plots = {}
+        self.__node_parameters = {}
+        self.__node2nodes = {}
 
     def add_node_plot_result(self, node_plot_result):
         assert isinstance(node_plot_result, NodePlotResults_node)
@@ -30,6 +60,7 @@ class JsonOutput:
                 t.add_result(res)
         else:
             self.node_plot_results.append(node_plot_result)
+            self.__node_plots[node_plot_result.node_id] = node_plot_result
 
     def add_node_parameter_result(self, node_parameter_result):
         assert isinstance(node_parameter_result, NodeParameterResults_node)
@@ -41,6 +72,7 @@ class JsonOutput:
                 t.add_result(res)
         else:
             self.node_parameter_results.append(node_parameter_result)
+            self.__node_parameters[node_parameter_result.node_id] = node_parameter_result
 
     def add_network_plot_result(self, network_plot_result):
         assert isinstance(network_plot_result, NetworkPlotResults_node)
@@ -62,33 +94,46 @@ class JsonOutput:
                 t.add_plot(pl)
         else:
             self.node_2_node_results.append(node_2_node_result)
+            self.__node2nodes[node_2_node_result.node1_id, node_2_node_result.node2_id] = node_2_node_result
+
+    def merge(self, other):
+        """
+        Add all the results of JsonOutput other to this one, in order.
+        """
+        assert isinstance(other, JsonOutput)
+        for r in other.node_plot_results:
+            self.add_node_plot_result(r)
+        for r in other.node_parameter_results:
+            self.add_node_parameter_result(r)
+        for r in other.network_plot_results:
+            self.add_network_plot_result(r)
+        for r in other.network_parameter_results:
+            self.add_network_parameter_result(r)
+        for r in other.node_2_node_results:
+            self.add_node_2_node_result(r)
 
     def __find_node_plot(self, nodeid):
-        for i in self.node_plot_results:
-            if i.node_id == nodeid:
-                return i
-        return False
+        return self.__node_plots.get(nodeid, False)
 
     def __find_node_parameter(self, nodeid):
-        for i in self.node_parameter_results:
-            if i.node_id == nodeid:
-                return i
-        return False
+        return self.__node_parameters.get(nodeid, False)
 
     def __find_node2node(self, nodeid1, nodeid2):
-        for i in self.node_2_node_results:
-            if i.node1_id == nodeid1 and i.node2_id == nodeid2:
-                return i
-        return False
+        return self.__node2nodes.get((nodeid1, nodeid2), False)
 
     def get_json_string(self):
-        return json.dumps(self, default=lambda o: o.__dict__, indent=2)
+        return json.dumps(self.get_json(), indent=2)
 
     def get_json(self):
-        return json.loads(self.get_json_string())
+        """
+        Return the results as a (new) json object, i.e., plain dicts and lists
+        """
+        return {name: to_json_value(getattr(self, name)) for name in self.FIELDS}
 
 
-class NodePlotResults_node:
+class NodePlotResults_node(ResultRecord):
+    __slots__ = ('node_id', 'results')
+
     def __init__(self, node_id):
         self.node_id = node_id
         self.results = []
@@ -98,13 +143,17 @@ class NodePlotResults_node:
         self.results.append(result)
 
 
-class NodePlotResult:
+class NodePlotResult(ResultRecord):
+    __slots__ = ('name', 'file_id')
+
     def __init__(self, name, file_id):
         self.name = name
         self.file_id = file_id
 
 
-class NodeParameterResults_node:
+class NodeParameterResults_node(ResultRecord):
+    __slots__ = ('node_id', 'results')
+
     def __init__(self, node_id):
         self.node_id = node_id
         self.results = []
@@ -114,27 +163,35 @@ class NodeParameterResults_node:
         self.results.append(result)
 
 
-class NodeParameterResult:
+class NodeParameterResult(ResultRecord):
+    __slots__ = ('name', 'unit', 'value')
+
     def __init__(self, name, unit, value):
         self.name = name
         self.unit = unit
         self.value = value
 
 
-class NetworkPlotResults_node:
+class NetworkPlotResults_node(ResultRecord):
+    __slots__ = ('name', 'file_id')
+
     def __init__(self, name, file_id):
         self.name = name
         self.file_id = file_id
 
 
-class NetworkParameterResults_node:
+class NetworkParameterResults_node(ResultRecord):
+    __slots__ = ('name', 'unit', 'value')
+
     def __init__(self, name, unit, value):
         self.name = name
         self.unit = unit
         self.value = value
 
 
-class Node2NodeResults_node:
+class Node2NodeResults_node(ResultRecord):
+    __slots__ = ('node1_id', 'node2_id', 'parameters', 'plots')
+
     def __init__(self, node1_id, node2_id):
         self.node1_id = node1_id
         self.node2_id = node2_id
@@ -150,14 +207,18 @@ class Node2NodeResults_node:
         self.plots.append(plot)
 
 
-class Node2NodeResults_parameter:
+class Node2NodeResults_parameter(ResultRecord):
+    __slots__ = ('name', 'value', 'unit')
+
     def __init__(self, name, value, unit):
         self.name = name
         self.value = value
         self.unit = unit
 
 
-class Node2NodeResults_plot:
+class Node2NodeResults_plot(ResultRecord):
+    __slots__ = ('name', 'file_id')
+
     def __init__(self, name, file_id):
         self.name = name
         self.file_id = file_id
@@ -0,0 +1,54 @@
+'''
+Tests for the comparison of several simulations
+'''
+
+import os
+import pytest
+import datavis.compare
+from datavis.compare import ComparisonDatabase, compare_plot, parse_select, resolve_simhome
+from datavis.database import StatsDatabase, Attribute, RESULTS_DB_FILE
+from datavis.tests.test_database import castalia_output_file
+
+
+def make_simhome(tmp_dir, name, scale):
+    simhome = os.path.join(tmp_dir, name)
+    os.makedirs(simhome, exist_ok=True)
+    alist = [Attribute("module", "VARCHAR"), Attribute("node", "INT"), Attribute("name", "VARCHAR"),
+             Attribute("label", "VARCHAR"), Attribute("n_index", "INT"), Attribute("data", "FLOAT")]
+    d = StatsDatabase(dbfile=os.path.join(simhome, RESULTS_DB_FILE))
+    d.create_table("dataTable", alist)
+    d.load_data_castalia(castalia_output_file())
+    d.conn.execute("UPDATE dataTable SET data = data * ?", (scale,))
+    d.stamp_table("dataTable", alist, [castalia_output_file()])
+    d.conn.close()
+    return simhome
+
+
+@pytest.mark.parametrize("max_attached", [10, 1])
+def test_compare(tmp_dir, monkeypatch, max_attached):
+    monkeypatch.setattr(datavis.compare, "MAX_ATTACHED", max_attached)
+    homes = [make_simhome(tmp_dir, "compare_sim%d" % i, i + 1) for i in range(3)]
+
+    with ComparisonDatabase(homes) as cdb:
+        assert cdb.attached == (max_attached == 10)
+        assert [a.name for a in cdb.relations["dataTable"].attributes] == \
+            ["sim", "module", "node", "name", "label", "n_index", "data"]
+        res = cdb.conn.execute("SELECT sim, data FROM dataTable "
+                               "WHERE name='TXed pkts' AND node=1 ORDER BY sim").fetchall()
+        assert res == [("compare_sim0", 499.0), ("compare_sim1", 998.0), ("compare_sim2", 1497.0)]
+
+        plot = compare_plot(cdb, "node", "data", {"name": "Consumed Energy"})
+        assert [g.title for g in plot.graphs] == ["sim=compare_sim0", "sim=compare_sim1", "sim=compare_sim2"]
+
+
+def test_missing_results_database(tmp_dir):
+    with pytest.raises(Exception):
+        ComparisonDatabase([os.path.join(tmp_dir, "no_such_simhome")])
+
+
+def test_resolve_simhome():
+    assert resolve_simhome("/some/path/sim_1") == "/some/path/sim_1"
+
+
+def test_parse_select():
+    assert parse_select(["name=Consumed Energy", "node=2"]) == {"name": "Consumed Energy", "node": 2}
@@ -5,6 +5,8 @@ Created on Jan 30, 2015
 @author: GeoMSK
 '''
 
+import pytest
+import datavis.create_plot
 from models.nsdplot import Column
 from datavis.tests.test_database import castalia_output_file
 from datavis.database import StatsDatabase
@@ -25,3 +27,151 @@ def test_plot(tmp_dir):
     # restore the working directory to its previous value
     os.chdir(curdir)
 
+
+
+def test_gnuplot_session():
+    with GnuplotSession() as session:
+        ok, err = session.render("set terminal unknown\nplot sin(x)\n")
+        assert ok and err == ""
+
+        # an error is reported for its own plot only, and the session goes on
+        ok, err = session.render("set terminal unknown\nthis_is_an_error\n")
+        assert not ok or err != ""
+        ok, err = session.render("set terminal unknown\nplot cos(x)\n")
+        assert ok and err == ""
+        assert session.plots == 3
+
+
+def test_matplotlib_renderer(tmp_dir):
+    pytest.importorskip("matplotlib")
+    d = StatsDatabase(testing=True)
+    d.load_data_castalia(castalia_output_file())
+    for style, logscale in (("linespoints", "y"), ("histogram", " ")):
+        output = os.path.join(tmp_dir, "matplotlib_" + style)
+        plot = make_plot(d.relations["dataTable"], (Column("node"),), (Column("data"),), ["name"],
+                         select={"name": "Consumed Energy"}, style=style, terminal=PNG(), output=output,
+                         logscale=logscale, renderer="matplotlib")
+        assert plot.make_plot()
+        with open(output + ".png", "rb") as f:
+            assert f.read(8) == b"\x89PNG\r\n\x1a\n"
+
+
+def test_matplotlib_settings():
+    assert parse_range("[0:10]") == (0.0, 10.0)
+    assert parse_range("[*:5.5]") == (None, 5.5)
+    assert legend_location(None) == "upper right"
+    assert legend_location("bottom left") == "lower left"
+    assert legend_location("off") is None
+
+
+@pytest.mark.parametrize("select", [{"name": ["Consumed Energy", "TXed pkts"]}, {"node": 1}])
+def test_graph_data(select):
+    d = StatsDatabase(testing=True)
+    d.load_data_castalia(castalia_output_file())
+    queries = []
+    d.conn.set_trace_callback(queries.append)
+    plot = make_plot(d.relations["dataTable"], (Column("node"),), (Column("data"),), ["name"], select=select,
+                     terminal=PNG())
+    graph_data = [(g, list(rows)) for g, rows in plot.graph_data()]
+    # one query for the axis values, one for the data of all graphs
+    assert len(queries) == 2
+
+    assert [g for g, rows in graph_data] == plot.graphs
+    for g, rows in graph_data:
+        assert rows and rows == g.fetch_data()
+
+
+def test_script_streaming(monkeypatch):
+    monkeypatch.setattr(datavis.create_plot, "DATA_CHUNK_LINES", 2)
+    assert list(gnuplot_block(["1 2", "2 3", "3 4"])) == ["1 2\n2 3\n", "3 4\n", "end\n"]
+    assert list(gnuplot_block([])) == []
+
+    d = StatsDatabase(testing=True)
+    d.load_data_castalia(castalia_output_file())
+    plot = make_plot(d.relations["dataTable"], (Column("node"),), (Column("data"),), ["name"],
+                     select={"name": ["Consumed Energy", "TXed pkts"]}, terminal=PNG())
+    script = plot.create_script()
+    text = str(script)
+    assert text.startswith("set title") and text.endswith("end\n")
+    assert text.count("end\n") == 2
+    # a kept script can be replayed
+    assert "".join(script) == text
+
+
+def test_decimate():
+    rows = [(x, (x * 7919) % 1000) for x in range(10000)]
+    assert decimate(rows[:100], 100) == (rows[:100], 100)
+
+    for max_points in (2, 3, 101, 1000):
+        kept, count = decimate(iter(rows), max_points)
+        assert count == len(rows)
+        assert 0 < len(kept) <= max_points
+        assert kept == sorted(kept) and set(kept) <= set(rows)
+        assert min(kept, key=lambda r: r[1])[1] == 0 and max(kept, key=lambda r: r[1])[1] == 999
+
+    with pytest.raises(ValueError):
+        decimate(iter(rows), 1)
+
+
+def test_decimate_boundary():
+    # a flat series of exactly max_points rows is kept whole
+    rows = [(x, 1.0) for x in range(10)]
+    assert decimate(iter(rows), 10) == (rows, 10)
+    kept, count = decimate(iter(rows + [(10, 1.0)]), 10)
+    assert count == 11 and len(kept) <= 10
+
+
+def test_decimate_null_y():
+    rows = [(x, None if x % 3 == 0 else x % 100) for x in range(1000)]
+    kept, count = decimate(iter(rows), 10)
+    assert count == len(rows)
+    assert 0 < len(kept) <= 10
+    assert all(y is not None for x, y in kept)
+    assert min(y for x, y in kept) == 0 and max(y for x, y in kept) == 99
+
+    assert decimate([(x, None) for x in range(100)], 10) == ([], 100)
+
+
+def test_plot_decimation():
+    d = StatsDatabase(testing=True)
+    d.load_data_castalia(castalia_output_file())
+    plot = make_plot(d.relations["dataTable"], (Column("node"),), (Column("data"),), ["name"],
+                     select={"name": "Consumed Energy"}, terminal=PNG(), max_points=2)
+    assert [len(list(rows)) for g, rows in plot.graph_data()] == [2]
+
+    plot.max_points = 1
+    assert [len(list(rows)) for g, rows in plot.graph_data()] == [2]
+
+    plot.max_points = 0
+    assert [len(list(rows)) for g, rows in plot.graph_data()] == [3]
+
+
+def test_histogram_values():
+    d = StatsDatabase(testing=True)
+    d.load_data_castalia(castalia_output_file())
+    plot = make_plot(d.relations["dataTable"], (Column("node"),), (Column("data"),), ["name"],
+                     select={"name": ["Consumed Energy", "TXed pkts"]}, style="histogram", terminal=PNG())
+    graphs = [dict(g.fetch_data()) for g in plot.graphs]
+    nodes = sorted(set().union(*graphs))
+    values = plot.histogram_values()
+    # TXed pkts has no value for node 0
+    assert 0 not in graphs[1]
+    assert values == [[node] + [g.get(node, 0.0) for g in graphs] for node in nodes]
+
+    text = str(plot.create_script())
+    blocks = text[text.index("\n\"") + 1:].split("end\n")
+    assert blocks[1].splitlines()[0] == '"0" 0.0'
+
+
+def test_histogram_values_duplicates_and_nulls():
+    d = StatsDatabase(testing=True)
+    d.load_data_castalia(castalia_output_file())
+    insert = "INSERT INTO dataTable(node, name, data) VALUES (?,?,?)"
+    d.conn.executemany(insert, [(100, "Consumed Energy", 1.0), (100, "Consumed Energy", 2.0),
+                                (101, "TXed pkts", None)])
+    plot = make_plot(d.relations["dataTable"], (Column("node"),), (Column("data"),), ["name"],
+                     select={"name": ["Consumed Energy", "TXed pkts"]}, style="histogram", terminal=PNG())
+    values = {row[0]: row[1:] for row in plot.histogram_values()}
+    # the last of many values, a gap for NULL, and 0.0 for no value
+    assert values[100] == [2.0, 0.0]
+    assert values[101] == [0.0, None]
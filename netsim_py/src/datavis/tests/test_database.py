@@ -10,7 +10,9 @@ import pytest
 import os.path, runner.config
 from models.nsdplot import Table as nsdTable, Column
 from datavis.model2plots import create_table
-from datavis.database import StatsDatabase
+from datavis.database import StatsDatabase, Attribute, BulkInserter, open_results_database, RESULTS_DB_FILE
+import shutil
+import json
 
 
 def castalia_output_file():
@@ -41,9 +43,16 @@ def test_isint():
     assert(StatsDatabase._StatsDatabase__is_int(123.123) is False)
 
 
+def save_outputs(d, outputs):
+    """Store simple outputs (m, n, i, o, bl, l, v) into the dataTable of d, as load_data_castalia does"""
+    with BulkInserter(d.conn, d._StatsDatabase__insert_output_sql("dataTable")) as inserter:
+        for output in outputs:
+            inserter.add(d._StatsDatabase__output_row(*output))
+
+
 def test_saveoutput():
     d = StatsDatabase(testing=True)
-    d._StatsDatabase__save_output("module1", 1, -1, "outputname", "simlabel", "label", 123.123, table_name="dataTable")
+    save_outputs(d, [("module1", 1, -1, "outputname", "simlabel", "label", 123.123)])
     c = d.conn.cursor()
     res = c.execute('SELECT * FROM dataTable').fetchall()
     assert(res[0] == ("module1", 1, "outputname", "label", -1, 123.123))
@@ -52,8 +61,8 @@ def test_saveoutput():
 
 def test_getdatatable():
     d = StatsDatabase(testing=True)
-    d._StatsDatabase__save_output("module1", 1, -1, "outputname", "simlabel", "label", 123.123, table_name="dataTable")
-    d._StatsDatabase__save_output("module2", 2, -1, "outputname2", "simlabel2", "label2", 1234.1234, table_name="dataTable")
+    save_outputs(d, [("module1", 1, -1, "outputname", "simlabel", "label", 123.123),
+                     ("module2", 2, -1, "outputname2", "simlabel2", "label2", 1234.1234)])
     res = d.get_datatable()
     assert(res[0] == ("module1", 1, "outputname", "label", -1, 123.123))
     assert(res[1] == ("module2", 2, "outputname2", "label2", -1, 1234.1234))
@@ -171,3 +180,138 @@ def test_execute():
 
     assert db.execute("SELECT node,data FROM dataTable WHERE name = 'Consumed Energy'") == [(0, 6.79813), (1, 6.28785), (2, 6.28569)]
 
+
+
+def test_readcastaliaoutput_batches():
+    d1 = StatsDatabase(testing=True)
+    d1.load_data_castalia(castalia_output_file())
+    d2 = StatsDatabase(testing=True)
+    d2.load_data_castalia(castalia_output_file(), batch_size=4)
+    assert d1.get_datatable() == d2.get_datatable()
+    assert len(d2.get_datatable()) == 21
+    assert not d2.conn.in_transaction
+    d1.conn.close()
+    d2.conn.close()
+
+
+def test_results_database(tmp_dir):
+    dbfile = os.path.join(tmp_dir, RESULTS_DB_FILE)
+    datafile = os.path.join(tmp_dir, "simout_results_db.txt")
+    shutil.copy(castalia_output_file(), datafile)
+    alist = [Attribute("module", "VARCHAR"), Attribute("node", "INT"), Attribute("name", "VARCHAR"),
+             Attribute("label", "VARCHAR"), Attribute("n_index", "INT"), Attribute("data", "FLOAT")]
+    sources = [datafile]
+
+    d = StatsDatabase(dbfile=dbfile)
+    assert d.restore_table("dataTable", alist, sources) is None
+    d.create_table("dataTable", alist)
+    d.load_data_castalia(datafile)
+    d.stamp_table("dataTable", alist, sources)
+    d.create_view("test_view", "SELECT node FROM dataTable")
+    expected = d.get_datatable()
+    d.conn.close()
+
+    # unchanged sources: the table is restored, views are gone
+    d = StatsDatabase(dbfile=dbfile)
+    assert d.restore_table("dataTable", alist, sources) is not None
+    assert d.get_datatable() == expected
+    assert d.execute("SELECT name FROM sqlite_master WHERE type='view'") == []
+    d.conn.close()
+
+    d = open_results_database(tmp_dir)
+    assert "dataTable" in d.relations
+    assert [a.name for a in d.relations["dataTable"].attributes] == [a.name for a in alist]
+    d.conn.close()
+
+    # changed source: the table must be reloaded
+    with open(datafile, "a") as f:
+        f.write("Castalia|\tmodule:SN.node[3].ResourceManager\n")
+    d = StatsDatabase(dbfile=dbfile)
+    assert d.restore_table("dataTable", alist, sources) is None
+    d.conn.close()
+
+
+def test_histogram_labels():
+    labels = StatsDatabase._StatsDatabase__histogram_labels
+    assert labels(0.0, 200.0, 11) == ['[0,20)', '[20,40)', '[40,60)', '[60,80)', '[80,100)', '[100,120)',
+                                      '[120,140)', '[140,160)', '[160,180)', '[180,200)', '[200,inf)']
+    assert labels(0.0, 10.0, 5) == ['[0,2.5)', '[2.5,5)', '[5.0,7.5)', '[7.5,10)', '[10.0,inf)']
+
+
+def test_readcastaliaoutput_runs():
+    alist = [Attribute("module", "VARCHAR"), Attribute("node", "INT"), Attribute("name", "VARCHAR"),
+             Attribute("label", "VARCHAR"), Attribute("n_index", "INT"), Attribute("data", "FLOAT"),
+             Attribute("run", "INT")]
+    d = StatsDatabase()
+    d.create_table("dataTable", alist)
+    d.load_data_castalia_runs([castalia_output_file()] * 3, processes=2)
+    assert d.execute("SELECT run, COUNT(*) FROM dataTable GROUP BY run ORDER BY run") == [(0, 21), (1, 21), (2, 21)]
+    res = d.execute("SELECT node, AVG(data), STDDEV(data), CI95(data) FROM dataTable "
+                    "WHERE name = 'Consumed Energy' GROUP BY node ORDER BY node")
+    assert res == [(0, 6.79813, 0.0, 0.0), (1, 6.28785, 0.0, 0.0), (2, 6.28569, 0.0, 0.0)]
+    d.conn.close()
+
+
+def test_stddev():
+    d = StatsDatabase()
+    d.create_table("t", [Attribute("x", "FLOAT")])
+    assert d.execute("SELECT STDDEV(x), CI95(x) FROM t") == [(None, None)]
+    d.conn.executemany("INSERT INTO t(x) VALUES(?)", [(2.0,), (4.0,), (4.0,), (4.0,), (5.0,), (5.0,), (7.0,), (9.0,)])
+    stddev, ci95 = d.execute("SELECT STDDEV(x), CI95(x) FROM t")[0]
+    assert stddev == pytest.approx(2.138089935)
+    assert ci95 == pytest.approx(1.96 * 2.138089935 / 8 ** 0.5)
+    d.conn.close()
+
+
+def test_readCSV_batches(tmp_dir):
+    datafile = os.path.join(tmp_dir, "csv_batches.txt")
+    with open(datafile, "w") as f:
+        f.write("node, name, data\n")
+        for i in range(1000):
+            f.write("%d, name%d, %d\n" % (i % 3, i, i))
+    table = nsdTable("csvTable", [Column("name"), Column("node"), Column("data")], datafile, "csv", ["node"])
+    d = StatsDatabase(testing=True)
+    create_table(d, table)
+    d.load_data_csv(table, node_mapping_file(), batch_size=64)
+    assert not d.conn.in_transaction
+    assert d.execute("SELECT COUNT(*) FROM csvTable") == [(1000,)]
+    assert d.execute("SELECT node, name, data FROM csvTable WHERE data = '998'") == [('plan2', 'name998', '998')]
+    d.conn.close()
+
+
+def test_remap_results_database(tmp_dir):
+    dbfile = os.path.join(tmp_dir, "remap_" + RESULTS_DB_FILE)
+    nodemap = os.path.join(tmp_dir, "remap_nodemap.json")
+    alist = [Attribute("module", "VARCHAR"), Attribute("node", "INT"), Attribute("name", "VARCHAR"),
+             Attribute("label", "VARCHAR"), Attribute("n_index", "INT"), Attribute("data", "FLOAT")]
+    sources = [castalia_output_file()]
+
+    shutil.copy(node_mapping_file(), nodemap)
+    d = StatsDatabase(dbfile=dbfile)
+    d.create_table("dataTable", alist)
+    d.load_data_castalia(castalia_output_file(), node_mapping_file=nodemap)
+    d.stamp_table("dataTable", alist, sources)
+    assert d.get_nodes() == ['plan0', 'plan1', 'plan2']
+    d.conn.close()
+
+    # a new node mapping is applied to the stored table
+    with open(nodemap, "w") as f:
+        json.dump({"nodes": [{"simid": i, "nodeid": "mote%d" % i} for i in range(3)]}, f)
+    d = StatsDatabase(dbfile=dbfile)
+    assert d.restore_table("dataTable", alist, sources, nodemap) is not None
+    assert d.get_nodes() == ['mote0', 'mote1', 'mote2']
+    assert d.execute("SELECT n_index FROM dataTable WHERE name = 'Packets received per node'") == [('mote1',), ('mote2',)]
+    assert d.execute("SELECT MAX(n_index) FROM dataTable WHERE name = 'Application level latency, in ms'") == [(10,)]
+    d.conn.close()
+
+    # numeric plan ids cannot be told apart from castalia ids: the table must be reloaded
+    with open(nodemap, "w") as f:
+        json.dump({"nodes": [{"simid": i, "nodeid": str(i + 1)} for i in range(3)]}, f)
+    d = StatsDatabase(dbfile=dbfile)
+    assert d.restore_table("dataTable", alist, sources, nodemap) is not None
+    d.conn.close()
+    with open(nodemap, "w") as f:
+        json.dump({"nodes": [{"simid": i, "nodeid": "plan%d" % i} for i in range(3)]}, f)
+    d = StatsDatabase(dbfile=dbfile)
+    assert d.restore_table("dataTable", alist, sources, nodemap) is None
+    d.conn.close()
@@ -119,6 +119,15 @@ def test_views_plots_decoder():
 table = Table('foo', [Column('a'), Column('b'), Column('name'), Column('dummy')])
 
 
+def test_plotmodel_max_points():
+    d = {"model_type": "plot", "stat_type": "network", "x": ["a"], "y": ["b"]}
+    assert ViewsPlotsDecoder.gen_plotmodel(table, dict(d, max_points=2)).max_points == 2
+    assert ViewsPlotsDecoder.gen_plotmodel(table, dict(d, max_points=0)).max_points == 0
+    for bad in (1, -5, "10"):
+        with pytest.raises(RuntimeError):
+            ViewsPlotsDecoder.gen_plotmodel(table, dict(d, max_points=bad))
+
+
 def test_selector_parser():
     sel_str = 'a: 1, b: greater_than(5)|less_equal(3), name: "Consumed Energy"'
     selector = SelectorParser.parse(sel_str, table)
@@ -6,15 +6,17 @@ Created on Feb 03, 2015
 '''
 
 from datavis.model2plots import collect_tables_for_pml, expression2sql, derived2sql, create_view_for_derived, \
-    create_plot_for_model, model2plots
+    create_plot_for_model, model2plots, ParameterGroups, castalia_runs, table_attributes
 from datavis.database import less_than, StatsDatabase, Attribute, not_equal
 from models.nsdplot import Table, DerivedTable, Column, ColumnExpr, ConstantExpr, ColumnRef, Operator, PlotModel, \
     PLUS, MINUS, DIV, MULT, EQ, NOTEQ, LESS, LESS_EQ, GREATER, GREATER_EQ, AVG, COUNT, MAX, MIN, \
     SUM, LAND, LOR, DATA_TABLE
 from datavis.results2json import JsonOutput
+from datavis.datavis_logger import DatavisProcess
 from datavis.tests.test_database import castalia_output_file
 import json
 import os
+import shutil
 
 def test_collect_tables_for_pml():
     ca = Column("a")
@@ -350,4 +352,76 @@ def test_model2plots(tmp_dir):
     model2plots([pm, pm2], jo, castalia_output_file())
 
     # restore the working directory to its previous value
-    os.chdir(curdir)
\ No newline at end of file
+    os.chdir(curdir)
+
+def test_model2plots_parallel(tmp_dir):
+    curdir = os.getcwd()
+    # change dir so that the generated plots will go into that dir
+    os.chdir(tmp_dir)
+
+    def plot_models():
+        f = Operator(EQ, [ColumnRef(DATA_TABLE.col["name"]), ConstantExpr("\"Consumed Energy\"")])
+        dt = DerivedTable("parallel_energy", [Column("node"), Column("data"), Column("name")], [DATA_TABLE], f)
+        q = Operator(EQ, [ColumnRef(DATA_TABLE.col["name"]), ConstantExpr("\"Packets received per node\"")])
+        n2n = DerivedTable("parallel_n2n", [Column("node"), Column("n_index"), Column("data")], [DATA_TABLE], q)
+        return [PlotModel("plot", "network", dt, (dt.col["node"],), (dt.col["data"],), None, {}),
+                PlotModel("parameter", "node", dt, (dt.col["node"],), (dt.col["data"],), title="Energy"),
+                PlotModel("parameter", "node2node", n2n, (n2n.col["node"], n2n.col["n_index"]), (n2n.col["data"],),
+                          title="Packets received per node"),
+                PlotModel("parameter", "node", dt, (dt.col["node"],), (dt.col["data"],),
+                          select={"node": 7}, title="No such node")]
+
+    results = []
+    for workers in (1, 3):
+        records = []
+        progress = []
+        jo = JsonOutput("simulation_results", "SIM1391536771845")
+        with DatavisProcess(records):
+            model2plots(plot_models(), jo, castalia_output_file(), workers=workers,
+                        progress=lambda jo, flush: progress.append((len(jo.network_plot_results), flush)))
+        results.append((jo.get_json(), [r["message"] for r in records], progress))
+
+    assert results[0] == results[1]
+    assert any("No such node" in msg and "no data found" in msg for msg in results[1][1])
+    # the parameters are generated (and flushed) first
+    assert results[0][2] == [(0, False), (0, False), (0, True), (1, False)]
+
+    # restore the working directory to its previous value
+    os.chdir(curdir)
+
+
+def test_parameter_groups():
+    d = StatsDatabase(testing=True)
+    d.load_data_castalia(castalia_output_file())
+    node, n_index, data = DATA_TABLE.col["node"], DATA_TABLE.col["n_index"], DATA_TABLE.col["data"]
+    pms = [PlotModel("parameter", "node", DATA_TABLE, (node,), (data,), select={"name": "TXed pkts"}),
+           PlotModel("parameter", "node", DATA_TABLE, (node,), (n_index,), select={"name": "TXed pkts"}),
+           PlotModel("parameter", "node", DATA_TABLE, (node,), (data,), select={"name": "Consumed Energy"}),
+           PlotModel("parameter", "network", DATA_TABLE, None, (data,), select={"name": "TXed pkts"})]
+    expected = [d.conn.execute(d.relations["dataTable"].sql_select([c.name for c in pm.x + pm.y], where=pm.select,
+                                                                   order=["node"])).fetchall()
+                for pm in pms[:2]]
+
+    parameters = ParameterGroups(pms, d)
+    queries = []
+    d.conn.set_trace_callback(queries.append)
+    assert [parameters.rows(pm, d) for pm in pms] == expected + [None, None]
+    assert len(queries) == 1
+    # the results are released after the last parameter of the group
+    assert parameters.results == {}
+
+
+def test_castalia_runs_from_pattern(tmp_dir, monkeypatch):
+    simhome = os.path.join(tmp_dir, "castalia_runs")
+    os.mkdir(simhome)
+    for i in (1, 0):
+        shutil.copy(castalia_output_file(), os.path.join(simhome, "simout-%d.txt" % i))
+    monkeypatch.chdir(simhome)
+
+    t = Table("dataTable", [Column(c) for c in ("node", "name", "module", "label", "n_index", "data")],
+              filename="simout-*.txt", format="dataTable")
+    assert castalia_runs(t) == ["simout-0.txt", "simout-1.txt"]
+    assert table_attributes(t)[-1].name == "run"
+
+    t.filename = "simout.txt"
+    assert castalia_runs(t) is None
@@ -0,0 +1,103 @@
+'''
+Tests for reading OMNeT++ result files
+'''
+
+import os
+from models.nsdplot import Table as nsdTable, Column
+from datavis.model2plots import create_table, populate_table
+from datavis.database import StatsDatabase
+from datavis.omnetpp import VectorStore, read_scalars, split_module, STORE_SUFFIX
+from datavis.tests.test_database import node_mapping_file
+
+VEC = """version 2
+run General-0-20150301-12:00:00-1234
+attr configname General
+vector 0 SN.node[0].Communication.Radio "RX pkts" ETV
+vector 1 SN.node[1].ResourceManager "Consumed Energy" TV
+vector 2 SN.wirelessChannel sinr ETV
+0\t10\t0.5\t1
+1\t0.5\t0.25
+0\t12\t1.5\t2
+2\t13\t1.5\t-3.5
+0\t20\t2.5\t3
+"""
+
+SCA = """version 2
+run General-0-20150301-12:00:00-1234
+scalar SN.node[0].ResourceManager "Consumed Energy" 6.79813
+scalar SN.node[2].ResourceManager "Consumed Energy" 6.28569
+statistic SN.node[1].Application "Application level latency"
+field count 3
+field mean 20.5
+attr unit ms
+bin -inf 0
+scalar SN.wirelessChannel "Packets" 42
+"""
+
+
+def write(tmp_dir, name, text):
+    fname = os.path.join(tmp_dir, name)
+    with open(fname, "w") as f:
+        f.write(text)
+    return fname
+
+
+def test_split_module():
+    assert split_module("SN.node[12].Communication.Radio") == (12, "Communication.Radio")
+    assert split_module("SN.wirelessChannel") == (None, "SN.wirelessChannel")
+
+
+def test_vector_store(tmp_dir):
+    vecfile = write(tmp_dir, "test_store.vec", VEC)
+    store = VectorStore(vecfile).open()
+    assert [(v["module"], v["name"], v["count"]) for v in store.vectors] == \
+        [("SN.node[0].Communication.Radio", "RX pkts", 3), ("SN.node[1].ResourceManager", "Consumed Energy", 1),
+         ("SN.wirelessChannel", "sinr", 1)]
+    v, = store.find(name="RX pkts")
+    assert list(store.column(v, "event")) == [10, 12, 20]
+    assert list(store.column(v, "time")) == [0.5, 1.5, 2.5]
+    assert list(store.column(v, "value")) == [1.0, 2.0, 3.0]
+    v, = store.find(module="SN.node[1].ResourceManager")
+    assert store.column(v, "event") is None
+    store.close()
+
+    # the store is reused while the vector file is unchanged
+    mtime = os.stat(os.path.join(vecfile + STORE_SUFFIX, "index.json")).st_mtime_ns
+    VectorStore(vecfile).open().close()
+    assert os.stat(os.path.join(vecfile + STORE_SUFFIX, "index.json")).st_mtime_ns == mtime
+
+
+def test_load_vectors(tmp_dir):
+    vecfile = write(tmp_dir, "test_load.vec", VEC)
+    table = nsdTable("vecTable", [Column("node", type="int"), Column("module"), Column("name"), Column("time", type="real"),
+                                  Column("data", type="real")], vecfile, "vector", ["node"])
+    d = StatsDatabase()
+    create_table(d, table)
+    populate_table(d, table)
+    assert d.execute("SELECT * FROM vecTable ORDER BY time, module") == [
+        (0, "Communication.Radio", "RX pkts", 0.5, 1.0),
+        (1, "ResourceManager", "Consumed Energy", 0.5, 0.25),
+        (0, "Communication.Radio", "RX pkts", 1.5, 2.0),
+        (None, "SN.wirelessChannel", "sinr", 1.5, -3.5),
+        (0, "Communication.Radio", "RX pkts", 2.5, 3.0)]
+
+    d = StatsDatabase()
+    create_table(d, table)
+    d.load_data_vectors(table, node_mapping_file())
+    assert d.execute("SELECT DISTINCT node FROM vecTable ORDER BY node") == [(None,), ("plan0",), ("plan1",)]
+
+
+def test_load_scalars(tmp_dir):
+    scafile = write(tmp_dir, "test_load.sca", SCA)
+    assert len(list(read_scalars(scafile))) == 5
+    table = nsdTable("scaTable", [Column("module"), Column("node"), Column("name"), Column("data", type="real")],
+                     scafile, "scalar", ["node"])
+    d = StatsDatabase()
+    create_table(d, table)
+    d.load_data_scalars(table, node_mapping_file())
+    assert d.execute("SELECT * FROM scaTable") == [
+        ("ResourceManager", "plan0", "Consumed Energy", 6.79813),
+        ("ResourceManager", "plan2", "Consumed Energy", 6.28569),
+        ("Application", "plan1", "Application level latency:count", 3.0),
+        ("Application", "plan1", "Application level latency:mean", 20.5),
+        ("SN.wirelessChannel", None, "Packets", 42.0)]
@@ -0,0 +1,95 @@
+'''
+Tests for the publication of simulation results
+'''
+
+import os
+from simgen.datastore import DataStore
+from datavis.output_handler import AttachmentUploader, ResultsPublisher, SimOutputHandler, RESULT_FIELDS
+
+
+class MemoryStore(DataStore):
+    """A datastore holding the root object in memory"""
+    def __init__(self):
+        super().__init__("mem://sim")
+        self.doc = {"_id": "sim", "_rev": "1", "simulation_status": "RUNNING"}
+        self.uploads = 0
+        # the simulation status at each upload
+        self.upload_status = []
+
+    def get_root_object(self):
+        return dict(self.doc)
+
+    def __new_rev(self):
+        self.doc["_rev"] = str(int(self.doc["_rev"]) + 1)
+        return self.doc["_rev"]
+
+    def put_root_object(self, sim):
+        assert sim["_rev"] == self.doc["_rev"]
+        self.doc = dict(sim)
+        self.__new_rev()
+        return dict(self.doc)
+
+    def put_root_attachment(self, name, data, content_type, rev):
+        assert rev == self.doc["_rev"]
+        self.uploads += 1
+        self.upload_status.append(self.doc["simulation_status"])
+        self.doc["_attachments"] = dict(self.doc.get("_attachments", {}), **{name: data.read()})
+        return self.__new_rev()
+
+
+def results(*files):
+    res = {field: [] for field in RESULT_FIELDS}
+    res["network_plot_results"] = [{"file_id": fname} for fname in files]
+    return res
+
+
+def make_files(tmp_dir, *names):
+    files = []
+    for name in names:
+        files.append(os.path.join(tmp_dir, name))
+        with open(files[-1], "wb") as f:
+            f.write(name.encode())
+    return files
+
+
+def test_upload_all(tmp_dir):
+    files = make_files(tmp_dir, "plot1.png", "plot2.png")
+    store = MemoryStore()
+    uploader = AttachmentUploader(store, store.doc["_rev"])
+    missing = os.path.join(tmp_dir, "missing.png")
+    failed = uploader.upload_all([(fname, "image/png") for fname in files + [missing]])
+    assert failed == [missing]
+    # each file is sent once, with the revision made by the previous upload
+    assert store.uploads == 2
+    assert sorted(store.doc["_attachments"]) == files
+    assert uploader.rev == store.doc["_rev"]
+
+
+def test_publish_status_after_uploads(tmp_dir):
+    plot, = make_files(tmp_dir, "plot1.png")
+    missing = os.path.join(tmp_dir, "missing.png")
+    store = MemoryStore()
+    doc = ResultsPublisher(store).publish(results(plot, missing), 'FINISHED')
+    assert store.upload_status == ['RUNNING']
+    assert doc["simulation_status"] == store.doc["simulation_status"] == 'FINISHED'
+    # the plot which could not be uploaded is left out
+    assert store.doc["network_plot_results"] == [{"file_id": plot}]
+    assert list(store.doc["_attachments"]) == [plot]
+
+
+def test_abort_after_partial_publish(tmp_dir):
+    plot = os.path.join(tmp_dir, "plot1.png")
+    with open(plot, "wb") as f:
+        f.write(b"png")
+
+    store = MemoryStore()
+    handler = SimOutputHandler(ResultsPublisher(store))
+    handler.publisher.publish(results(plot))
+    assert list(store.doc["_attachments"]) == [plot]
+    assert store.doc["network_plot_results"] == [{"file_id": plot}]
+
+    handler.status = 'ABORTED'
+    handler.create_null_SIMOUTPUT()
+    assert store.doc["simulation_status"] == 'ABORTED'
+    assert store.doc["network_plot_results"] == []
+    assert store.doc["_attachments"] == {}
@@ -0,0 +1,66 @@
+'''
+Tests for the cache of parsed Castalia output
+'''
+
+import os
+import shutil
+from datavis.database import StatsDatabase
+from datavis.parse_cache import ParseCache
+from datavis.tests.test_database import castalia_output_file, node_mapping_file
+
+
+def test_store_restore(tmp_dir):
+    cache = ParseCache(os.path.join(tmp_dir, "cache_store_restore"), 1 << 20)
+
+    d1 = StatsDatabase(testing=True)
+    assert not cache.restore(d1, castalia_output_file(), "dataTable")
+    d1.load_data_castalia(castalia_output_file(), node_mapping_file=None)
+    cache.store(d1, castalia_output_file(), "dataTable")
+    d1.map_castalia_nodes("dataTable", node_mapping_file())
+
+    d2 = StatsDatabase(testing=True)
+    assert cache.restore(d2, castalia_output_file(), "dataTable")
+    d2.map_castalia_nodes("dataTable", node_mapping_file())
+    assert d1.get_datatable() == d2.get_datatable()
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # cached rows are not node-mapped
+    d3 = StatsDatabase(testing=True)
+    assert cache.restore(d3, castalia_output_file(), "dataTable")
+    assert d3.get_nodes() == [0, 1, 2]
+    cache.close()
+
+
+def test_eviction(tmp_dir):
+    cachedir = os.path.join(tmp_dir, "cache_eviction")
+    cache = ParseCache(cachedir, 1)
+
+    datafile = os.path.join(tmp_dir, "simout_eviction.txt")
+    shutil.copy(castalia_output_file(), datafile)
+    d = StatsDatabase(testing=True)
+    d.load_data_castalia(datafile, node_mapping_file=None)
+    cache.store(d, datafile, "dataTable")
+
+    # the cache cannot hold even a single entry
+    assert [f for f in os.listdir(cachedir) if f != "index.sqlite"] == []
+    assert not cache.restore(StatsDatabase(testing=True), datafile, "dataTable")
+    cache.close()
+
+
+def test_damaged_entry(tmp_dir):
+    cachedir = os.path.join(tmp_dir, "cache_damaged")
+    cache = ParseCache(cachedir, 1 << 20)
+    d = StatsDatabase(testing=True)
+    d.load_data_castalia(castalia_output_file(), node_mapping_file=None)
+    cache.store(d, castalia_output_file(), "dataTable")
+
+    # an empty database, as left by restoring an entry evicted concurrently
+    entry, = [os.path.join(cachedir, f) for f in os.listdir(cachedir) if f != "index.sqlite"]
+    open(entry, "w").close()
+    assert not cache.restore(StatsDatabase(testing=True), castalia_output_file(), "dataTable")
+    assert not os.path.exists(entry)
+
+    # the entry is stored again
+    cache.store(d, castalia_output_file(), "dataTable")
+    assert cache.restore(StatsDatabase(testing=True), castalia_output_file(), "dataTable")
+    cache.close()
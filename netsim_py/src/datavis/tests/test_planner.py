@@ -0,0 +1,84 @@
+'''
+Tests for the physical design of the statistics database
+'''
+
+from datavis.planner import plan_indexes, create_indexes, filter_columns, plan_materialization
+import datavis.planner
+from datavis.model2plots import collect_tables_for_pml, create_view_for_derived
+from datavis.database import StatsDatabase, less_than
+from datavis.tests.test_database import castalia_output_file
+from models.nsdplot import DerivedTable, Column, ColumnExpr, ColumnRef, ConstantExpr, Operator, PlotModel, \
+    EQ, LAND, LOR, LESS, SUM, DATA_TABLE
+
+
+def energy_view():
+    f = Operator(EQ, [ColumnRef(DATA_TABLE.col["name"]), ConstantExpr("\"Consumed Energy\"")])
+    return DerivedTable("energy", [Column("node"), Column("data")], [DATA_TABLE], f)
+
+
+def test_filter_columns():
+    name = ColumnRef(DATA_TABLE.col["name"])
+    node = ColumnRef(DATA_TABLE.col["node"])
+    f = Operator(LAND, [Operator(EQ, [name, ConstantExpr("'x'")]), Operator(LESS, [node, ConstantExpr(3)])])
+    assert filter_columns(f) == (["name"], ["node"])
+    assert filter_columns(Operator(LOR, [Operator(EQ, [name, ConstantExpr("'x'")]), f])) == ([], [])
+    assert filter_columns(None) == ([], [])
+
+
+def test_plan_indexes():
+    dt = energy_view()
+    pm = PlotModel("plot", "network", dt, (dt.col["node"],), (dt.col["data"],))
+    pml = [pm]
+    idx = plan_indexes(pml, collect_tables_for_pml(pml))
+    # the view and the plot are both served by one covering index
+    assert [(i.table.name, i.columns, i.uses) for i in idx] == [("dataTable", ["name", "node", "data"], 2)]
+
+    # nothing is traced through grouped views
+    c_data = ColumnExpr("data", Operator(SUM, [ColumnRef(DATA_TABLE.col["data"])]))
+    gdt = DerivedTable("total", [Column("name"), c_data], [DATA_TABLE], None, [DATA_TABLE.col["name"]])
+    pm2 = PlotModel("parameter", "network", gdt, None, (gdt.col["data"],), select={"name": less_than("b")})
+    idx = plan_indexes([pm2], collect_tables_for_pml([pm2]))
+    assert [(i.table.name, i.columns, i.uses) for i in idx] == [("dataTable", ["name", "data"], 1)]
+
+
+def test_create_indexes(monkeypatch):
+    dt = energy_view()
+    pm = PlotModel("plot", "network", dt, (dt.col["node"],), (dt.col["data"],))
+    ds = StatsDatabase(testing=True)
+    ds.load_data_castalia(castalia_output_file())
+    create_view_for_derived(ds, dt)
+
+    def indexes():
+        return ds.execute("SELECT name FROM sqlite_master WHERE type='index'")
+
+    create_indexes(ds, [pm], collect_tables_for_pml([pm]))
+    assert indexes() == []
+
+    monkeypatch.setattr(datavis.planner, "MIN_INDEXED_ROWS", 1)
+    create_indexes(ds, [pm], collect_tables_for_pml([pm]))
+    assert indexes() == [("auto_dataTable_name_node_data",)]
+
+
+def test_plan_materialization(monkeypatch):
+    c_data = ColumnExpr("data", Operator(SUM, [ColumnRef(DATA_TABLE.col["data"])]))
+    gdt = DerivedTable("total", [Column("name"), c_data], [DATA_TABLE], None, [DATA_TABLE.col["name"]])
+    dt = energy_view()
+    pml = [PlotModel("parameter", "network", gdt, None, (gdt.col["data"],), select={"name": less_than("b")}),
+           PlotModel("parameter", "network", gdt, None, (gdt.col["data"],), select={"name": "TXed pkts"}),
+           PlotModel("plot", "network", dt, (dt.col["node"],), (dt.col["data"],)),
+           PlotModel("plot", "network", dt, (dt.col["data"],), (dt.col["node"],))]
+    ds = StatsDatabase(testing=True)
+    ds.load_data_castalia(castalia_output_file())
+    table_list = collect_tables_for_pml(pml)
+
+    # the test data is too small to be worth it
+    assert plan_materialization(ds, pml, table_list) == set()
+
+    # views over a single table, which are not grouped, are never materialized
+    monkeypatch.setattr(datavis.planner, "MIN_MATERIALIZED_COST", 1)
+    assert plan_materialization(ds, pml, table_list) == {"total"}
+
+    create_view_for_derived(ds, gdt, materialize=True)
+    assert ds.execute("SELECT type FROM sqlite_master WHERE name='total'") == [("table",)]
+    assert ds.execute("SELECT name, data FROM total ORDER BY name") == \
+        ds.execute("SELECT name, SUM(data) FROM dataTable GROUP BY name ORDER BY name")
@@ -0,0 +1,95 @@
+'''
+Tests for the cache of rendered plots
+'''
+
+import os
+import re
+from models.nsdplot import Column
+from datavis.database import StatsDatabase
+from datavis.create_plot import make_plot, PNG
+from datavis.render_cache import RenderCache
+from datavis.tests.test_database import castalia_output_file
+
+
+class FakeSession:
+    """A gnuplot session which writes the script into the output file"""
+    def __init__(self):
+        self.plots = 0
+
+    def render(self, script):
+        self.plots += 1
+        script = "".join(script)
+        output = re.search(r'set output "(.*)"', script).group(1)
+        with open(output, "w") as f:
+            f.write(script)
+        return True, ""
+
+
+def energy_plot(d, output):
+    return make_plot(d.relations["dataTable"], (Column("node"),), (Column("data"),), ["name"],
+                     select={"name": "Consumed Energy"}, terminal=PNG(), output=output)
+
+
+def test_render_cache(tmp_dir):
+    cache = RenderCache(os.path.join(tmp_dir, "render_cache"), 1 << 20)
+    session = FakeSession()
+    d = StatsDatabase(testing=True)
+    d.load_data_castalia(castalia_output_file())
+
+    out1 = os.path.join(tmp_dir, "render_cache_plot1")
+    assert energy_plot(d, out1).make_plot(session=session, cache=cache)
+    assert (session.plots, cache.hits, cache.misses) == (1, 0, 1)
+
+    # the same plot, into another file, is not rendered again
+    out2 = os.path.join(tmp_dir, "render_cache_plot2")
+    assert energy_plot(d, out2).make_plot(session=session, cache=cache)
+    assert (session.plots, cache.hits, cache.misses) == (1, 1, 1)
+    with open(out1 + ".png") as f1, open(out2 + ".png") as f2:
+        assert f1.read() == f2.read()
+
+    # different data is a miss
+    d.conn.execute("UPDATE dataTable SET data = data * 2")
+    assert energy_plot(d, out2).make_plot(session=session, cache=cache)
+    assert (session.plots, cache.hits, cache.misses) == (2, 1, 2)
+    with open(out1 + ".png") as f1, open(out2 + ".png") as f2:
+        assert f1.read() != f2.read()
+    cache.close()
+
+
+def test_render_cache_eviction(tmp_dir):
+    cachedir = os.path.join(tmp_dir, "render_cache_eviction")
+    cache = RenderCache(cachedir, 1)
+    d = StatsDatabase(testing=True)
+    d.load_data_castalia(castalia_output_file())
+
+    out = os.path.join(tmp_dir, "render_cache_eviction_plot")
+    assert energy_plot(d, out).make_plot(session=FakeSession(), cache=cache)
+
+    # the cache cannot hold even a single entry
+    assert os.listdir(cachedir) == ["index.sqlite"]
+    assert os.path.isfile(out + ".png")
+    cache.close()
+
+
+def test_render_cache_entries_not_shared(tmp_dir):
+    cache = RenderCache(os.path.join(tmp_dir, "render_cache_shared"), 1 << 20)
+    d = StatsDatabase(testing=True)
+    d.load_data_castalia(castalia_output_file())
+
+    out1 = os.path.join(tmp_dir, "render_cache_shared_plot1")
+    assert energy_plot(d, out1).make_plot(session=FakeSession(), cache=cache)
+    entries = [os.path.join(cache.path, f) for f in os.listdir(cache.path) if f != "index.sqlite"]
+    assert len(entries) == 1
+    # the stored entry is a copy of the rendered file
+    assert not os.path.samefile(entries[0], out1 + ".png")
+    with open(entries[0]) as f:
+        cached = f.read()
+
+    # a restored plot, re-rendered without the cache, leaves the entry alone
+    out2 = os.path.join(tmp_dir, "render_cache_shared_plot2")
+    assert energy_plot(d, out2).make_plot(session=FakeSession(), cache=cache)
+    d.conn.execute("UPDATE dataTable SET data = data * 2")
+    assert energy_plot(d, out2).make_plot(session=FakeSession())
+    with open(entries[0]) as f:
+        assert f.read() == cached
+    cache.close()
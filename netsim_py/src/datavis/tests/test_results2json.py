@@ -431,6 +431,33 @@ def test_plot2json():
     assert json.loads(correct_json) == json.loads(jo.get_json_string())
 
 
+def test_merge_node_results():
+    jo = JsonOutput("simulation_results", "123")
+    for name in ["a", "b"]:
+        for node in range(3):
+            npr = NodeParameterResults_node(str(node))
+            npr.add_result(NodeParameterResult(name, "", node))
+            jo.add_node_parameter_result(npr)
+            n2nr = Node2NodeResults_node(node, node + 1)
+            n2nr.add_parameter(Node2NodeResults_parameter(name, node, ""))
+            jo.add_node_2_node_result(n2nr)
+
+    other = JsonOutput("simulation_results", "123")
+    npr = NodeParameterResults_node("1")
+    npr.add_result(NodeParameterResult("c", "", 1))
+    other.add_node_parameter_result(npr)
+    jo.merge(other)
+
+    res = jo.get_json()
+    assert [r["node_id"] for r in res["node_parameter_results"]] == ["0", "1", "2"]
+    assert [p["name"] for p in res["node_parameter_results"][1]["results"]] == ["a", "b", "c"]
+    assert [(r["node1_id"], r["node2_id"], len(r["parameters"])) for r in res["node_2_node_results"]] == \
+        [(0, 1, 2), (1, 2, 2), (2, 3, 2)]
+    # the fields appear in the usual order
+    assert list(res["node_2_node_results"][0]) == ["node1_id", "node2_id", "parameters", "plots"]
+    assert json.loads(jo.get_json_string()) == res
+
+
 class executor_final_stage_test:
     @staticmethod
     def get_plot_models():
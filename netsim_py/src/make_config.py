@@ -80,10 +80,53 @@ http_server = wsgiref
 #
 project_repository = http://213.172.45.30:5984/
 
+#
+# Keep the parsed simulation statistics in a results.sqlite file inside
+# each simulation home, so that later plots do not re-parse the output
+#
+#datavis_results_db = yes
+
+#
+# A directory where parsed simulation outputs and rendered plots are cached,
+# shared by all simulation homes, and the size limits in MB of each
+#
+#datavis_cache_path = %(execdir)s/datavis_cache
+#datavis_cache_size = 1024
+#datavis_plot_cache_size = 256
+
+#
+# The renderer of plots: gnuplot (the default), or matplotlib, which draws
+# plots in-process (it needs the matplotlib package)
+#
+#datavis_renderer = matplotlib
+
+#
+# The maximum number of points drawn for each graph of a plot; longer
+# series are decimated, keeping their extremes (0, the default, means no limit)
+#
+#datavis_max_points = 10000
+
+#
+# The number of plots and parameters generated in parallel by datavis
+#
+#datavis_workers = 4
+
 
 # In this section you can customize defaults for the sim_runner server
 [sim_runner]
 
+#
+# The order in which queued jobs are processed: fairshare (the default), by
+# job priority, sharing the workers fairly among projects, or fifo
+#
+#monitor_scheduler = fifo
+
+#
+# The largest job priority; the priorities given to simulations are limited
+# to the range -monitor_max_priority .. monitor_max_priority
+#
+#monitor_max_priority = 10
+
 # In this section you can customize defaults for the unit tests
 [unit_test]
 
@@ -94,6 +94,8 @@ COUNT = Function('COUNT', False, True)
 MAX = Function('MAX', False, True)
 MIN = Function('MIN', False, True)
 SUM = Function('SUM', False, True)
+STDDEV = Function('STDDEV', False, True)  # sample standard deviation
+CI95 = Function('CI95', False, True)      # half-width of the 95% confidence interval of the mean
 
 LAND = Function('AND', True)
 LOR = Function('OR', True)
@@ -225,13 +227,15 @@ class PlotModel:
     logscale = attr(str)  # gnuplot syntax
     grid = attr(str)      # gnuplot syntax
     key = attr(str)       # gnuplot syntax
+    renderer = attr(str)  # e.g. 'gnuplot', 'matplotlib', by default the configured one
+    max_points = attr(int)  # points per graph, beyond which graphs are decimated (0: no limit)
 
     # These two are hard-coded (!)
     #terminal = None
     #output = DEFAULT
     def __init__(self, model_type, stat_type, rel, x, y, axes=None, select={}, title='DEFAULT', style='linespoints',
               legend='DEFAULT', xlabel=None, ylabel=None, x_range=None, y_range=None, logscale=None, grid=" ",
-              key=None, unit=""):
+              key=None, unit="", renderer=None, max_points=None):
         """
         Return a Plot object, containing a number of Graph objects.
 
@@ -254,6 +258,9 @@ class PlotModel:
         xlabel, x_range, ylabel, y_range: strings passed to gnuplot
         logscale: a string passed to gnuplot
         grid:     a string passed to gnuplot
+        renderer: the name of the plot renderer, if not the configured one
+        max_points: the number of points per graph beyond which graphs are decimated,
+                  if not the configured one
 
         info for json output
         type:     can be "node", "network", "node2node"
@@ -278,5 +285,7 @@ class PlotModel:
         self.stat_type = stat_type
         self.model_type = model_type
         self.unit = unit
+        self.renderer = renderer
+        self.max_points = max_points
 
 
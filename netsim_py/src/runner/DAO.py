@@ -10,6 +10,7 @@ from psycopg2 import connect
 import psycopg2.extensions as pg
 import logging
 import os.path
+import select
 
 
 from simgen.executor import instantiate_executor
@@ -305,6 +306,43 @@ class MonitorDao(DataAccessObject):
                 
 
 
+class JobListener:
+    """A dedicated database connection, listening for the notifications
+    of new jobs and job status changes (see create.sql).
+    """
+    # the channel notified with the jobid of new jobs and of jobs that change status
+    CHANNEL = 'monitor_jobs'
+
+    def __init__(self, dbconn):
+        self.db = connect(dbconn)
+        self.db.set_isolation_level(pg.ISOLATION_LEVEL_AUTOCOMMIT)
+        cursor = self.db.cursor()
+        try:
+            execSql(cursor, "LISTEN %s" % self.CHANNEL)
+        finally:
+            cursor.close()
+
+    def fileno(self):
+        return self.db.fileno()
+
+    def wait(self, timeout, *files):
+        """Wait up to timeout seconds for notifications, or until one of the
+        passed files (objects with a fileno() or file descriptors) becomes readable.
+
+        Returns the list of the jobids notified, which is empty on timeout.
+        """
+        if not self.db.notifies:
+            select.select([self] + list(files), [], [], timeout)
+            self.db.poll()
+        jobids = [int(n.payload) for n in self.db.notifies]
+        del self.db.notifies[:]
+        return jobids
+
+    def close(self):
+        self.db.close()
+
+
+
 class UserDao(DataAccessObject):
     "DAO for users"
     def __init__(self, pool):
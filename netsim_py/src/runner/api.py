@@ -169,7 +169,7 @@ def create_simulation(nsdid, xtorname=None):
     logfile = create_logstatistics(simhome)
     
     # create the job
-    Manager.create_job(xtor, url, simhome)
+    Manager.create_job(xtor, url, simhome, sim)
     return sim
 
 
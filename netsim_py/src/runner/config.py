@@ -202,6 +202,76 @@ def project_repository():
     return cfg["project_repository"]
 
 
+#
+# Optional: keep a persistent results database (results.sqlite)
+# in each simulation home, instead of an in-memory one
+#
+def datavis_results_db():
+    return cfg.defined("datavis_results_db") and cfg.getboolean("datavis_results_db")
+
+
+#
+# Optional: a directory shared by all simulation homes, where datavis
+# caches parsed simulation output and rendered plots, and the size limit
+# in MB of the parsed output
+#
+def datavis_cache_path():
+    return cfg["datavis_cache_path"] if cfg.defined("datavis_cache_path") else None
+
+def datavis_cache_size():
+    size = cfg["datavis_cache_size"] if cfg.defined("datavis_cache_size") else 1024
+    return int(size) * 1024 * 1024
+
+#
+# Optional: the size limit in MB of the rendered plots cached
+# in datavis_cache_path
+#
+def datavis_plot_cache_size():
+    size = cfg["datavis_plot_cache_size"] if cfg.defined("datavis_plot_cache_size") else 256
+    return int(size) * 1024 * 1024
+
+
+#
+# Optional: the renderer of datavis plots, "gnuplot" (the default) or
+# "matplotlib" (in-process, needs the matplotlib package)
+#
+def datavis_renderer():
+    return cfg["datavis_renderer"] if cfg.defined("datavis_renderer") else "gnuplot"
+
+
+#
+# Optional: the maximum number of points drawn for each graph of a datavis
+# plot; longer series are decimated, keeping their extremes (0, the default:
+# no limit)
+#
+def datavis_max_points():
+    return int(cfg["datavis_max_points"]) if cfg.defined("datavis_max_points") else 0
+
+
+#
+# Optional: the number of worker threads generating plots and parameters
+# in datavis (1, the default, generates them sequentially)
+#
+def datavis_workers():
+    return int(cfg["datavis_workers"]) if cfg.defined("datavis_workers") else 1
+
+
+#
+# Optional: the scheduler of the tasks of the monitor engines, "fairshare"
+# (the default: by priority, fairly among projects, with aging) or "fifo"
+#
+def monitor_scheduler():
+    return cfg["monitor_scheduler"] if cfg.defined("monitor_scheduler") else "fairshare"
+
+
+#
+# Optional: the largest priority of a job (default 10); the priority field
+# of a simulation is limited to [-monitor_max_priority, monitor_max_priority]
+#
+def monitor_max_priority():
+    return int(cfg["monitor_max_priority"]) if cfg.defined("monitor_max_priority") else 10
+
+
 
 #################################################
 ## DO NOT EDIT BELOW THIS LINE 
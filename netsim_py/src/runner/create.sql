@@ -106,11 +106,19 @@ $$ LANGUAGE SQL;
 
 
 --
--- Create a new job for the given file location. The job starts at INIT status and READY state
+-- Create a new job for the given file location. The job starts at INIT status and READY state.
+-- The jobid is notified on channel monitor_jobs.
 --
-CREATE OR REPLACE FUNCTION monitor.new_job(exec text, floc text) RETURNS bigint AS '
-  INSERT INTO monitor.simjob(executor, fileloc, tscreated, tsinstatus) VALUES($1, $2, NOW(), NOW()) RETURNING jobid;
-' LANGUAGE SQL;
+CREATE OR REPLACE FUNCTION monitor.new_job(exec text, floc text) RETURNS bigint AS $$
+	DECLARE
+		jid bigint;
+	BEGIN
+		INSERT INTO monitor.simjob(executor, fileloc, tscreated, tsinstatus) VALUES(exec, floc, NOW(), NOW())
+		RETURNING jobid INTO jid;
+		PERFORM pg_notify('monitor_jobs', jid::text);
+		RETURN jid;
+	END
+$$ LANGUAGE plpgsql;
 
 
 --
@@ -146,7 +154,7 @@ $$ LANGUAGE plpgsql;
 
 
 --
--- Change the status of a job.
+-- Change the status of a job, making it READY, and notify its jobid on channel monitor_jobs.
 -- If the current status is FINISHED or ABORTED an error is raised
 --
 CREATE OR REPLACE FUNCTION monitor.change_job_status(jid bigint, newstatus monitor.JobStatus) RETURNS void AS $$
@@ -163,6 +171,7 @@ CREATE OR REPLACE FUNCTION monitor.change_job_status(jid bigint, newstatus monit
 			UPDATE monitor.simjob 
 				SET status = newstatus, last_status=oldstatus, tsinstatus=ctime, state='READY'  
 				WHERE jobid = jid;
+			PERFORM pg_notify('monitor_jobs', jid::text);
 		END IF;
 	END 
 $$ LANGUAGE plpgsql;
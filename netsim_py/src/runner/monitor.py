@@ -7,23 +7,31 @@ Created on Mar 2, 2014
 @author: juls
 '''
 
-from threading import Thread, RLock, Condition
+from threading import Thread, Lock, RLock, Condition
 from psycopg2.pool import ThreadedConnectionPool
 
 import time
 import logging
 import os.path
+import select
 from shutil import copyfile
 
 from runner.dpcmrepo import repo
-from runner.DAO import JobDao, ExecutorDao, JobStatus, SimJob, UserDao
-from runner.config import monitor_init
+from runner.DAO import JobDao, ExecutorDao, JobStatus, SimJob, UserDao, JobListener
+from runner.config import monitor_init, monitor_scheduler, monitor_max_priority
+from runner.scheduler import create_scheduler, job_priority
 from runner.apierrors import *
 from subprocess import CalledProcessError
 from simgen.executor import Executor
 
 from models.aaa import User
 
+
+# The time (in seconds) before the scheduling attributes of a job, which could
+# not be read from the project repository, are read again
+JOB_SCHEDULING_RETRY = 300
+
+
 class Manager:
     """A singleton class managing the whole execution engine.
     
@@ -52,6 +60,12 @@ class Manager:
         self.default_executor = None   # the default executor for jobs
         self._create_executors()
 
+        # the scheduling attributes of active jobs, by simid, as pairs
+        # (attributes, expiry time), where expiry is None unless they are the defaults
+        # used while the project repository cannot be read
+        self._job_sched_cache = {}
+        self.job_scheduling_lock = RLock()
+
         # monitor registry
         self.monitors = {}             # the monitor registry
         self._create_monitors()
@@ -71,11 +85,13 @@ class Manager:
 
     def _create_monitors(self):
         for name, nw in monitor_init():
-            self.monitors[name] = MonitorEngine(name, nw)
+            self.monitors[name] = MonitorEngine(name, nw, create_scheduler(monitor_scheduler()))
 
-        # Start the db monitoring task
+        # Start the db monitoring task, run whenever jobs change
         main = self.monitors['main']
-        self.dbMonitor = main.add_task(DbPollTask(main))
+        self.dbListener = DbListener(main, self.dbconn)
+        self.dbMonitor = self.dbListener.task
+        self.dbListener.start()
 
 
 
@@ -94,6 +110,9 @@ class Manager:
     def shutdown():
         '''Shut down the manager.'''
         self = Manager.SINGLETON
+        self.log.info("Stopping the database listener")
+        self.dbListener.stop()
+
         allmon = self.monitors.values()
         self.log.info("Disabling monitors")
         self.monitors = {}
@@ -139,13 +158,18 @@ class Manager:
             yield ex
 
     @staticmethod
-    def create_job(exctor, url, simhome=None):
+    def create_job(exctor, url, simhome=None, sim=None):
         '''
         Create a new job on the given executor and for the passed url and
-        simhome.
+        simhome. If the simulation object sim is passed, the scheduling
+        attributes of the job are taken from it.
         '''
         self = Manager.SINGLETON
         fileloc = exctor.create_simulation(url, simhome)
+        if sim is not None:
+            with self.job_scheduling_lock:
+                self._job_sched_cache[SimJob.make_simid(exctor.name, fileloc)] = \
+                    (Manager.scheduling_attributes(sim), None)
         Manager.getDao().submit_new_job(exctor.name, fileloc)
         return fileloc
 
@@ -219,6 +243,44 @@ class Manager:
         homedir = Manager.executor(xtor).homedir
         return os.path.join(homedir, bname)
 
+    @staticmethod
+    def scheduling_attributes(sim):
+        '''Return the scheduling attributes (priority, share) of the jobs of
+        a simulation object, i.e., its priority field (default 0, limited by
+        monitor_max_priority) and its project.'''
+        return (job_priority(sim.get('priority', 0), monitor_max_priority()), sim.get('project_id'))
+
+    @staticmethod
+    def job_scheduling(job):
+        '''Return the scheduling attributes (priority, share) of a job (see
+        scheduling_attributes). They are known for the jobs created by create_job;
+        for other jobs (e.g., recovered ones), they are read once from the project
+        repository. If it cannot be read, the defaults (0, None) are used, and it
+        is not read again for JOB_SCHEDULING_RETRY seconds.'''
+        self = Manager.SINGLETON
+        with self.job_scheduling_lock:
+            if job.simid in self._job_sched_cache:
+                attrs, expiry = self._job_sched_cache[job.simid]
+                if expiry is None or time.monotonic() < expiry:
+                    return attrs
+        try:
+            attrs = Manager.scheduling_attributes(repo().SIM.get(job.simid))
+            expiry = None
+        except Exception:
+            self.log.warning("Cannot read the scheduling attributes of %s", job.simid, exc_info=1)
+            attrs = (0, None)
+            expiry = time.monotonic() + JOB_SCHEDULING_RETRY
+        with self.job_scheduling_lock:
+            self._job_sched_cache[job.simid] = (attrs, expiry)
+        return attrs
+
+    @staticmethod
+    def forget_job_scheduling(job):
+        '''Discard the scheduling attributes of a job which is done.'''
+        self = Manager.SINGLETON
+        with self.job_scheduling_lock:
+            self._job_sched_cache.pop(job.simid, None)
+
     @staticmethod
     def create_user(user):
         '''Create a system system user for the given object'''
@@ -263,10 +325,11 @@ class MonitorEngine:
     Instances of this class act essentially as queues of tasks, which
     are instances of class MonitorTask. 
     Worker threads, which are instances of class MonitorWorker,
-     get tasks and execute them. 
+     get tasks and execute them. The order in which queued tasks are
+     executed is decided by a scheduler (see runner.scheduler).
     '''
     
-    def __init__(self, name, number_of_workers=4):
+    def __init__(self, name, number_of_workers=4, scheduler=None):
         '''
         Create an engine and initialize its database pool
         '''
@@ -282,7 +345,7 @@ class MonitorEngine:
         self.monitor_lock = RLock()
         
         # set up register for threads
-        self.task_queue = []
+        self.task_queue = scheduler if scheduler is not None else create_scheduler('fairshare')
         self.task_queue_not_empty = Condition(self.monitor_lock)
         self.shuttingDown = False        
                         
@@ -304,7 +367,7 @@ class MonitorEngine:
         with self.monitor_lock:
             if self.shuttingDown:
                 return None
-            self.task_queue.append(task)
+            self.task_queue.add(task)
             self.task_queue_not_empty.notify()
             return task
 
@@ -315,12 +378,19 @@ class MonitorEngine:
         If it returns null, we are shutting down.
         '''
         with self.monitor_lock:
-            while not (self.task_queue or self.shuttingDown):
+            while not (len(self.task_queue) or self.shuttingDown):
                 self.task_queue_not_empty.wait()
             if self.shuttingDown:
                 return None
-            assert self.task_queue
-            return self.task_queue.pop(0)
+            assert len(self.task_queue)
+            return self.task_queue.pop()
+
+    def queued_tasks(self):
+        '''
+        Return the list of queued tasks, in the order they will be executed.
+        '''
+        with self.monitor_lock:
+            return self.task_queue.tasks()
         
                 
     def shutdown(self):
@@ -375,11 +445,15 @@ class MonitorWorker(Thread):
 
 class MonitorTask:
     '''
-    An abstract base class for tasks that are controlled by a monitor engine
+    An abstract base class for tasks that are controlled by a monitor engine.
+
+    The priority and share of a task are used by the scheduler of the engine.
     '''
-    def __init__(self, engine, name="task"):
+    def __init__(self, engine, name="task", priority=0, share=None):
         self.engine = engine
         self.name = name
+        self.priority = priority
+        self.share = share
         self.log = logging.getLogger(self.engine.name)
     
     def execute(self):
@@ -394,30 +468,42 @@ class MonitorTask:
 
 class DbPollTask(MonitorTask):
     '''
-    The db monitor polls the database for events.
-    In particular, it examines for ready jobs to activate 
-    and cleans up old jobs
+    The db monitor examines the database for events.
+    In particular, it examines for ready jobs to activate.
+
+    The task is scheduled by a DbListener. Scheduling the task while it
+    is already queued has no effect, so bursts of events are handled by
+    a single run.
     '''
-    def __init__(self, engine, pollingPeriod=1, max_badcount=5):
-        MonitorTask.__init__(self,engine,"DbMonitor")
-        self.pollingPeriod = pollingPeriod
-        self.max_badcount = max_badcount
-        self.badcount = max_badcount
+    # job activation goes before the jobs already queued
+    PRIORITY = 100
+
+    def __init__(self, engine):
+        MonitorTask.__init__(self,engine,"DbMonitor", self.PRIORITY)
+        self.lock = Lock()
+        self.queued = False
+
+    def schedule(self):
+        '''
+        Queue the task in its engine, unless it is already queued.
+        '''
+        with self.lock:
+            if self.queued:
+                return
+            self.queued = True
+        if self.engine.add_task(self) is None:
+            # the engine is shutting down
+            with self.lock:
+                self.queued = False
 
     def execute(self):
+            with self.lock:
+                # events from now on need another run
+                self.queued = False
             try:
-                time.sleep(self.pollingPeriod)
                 self.examineDb()
             except:
                 self.log.exception("Exception in %s", self.name)
-                self.badcount -= 1
-                if self.badcount<=0:
-                    # A series of failures, we should abort
-                    self.log.critical("%s aborting.",self.name) 
-                    return
-            else:
-                self.badcount = self.max_badcount   # reset badcount
-            self.engine.add_task(self)
 
 
     def examineDb(self):
@@ -440,13 +526,79 @@ class DbPollTask(MonitorTask):
             self.engine.add_task(ProcessJob(self.engine, job))
 
 
+class DbListener(Thread):
+    '''
+    Schedules the DbPollTask of an engine whenever the database notifies
+    a new job or a job status change, so that stage transitions are handled
+    at once. For robustness, the task is also scheduled every fallbackPeriod
+    seconds without notifications. If the database cannot be listened to,
+    the task is scheduled every pollingPeriod seconds, until listening succeeds.
+    '''
+    def __init__(self, engine, dbconn, fallbackPeriod=30, pollingPeriod=1):
+        Thread.__init__(self, name="DbListener", daemon=True)
+        self.engine = engine
+        self.dbconn = dbconn
+        self.fallbackPeriod = fallbackPeriod
+        self.pollingPeriod = pollingPeriod
+        self.task = DbPollTask(engine)
+        self.log = logging.getLogger(engine.name)
+        self.stopping = False
+        # written to, to wake the thread up when stopping
+        self.wakeup_r, self.wakeup_w = os.pipe()
+
+    def listen(self):
+        '''
+        Return a JobListener, or None if the database cannot be listened to.
+        '''
+        try:
+            listener = JobListener(self.dbconn)
+        except Exception:
+            self.log.exception("Cannot listen for job notifications, polling every %s sec", self.pollingPeriod)
+            return None
+        self.log.info("Listening for job notifications")
+        return listener
+
+    def run(self):
+        listener = None
+        next_listen = 0
+        while not self.stopping:
+            # the first run also activates the jobs that were ready at startup
+            self.task.schedule()
+            if listener is None and time.time() >= next_listen:
+                listener = self.listen()
+                next_listen = time.time() + self.fallbackPeriod
+            try:
+                if listener is None:
+                    select.select([self.wakeup_r], [], [], self.pollingPeriod)
+                else:
+                    listener.wait(self.fallbackPeriod, self.wakeup_r)
+            except Exception:
+                self.log.exception("Lost the connection for job notifications")
+                if listener is not None:
+                    listener.close()
+                listener = None
+        if listener is not None:
+            listener.close()
+
+    def stop(self):
+        '''
+        Stop the thread and wait for it to exit.
+        '''
+        self.stopping = True
+        os.write(self.wakeup_w, b'x')
+        self.join()
+        os.close(self.wakeup_r)
+        os.close(self.wakeup_w)
+
+
 #
 #  The main Job processing thread
 #
 class ProcessJob(MonitorTask):
     
     def __init__(self, engine, job):
-        MonitorTask.__init__(self, engine, "[%s]" % job)
+        priority, share = Manager.job_scheduling(job)
+        MonitorTask.__init__(self, engine, "[%s]" % job, priority, share)
         self.job = job
         
     def execute(self):
@@ -466,6 +618,7 @@ class ProcessJob(MonitorTask):
                 # ABORTED or FINISHED
                 # 
                 dao.passivate_job(self.job)
+                Manager.forget_job_scheduling(self.job)
                 try:
                     executor = Manager.executor(self.job.executor)
                     executor.finalize(self.job.fileloc, self.job.jobid, self.job.status)
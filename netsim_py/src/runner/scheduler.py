@@ -0,0 +1,142 @@
+'''
+Task schedulers for the monitor engines.
+
+A MonitorEngine keeps the tasks waiting for a worker thread in a scheduler,
+which decides the order in which they are served. Each task has
+ - a priority (attribute priority, higher is served first), and
+ - a share (attribute share), the project the task works for. Tasks
+   with the same share compete with each other for a fair fraction of
+   the workers. Housekeeping tasks have share None.
+'''
+
+import heapq
+import itertools
+import time
+from collections import deque
+
+
+class Scheduler:
+    '''
+    Base class for schedulers. Schedulers are not thread-safe;
+    the monitor engine serializes access to them.
+    '''
+    def add(self, task):
+        '''Add a task.'''
+        raise NotImplementedError
+
+    def pop(self):
+        '''Remove and return the next task to execute. The scheduler must not be empty.'''
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def tasks(self):
+        '''Return the list of the queued tasks, in the order they will be served.'''
+        raise NotImplementedError
+
+
+
+class FifoScheduler(Scheduler):
+    '''
+    Serves tasks in the order they were added.
+    '''
+    def __init__(self):
+        self.queue = deque()
+
+    def add(self, task):
+        self.queue.append(task)
+
+    def pop(self):
+        return self.queue.popleft()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def tasks(self):
+        return list(self.queue)
+
+
+
+class FairShareScheduler(Scheduler):
+    '''
+    Serves tasks by priority, dividing the service fairly among shares,
+    with aging.
+
+    Fairness is by start-time fair queueing: the tasks of each share are
+    given consecutive virtual start times, never earlier than the start
+    time of the task last served. Thus, a share with 200 tasks queued gets
+    its turn as often as a share with a single task, not 200 times as often.
+    The key of a task is its virtual start time, less its priority, plus
+    agingRate times the (wall clock) time it was added: a task waiting for
+    1/agingRate seconds gains one priority level over newer tasks.
+    Tasks with equal keys are served in the order they were added.
+
+    Adding and popping a task take O(log n) time, for n queued tasks.
+    '''
+    def __init__(self, agingRate=1/60, clock=time.monotonic):
+        self.agingRate = agingRate
+        self.clock = clock
+        self.epoch = clock()
+        self.heap = []
+        self.counter = itertools.count()
+        # the virtual start time of the task last served
+        self.vtime = 0.0
+        # the virtual finish time of the last task added, for each share with tasks queued
+        self.finish = {}
+        # the number of queued tasks, for each share
+        self.queued = {}
+
+    def add(self, task):
+        share = getattr(task, 'share', None)
+        start = max(self.vtime, self.finish.get(share, 0.0))
+        self.finish[share] = start + 1.0
+        self.queued[share] = self.queued.get(share, 0) + 1
+
+        key = start - getattr(task, 'priority', 0) + self.agingRate * (self.clock() - self.epoch)
+        heapq.heappush(self.heap, (key, next(self.counter), start, share, task))
+
+    def pop(self):
+        key, seq, start, share, task = heapq.heappop(self.heap)
+        self.vtime = max(self.vtime, start)
+        self.queued[share] -= 1
+        if self.queued[share] == 0:
+            # an idle share does not keep its place
+            del self.queued[share]
+            del self.finish[share]
+        return task
+
+    def __len__(self):
+        return len(self.heap)
+
+    def tasks(self):
+        return [entry[-1] for entry in sorted(self.heap, key=lambda entry: entry[:2])]
+
+
+
+def job_priority(value, limit):
+    '''
+    Return the priority given by value (e.g., a field of a simulation object), an
+    integer limited to [-limit, limit], or 0 if value is missing or not an integer.
+    '''
+    try:
+        priority = int(value)
+    except (TypeError, ValueError):
+        return 0
+    return max(-limit, min(priority, limit))
+
+
+
+# The available schedulers, by name (see runner.config.monitor_scheduler)
+SCHEDULERS = {
+    'fifo': FifoScheduler,
+    'fairshare': FairShareScheduler
+}
+
+
+def create_scheduler(name):
+    '''Return a new scheduler of the given name.'''
+    try:
+        return SCHEDULERS[name]()
+    except KeyError:
+        raise ValueError("Unknown task scheduler: %s" % name)
@@ -7,7 +7,7 @@ Created on Mar 4, 2014
 @author: vsam
 '''
 
-from runner.DAO import check_database, JobDao, JobStatus, ExecutorDao, UserDao
+from runner.DAO import check_database, JobDao, JobStatus, ExecutorDao, UserDao, JobListener
 from psycopg2 import IntegrityError, InternalError
 from psycopg2.pool import ThreadedConnectionPool
 from models.aaa import User
@@ -131,3 +131,19 @@ def test_UserDao(pg_pool):
     dao.delete_user('foo')
     assert len(list(dao.get_users())) == 1
 
+
+def test_JobListener(pg_pool):
+    listener = JobListener(pg_testdb)
+    dao = JobDao(pg_pool)
+    try:
+        assert listener.wait(0) == []
+
+        dao.submit_new_job('local', '/notified')
+        job = dao.get_job_by_fileloc('/notified')
+        assert listener.wait(5) == [job.jobid]
+
+        dao.transition_job_status(job, JobStatus.PREPARED)
+        assert listener.wait(5) == [job.jobid]
+    finally:
+        dao.release()
+        listener.close()
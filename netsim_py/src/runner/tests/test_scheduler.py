@@ -0,0 +1,73 @@
+'''
+Tests for the task schedulers of the monitor engines
+'''
+
+import pytest
+from types import SimpleNamespace
+from runner.scheduler import FifoScheduler, FairShareScheduler, create_scheduler, job_priority
+
+
+def task(name, share=None, priority=0):
+    return SimpleNamespace(name=name, share=share, priority=priority)
+
+
+def drain(sched):
+    names = []
+    while len(sched):
+        names.append(sched.pop().name)
+    return names
+
+
+def test_fifo_scheduler():
+    sched = FifoScheduler()
+    for name in "abc":
+        sched.add(task(name))
+    assert [t.name for t in sched.tasks()] == ["a", "b", "c"]
+    assert drain(sched) == ["a", "b", "c"]
+
+
+def test_fair_share():
+    sched = FairShareScheduler(clock=lambda: 0)
+    for i in range(4):
+        sched.add(task("sweep%d" % i, share="p1"))
+    sched.add(task("other", share="p2"))
+    sched.add(task("urgent", share="p1", priority=10))
+
+    order = [t.name for t in sched.tasks()]
+    assert drain(sched) == order
+    # one task of the share with many tasks queued does not delay the other share
+    assert order == ["urgent", "sweep0", "other", "sweep1", "sweep2", "sweep3"]
+
+    # an idle share starts over, after the tasks already served
+    for i in range(3):
+        sched.add(task("sweep%d" % i, share="p1"))
+    sched.pop()
+    sched.add(task("late", share="p2"))
+    assert drain(sched) == ["late", "sweep1", "sweep2"]
+
+
+def test_aging():
+    now = [0]
+    sched = FairShareScheduler(agingRate=1, clock=lambda: now[0])
+    sched.add(task("old", share="p1"))
+    now[0] = 5
+    sched.add(task("important", share="p2", priority=3))
+    sched.add(task("very important", share="p3", priority=10))
+    assert drain(sched) == ["very important", "old", "important"]
+
+
+def test_create_scheduler():
+    assert isinstance(create_scheduler("fifo"), FifoScheduler)
+    with pytest.raises(ValueError):
+        create_scheduler("lottery")
+
+
+def test_job_priority():
+    assert job_priority(3, 10) == 3
+    assert job_priority("-2", 10) == -2
+    # out of range
+    assert job_priority(10**9, 10) == 10
+    assert job_priority(-10**9, 10) == -10
+    # invalid
+    for value in (None, "urgent", "1.5", [1]):
+        assert job_priority(value, 10) == 0
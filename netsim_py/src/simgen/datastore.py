@@ -76,7 +76,7 @@ class DataStore:
 
     def put_root_object(self, sim):
         """Update root object with the fields of the passed sim, which must be a
-        map-like object."""
+        map-like object. May return the saved object (e.g., with a new revision)."""
         raise NotImplementedError
 
     def update_root_object(self, newsim=(), **kwargs):
@@ -88,8 +88,16 @@ class DataStore:
         """
         sim = self.get_root_object()
         sim.update(newsim, **kwargs)
-        self.put_root_object(sim)
-        return sim
+        saved = self.put_root_object(sim)
+        return sim if saved is None else saved
+
+    def put_root_attachment(self, name, data, content_type, rev):
+        """Attach data (bytes, or a file-like object which is streamed) to the root
+        object, under the given name. rev is the current revision of the root object.
+
+        Returns the new revision of the root object.
+        """
+        raise NotImplementedError
 
     def get(self, entity, oid):
         """Retrieve plan for the given oid"""
@@ -132,7 +140,16 @@ class ProjectRepoStore(DataStore):
         
     def put_root_object(self, sim):
         """Save the root object sim."""
-        self.simdb.save(sim)
+        return self.simdb.save(sim)
+
+    def put_root_attachment(self, name, data, content_type, rev):
+        """Upload an attachment of the root object, with a request of its own.
+        Raises dpcmrepo.Conflict if rev is not the current revision."""
+        # unlike Database.put_attachment, this does not fetch the whole object
+        # again; the new revision is in the response
+        resp, result = self.simdb.resource(self.sim_id).put(name, data=data, params={'rev': rev},
+                                                              headers={'Content-Type': content_type})
+        return result['rev']
 
 
     def get_attached_file(self, entity, obj, attached):